@@ -1,35 +1,104 @@
-from aqt import gui_hooks, mw
-from aqt.qt import QAction
+try:
+    from aqt import mw
+except ImportError:
+    # Imported without Anki's GUI, e.g. by the command-line tool (cli.py).
+    mw = None
 
-# --- Import your addon's components ---
-from .hooks import add_editor_button, on_webview_message
-from .save_handler import on_editor_will_save_note
-from . import field_check_manager
-from . import config
-from . import config_actions
-from .config_dialog import show_config_dialog
+# --- Lazy handlers ---
+# Only the cheap modules that are needed right away are imported at startup.
+# Everything else (the dialogs, template handling, BeautifulSoup, ...) is
+# imported the first time it is actually used, so the add-on adds almost
+# nothing to Anki's startup time.
+# These thin wrappers import the real implementation on first use.
+# Python caches the import, so later calls only pay for a dict lookup.
 
-# --- Load the configuration on startup ---
-config.load_config()
+def on_editor_did_init_buttons(buttons: list, editor):
+    from .hooks import add_editor_button
+    return add_editor_button(buttons, editor)
 
-# --- Register all the hooks for the add-on ---
-# Adds the CodeMirror button to the editor
-gui_hooks.editor_did_init_buttons.append(add_editor_button)
+def on_webview_did_receive_js_message(handled: tuple[bool, object], message: str, context: object):
+    # Messages from other webviews (reviewer, deck browser, ...) don't concern
+    # us, so don't even import the editor hooks for them.
+    if not message.startswith("edit_code:"):
+        return handled
+    from .hooks import on_webview_message
+    return on_webview_message(handled, message, context)
 
-# Handles double-click events to edit a code block
-gui_hooks.webview_did_receive_js_message.append(on_webview_message)
+def on_add_cards_will_add_note(problem, note):
+    from .save_handler import on_editor_will_save_note
+    return on_editor_will_save_note(problem, note)
 
-# Cleans the HTML before a note is saved
-gui_hooks.add_cards_will_add_note.append(on_editor_will_save_note)
+def on_profile_did_open():
+    from .template_manager import check_template_injections
+    from .config_actions import schedule_media_cleanup
+    check_template_injections()
+    schedule_media_cleanup()
 
-# --- Apply the field check bypass patch (so cloze cards can be added) ---
-field_check_manager.apply_field_check_patch()
+def on_operation_did_execute(changes, handler):
+    # Only note type changes (template edits, deck imports, ...) can drop the injection.
+    if not changes.notetype:
+        return
+    from .template_manager import check_template_injections
+    check_template_injections()
 
-mw.addonManager.setConfigAction(__name__, config_actions.open_styles_folder)
-# --- Add the unified configuration menu item ---
-action_config = QAction("CodeMirror Configuration...", mw)
-action_config.triggered.connect(show_config_dialog)
-mw.form.menuTools.addAction(action_config)
+def on_open_styles_folder():
+    from .config_actions import open_styles_folder
+    open_styles_folder()
 
-# Expose the user_files folder to the web view
-mw.addonManager.setWebExports(__name__, r"user_files/.*")
\ No newline at end of file
+def on_show_config_dialog():
+    from .config_dialog import show_config_dialog
+    show_config_dialog()
+
+def on_show_import_dialog():
+    from .import_dialog import show_import_dialog
+    show_import_dialog()
+
+def setup_addon():
+    """Loads the config and registers all hooks and menu items."""
+    from aqt import gui_hooks
+    from aqt.qt import QAction
+
+    from . import field_check_manager
+    from . import config
+    from . import render_stats
+
+    # --- Load the configuration on startup ---
+    config.load_config()
+
+    # --- Register all the hooks for the add-on ---
+    # Adds the CodeMirror button to the editor
+    gui_hooks.editor_did_init_buttons.append(on_editor_did_init_buttons)
+
+    # Handles double-click events to edit a code block
+    gui_hooks.webview_did_receive_js_message.append(on_webview_did_receive_js_message)
+
+    # Collects the render timings reported by the reviewer
+    gui_hooks.webview_did_receive_js_message.append(render_stats.on_webview_message)
+
+    # Cleans the HTML before a note is saved
+    gui_hooks.add_cards_will_add_note.append(on_add_cards_will_add_note)
+
+    # Repairs templates that lost the CodeMirror resources block
+    # (and cleans up unused media files a while later)
+    gui_hooks.profile_did_open.append(on_profile_did_open)
+    gui_hooks.operation_did_execute.append(on_operation_did_execute)
+
+    # --- Apply the cloze-aware field check (so cloze cards can be added) ---
+    field_check_manager.apply_field_check_patch()
+
+    mw.addonManager.setConfigAction(__name__, on_open_styles_folder)
+    # --- Add the unified configuration menu item ---
+    action_config = QAction("CodeMirror Configuration...", mw)
+    action_config.triggered.connect(on_show_config_dialog)
+    mw.form.menuTools.addAction(action_config)
+
+    # --- Add the bulk code importer menu item ---
+    action_import = QAction("Import Code into CodeMirror Cards...", mw)
+    action_import.triggered.connect(on_show_import_dialog)
+    mw.form.menuTools.addAction(action_import)
+
+    # Expose the user_files folder to the web view
+    mw.addonManager.setWebExports(__name__, r"user_files/.*")
+
+if mw is not None:
+    setup_addon()
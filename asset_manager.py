@@ -2,11 +2,16 @@
 # Its primary responsibilities are:
 # 1. Defining which assets the add-on requires.
 # 2. Syncing these assets from the add-on's installation folder to Anki's media folder. So mobile can render code as well
-# 3. Generating the necessary HTML to include these assets in Anki card templates.
+# 3. Generating the runtime config and the (stable) HTML that loads these assets in Anki card templates.
 
+import json
+import os
+import re
 from pathlib import Path
 
-from aqt import mw
+# Nothing from aqt is imported here: every function works on the collection
+# it is given, so the command-line tool (cli.py) can use it without Anki's GUI.
+from . import config
 from . import utils
 
 # --- Asset Definition ---
@@ -15,6 +20,7 @@ from . import utils
 
 CSS_FILES = [
     "codemirror/lib/codemirror.css",
+    "codemirror/addon/merge/merge.css",
     "styles/reviewer_style.css",
 ]
 
@@ -33,10 +39,24 @@ JS_FILES = [
     "scripts/reviewer_script.js",
 ]
 
+# Files used by the Web Worker that tokenises big snippets in the reviewer.
+# They are synced to the media folder but not loaded into the page itself.
+WORKER_FILE = "scripts/tokenizer_worker.js"
+WORKER_RUNMODE_FILE = "codemirror/addon/runmode/runmode-standalone.js"
+
+# The asset that loads everything else on a card.
+LOADER_FILE = "scripts/loader.js"
+
 # A unique prefix for all assets copied to the media folder.
 # This is crucial to prevent filename conflicts with other add-ons or user media.
 PREFIX = "_codemirror_anki_"
 
+# Generated file holding everything that may change between syncs (theme, file list, settings).
+RUNTIME_CONFIG_FILENAME = f"{PREFIX}runtime.js"
+
+# Finds the names of prefixed media files in templates and note type CSS.
+MEDIA_REFERENCE = re.compile(re.escape(PREFIX) + r"[\w.\-]+")
+
 
 def get_prefixed_filename(path: Path) -> str:
     """
@@ -46,105 +66,235 @@ def get_prefixed_filename(path: Path) -> str:
     return f"{PREFIX}{path.name}"
 
 
-def _sync_file(source_path: Path, media_dir: Path):
-    """
-    Core logic for syncing a single asset file to Anki's media folder.
+def _collection(col=None):
+    """The collection to work on: the one given (headless use) or the one open in Anki."""
+    if col is not None:
+        return col
+    from aqt import mw
+    return mw.col
 
-    This function implements a "delete-then-write" strategy to ensure assets are
-    always up-to-date and to work around Anki's media hashing behavior. Anki
-    may create files with a hash in the name (e.g., 'style-abc123.css') if it
-    detects content changes. To prevent accumulation of old, hashed files, this
-    function proactively removes all variants of the target file before writing
-    the new version.
-    """
-    if not source_path.exists():
-        return
 
-    prefixed_name = get_prefixed_filename(source_path)
+def _remove_variants(prefixed_name: str, col):
+    """
+    Removes every version of a media file, including the hashed copies Anki
+    creates (e.g. 'style-<sha1>.css') when it detects content changes.
+    """
+    media_dir = Path(col.media.dir())
     base_name = Path(prefixed_name).stem
     extension = Path(prefixed_name).suffix
 
-    # Create a glob pattern to find all existing versions of the asset.
-    # e.g., for '_codemirror_anki_reviewer_style.css', the pattern is
-    # '_codemirror_anki_reviewer_style*.css' to match hashed versions.
-    glob_pattern = f"{base_name}*{extension}"
-    
+    # Anki names a copy '<name>-<sha1 of the content><extension>'. Only that
+    # form is matched, so other assets that share the start of the name
+    # (e.g. 'runmode-standalone.js' for 'runmode.js') are left alone.
+    variant_pattern = re.compile(re.escape(base_name) + r"(?:-[0-9a-f]{40})?" + re.escape(extension))
+
     # Use standard Pathlib to glob for files on the filesystem, which is more
     # stable across different Anki versions than relying on internal media DB methods.
-    files_on_disk = media_dir.glob(glob_pattern)
-    filenames_to_remove = [p.name for p in files_on_disk]
+    files_on_disk = media_dir.glob(f"{base_name}*{extension}")
+    filenames_to_remove = [p.name for p in files_on_disk if variant_pattern.fullmatch(p.name)]
 
     # If any old versions are found, use Anki's API to remove them.
     # This ensures they are properly removed from the media database as well.
     if filenames_to_remove:
-        mw.col.media.trash_files(filenames_to_remove)
+        col.media.trash_files(filenames_to_remove)
+
+
+def _write_media_file(prefixed_name: str, data: bytes, col):
+    """
+    Writes data to the media folder under prefixed_name.
 
-    # Read the new file's content and write it using Anki's media API.
-    # mw.col.media.write_data handles adding the file to the media database
+    This function implements a "delete-then-write" strategy to ensure assets are
+    always up-to-date and to work around Anki's media hashing behavior. If the
+    file on disk already has exactly this content, nothing is touched, so
+    unchanged assets are not re-synced to every device.
+    """
+    existing_path = Path(col.media.dir()) / prefixed_name
+    if existing_path.exists() and existing_path.stat().st_size == len(data):
+        if existing_path.read_bytes() == data:
+            return
+
+    _remove_variants(prefixed_name, col)
+
+    # col.media.write_data handles adding the file to the media database
     # and marking it for synchronization with AnkiWeb.
-    data = source_path.read_bytes()
-    mw.col.media.write_data(prefixed_name, data)
+    col.media.write_data(prefixed_name, data)
+
+
+def _sync_file(source_path: Path, col):
+    """
+    Core logic for syncing a single asset file to Anki's media folder.
+    """
+    if not source_path.exists():
+        return
+
+    prefixed_name = get_prefixed_filename(source_path)
+    _write_media_file(prefixed_name, source_path.read_bytes(), col)
+
 
+def _static_asset_files() -> list:
+    """All asset files that are copied to the media folder as they are."""
+    return CSS_FILES + JS_FILES + [LOADER_FILE, WORKER_FILE, WORKER_RUNMODE_FILE]
 
-def sync_assets_to_media_folder():
+
+def sync_assets_to_media_folder(col=None):
     """
-    Iterates through all defined CSS and JS assets and syncs them
-    to the media folder using the _sync_file helper.
+    Iterates through all defined CSS and JS assets (and the loader and worker
+    files) and syncs them to the media folder using the _sync_file helper.
     """
-    media_dir = Path(mw.col.media.dir())
+    col = _collection(col)
     addon_dir = utils.USER_FILES_PATH
-    files_to_sync = CSS_FILES + JS_FILES
 
-    for relative_path_str in files_to_sync:
+    for relative_path_str in _static_asset_files():
         source_path = addon_dir / relative_path_str
-        _sync_file(source_path, media_dir)
+        _sync_file(source_path, col)
 
 
-def sync_theme_to_media_folder(theme_name: str):
+def get_theme_css(theme_name: str) -> str:
+    """Reads the CSS of a CodeMirror theme shipped with the add-on."""
+    theme_path = utils.USER_FILES_PATH / "codemirror" / "theme" / f"{theme_name}.css"
+    if not theme_path.exists():
+        return ""
+    return theme_path.read_text(encoding="utf-8")
+
+
+def get_runtime_config(theme_name: str) -> dict:
     """
-    Syncs a single, dynamically chosen CodeMirror theme file to the media folder.
+    Builds the settings the loader reads on every card: the theme (and its
+    CSS), the (prefixed) CSS and JS files to load, in order, and the settings
+    for the tokenizer worker used by reviewer_script.js.
     """
-    media_dir = Path(mw.col.media.dir())
-    theme_path = utils.USER_FILES_PATH / "codemirror" / "theme" / f"{theme_name}.css"
-    _sync_file(theme_path, media_dir)
+    styles = [get_prefixed_filename(Path(file)) for file in CSS_FILES]
+    scripts = [get_prefixed_filename(Path(file)) for file in JS_FILES]
+
+    # The worker needs the standalone runMode plus every mode file (meta.js is
+    # only a list of modes, the worker doesn't need it).
+    worker_scripts = [get_prefixed_filename(Path(WORKER_RUNMODE_FILE))]
+    worker_scripts += [
+        get_prefixed_filename(Path(file)) for file in JS_FILES
+        if file.startswith("codemirror/mode/") and not file.endswith("/meta.js")
+    ]
+
+    return {
+        "theme": theme_name,
+        # The theme's CSS travels inside the runtime config, so a theme switch is
+        # still a single file write and exported decks always carry their theme.
+        "themeCss": get_theme_css(theme_name),
+        "styles": styles,
+        "scripts": scripts,
+        "worker": get_prefixed_filename(Path(WORKER_FILE)),
+        "workerScripts": worker_scripts,
+        "workerThreshold": config.CONFIG.get(config.CONFIG_KEY_WORKER_THRESHOLD, 20000),
+        "collectRenderStats": config.CONFIG.get(config.CONFIG_KEY_COLLECT_RENDER_STATS, True),
+    }
+
+
+def write_runtime_config(theme_name: str, col=None):
+    """
+    Writes the small runtime config file the loader reads. This is the only
+    media file that changes when the user picks another theme.
+    """
+    runtime_config = json.dumps(get_runtime_config(theme_name))
+    data = f"window.CODE_MIRROR_RUNTIME = {runtime_config};\n".encode("utf-8")
+    _write_media_file(RUNTIME_CONFIG_FILENAME, data, _collection(col))
+
+
+def apply_theme(theme_name: str, col=None):
+    """
+    Switches the theme used on cards without touching any card template.
+    """
+    write_runtime_config(theme_name, col)
+
+
+def build_resources_html() -> str:
+    """
+    Builds the HTML block that is injected into Anki card templates.
 
+    The block only runs the loader, which never changes. The loader reads the
+    runtime config and adds the actual CSS and JS files, so the block stays
+    identical across theme changes and templates don't have to be rewritten
+    (which would force a full sync of the note types).
 
-def get_mobile_resources_html(theme_name: str) -> str:
+    Every other media file is listed in an inert <template> as well. Browsers
+    never load anything from a <template>, but Anki sees the references and
+    includes the files when a deck is exported as .apkg.
+
+    The block is written exactly the way BeautifulSoup serialises it (attributes
+    in alphabetical order, void tags closed with "/>"). template_manager stores
+    it with BeautifulSoup, so this is what ends up in the templates, and a plain
+    substring test finds it again.
     """
-    Generates an HTML block containing <link> and <script> tags for all assets.
+    loader_filename = get_prefixed_filename(Path(LOADER_FILE))
+    referenced_files = [get_prefixed_filename(Path(file)) for file in _static_asset_files() if file != LOADER_FILE]
+    referenced_files.append(RUNTIME_CONFIG_FILENAME)
+    references = "".join(
+        f'<link href="{filename}" rel="stylesheet"/>' if filename.endswith(".css") else f'<script src="{filename}"></script>'
+        for filename in referenced_files
+    )
+
+    # It's wrapped in a hidden div so template_manager can find it again.
+    return (
+        f'<div id="{PREFIX}resources" style="display: none;">'
+        f'<script src="{loader_filename}"></script>'
+        f'<template>{references}</template>'
+        f'</div>'
+    )
 
-    This block is intended to be injected into Anki card templates. It ensures that
-    the necessary CSS and JS are loaded during card review.
+
+def get_mobile_resources_html(theme_name: str, col=None) -> str:
+    """
+    Syncs all assets and the runtime config for theme_name, then returns the
+    HTML block for the card templates (see build_resources_html).
     """
     # Trigger a sync every time this is called. This ensures that if the user
     # changes a file or theme, the changes are immediately reflected in the
     # media folder without needing an Anki restart.
-    sync_assets_to_media_folder()
-    sync_theme_to_media_folder(theme_name)
-    
-    # Build the <link> tags for the CSS files.
-    css_links = ""
-    for file in CSS_FILES:
-        filename = get_prefixed_filename(Path(file))
-        css_links += f'<link rel="stylesheet" type="text/css" href="{filename}">'
-    
-    # Add the link for the currently selected theme.
-    theme_filename = get_prefixed_filename(Path(f"{theme_name}.css"))
-    css_links += f'<link rel="stylesheet" type="text/css" href="{theme_filename}">'
-
-    # Build the <script> tags for the JavaScript files.
-    js_links = ""
-    for file in JS_FILES:
-        filename = get_prefixed_filename(Path(file))
-        js_links += f'<script src="{filename}"></script>'
-
-    # Assemble the final HTML block. It's wrapped in a hidden div.
-    # A global JS variable is also created to pass the theme name to the scripts.
-    return f"""
-    <div id="{PREFIX}resources" style="display: none;">
-        {css_links}
-        <script>window.CODE_MIRROR_GLOBAL_THEME = "{theme_name}";</script>
-        {js_links}
-    </div>
+    sync_assets_to_media_folder(col)
+    apply_theme(theme_name, col)
+    return build_resources_html()
+
+
+# --- Media clean-up ---
+
+def expected_media_files() -> set:
+    """The names of every media file the current version of the add-on writes."""
+    names = {get_prefixed_filename(Path(file)) for file in _static_asset_files()}
+    names.add(RUNTIME_CONFIG_FILENAME)
+    return names
+
+
+def referenced_media_files(col) -> set:
+    """
+    The prefixed names mentioned in any note type's templates or CSS. These are
+    kept even if the add-on doesn't use them anymore (e.g. the theme files that
+    older versions linked directly), so no card loses its styling.
+    """
+    names = set()
+    for model in col.models.all():
+        names.update(MEDIA_REFERENCE.findall(model['css']))
+        for template in model['tmpls']:
+            names.update(MEDIA_REFERENCE.findall(template['qfmt']))
+            names.update(MEDIA_REFERENCE.findall(template['afmt']))
+    return names
+
+
+def collect_garbage(col=None) -> list:
+    """
+    Moves every media file with the add-on's prefix that is neither a current
+    asset nor referenced by a note type to Anki's media trash: themes that were
+    selected once, hashed copies of old assets, files of removed assets, ...
+
+    The media folder is scanned once and everything is trashed in a single call.
+    Returns the names of the trashed files.
     """
+    col = _collection(col)
+    live_names = expected_media_files() | referenced_media_files(col)
+
+    with os.scandir(col.media.dir()) as entries:
+        stale_names = [
+            entry.name for entry in entries
+            if entry.name.startswith(PREFIX) and entry.name not in live_names and entry.is_file()
+        ]
 
+    if stale_names:
+        col.media.trash_files(stale_names)
+    return stale_names
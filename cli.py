@@ -0,0 +1,179 @@
+# This is the command-line tool for building shared decks without Anki's GUI (e.g. in CI).
+# It only needs the 'anki' and 'beautifulsoup4' packages, no Qt:
+#
+#   pip install anki beautifulsoup4
+#   python -m <add-on folder>.cli input.apkg output.apkg --theme dracula
+#
+# (run it from the folder that contains the add-on folder)
+#
+# The package is opened in a temporary collection. Then the tool:
+# 1. Streams the notes through the same code-block normalisation the editor uses (save_handler).
+# 2. Injects the resources block into the templates (template_manager).
+# 3. Adds the assets and the runtime config to the media folder (asset_manager).
+# 4. Removes stale add-on files (old themes, old asset versions) from the media folder.
+# 5. Writes the package back.
+# Notes are read and written in batches, so memory stays bounded for huge packages.
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+from . import asset_manager
+from . import save_handler
+from . import template_manager
+
+# How many notes are loaded and saved at once.
+NOTE_BATCH_SIZE = 500
+
+PACKAGE_SUFFIXES = (".apkg", ".colpkg")
+
+
+def open_package(package: Path, workdir: Path):
+    """Imports package into a new collection inside workdir and returns it."""
+    from anki.collection import Collection, ImportAnkiPackageOptions, ImportAnkiPackageRequest
+
+    col_path = workdir / "collection.anki2"
+    if package.suffix.lower() == ".colpkg":
+        # A .colpkg replaces the whole collection, which has to be closed for that.
+        col = Collection(str(col_path))
+        backend = col._backend
+        col.close()
+        backend.import_collection_package(
+            col_path=str(col_path),
+            backup_path=str(package),
+            media_folder=str(workdir / "collection.media"),
+            media_db=str(workdir / "collection.media.db"),
+        )
+        return Collection(str(col_path))
+
+    col = Collection(str(col_path))
+    col.import_anki_package(ImportAnkiPackageRequest(
+        package_path=str(package),
+        options=ImportAnkiPackageOptions(with_scheduling=True, with_deck_configs=True),
+    ))
+    return col
+
+
+def write_package(col, output: Path):
+    """Exports the whole collection (with media) to output."""
+    if output.suffix.lower() == ".colpkg":
+        col.export_collection_package(str(output), include_media=True, legacy=False)
+        return
+
+    from anki.collection import ExportAnkiPackageOptions
+    col.export_anki_package(
+        out_path=str(output),
+        options=ExportAnkiPackageOptions(
+            with_scheduling=True, with_deck_configs=True, with_media=True, legacy=False
+        ),
+        limit=None,
+    )
+
+
+def normalize_notes(col) -> int:
+    """
+    Replaces the editor's rich code blocks with the lightweight spans in every
+    note, NOTE_BATCH_SIZE notes at a time. Returns the number of changed notes.
+    """
+    changed_count = 0
+    last_id = 0
+    while True:
+        # Only notes that contain an editor block are loaded at all.
+        note_ids = col.db.list(
+            "SELECT id FROM notes WHERE id > ? AND flds LIKE ? ORDER BY id LIMIT ?",
+            last_id, f"%{save_handler.EDITOR_BLOCK_CLASS}%", NOTE_BATCH_SIZE,
+        )
+        if not note_ids:
+            break
+        last_id = note_ids[-1]
+
+        changed_notes = []
+        for note_id in note_ids:
+            note = col.get_note(note_id)
+            fields = [save_handler.normalize_field_html(value) for value in note.fields]
+            if fields != note.fields:
+                note.fields = fields
+                changed_notes.append(note)
+        if changed_notes:
+            col.update_notes(changed_notes)
+            changed_count += len(changed_notes)
+    return changed_count
+
+
+def find_code_model_ids(col) -> list:
+    """Returns the ids of all note types that have at least one code block."""
+    return col.db.list(
+        "SELECT DISTINCT mid FROM notes WHERE flds LIKE ?",
+        f"%{save_handler.CODE_SPAN_CLASS}%",
+    )
+
+
+def inject_models(col, model_ids: list, theme_name: str) -> int:
+    """
+    Syncs the assets into the collection's media folder and injects the
+    resources block into the given note types. Returns the number of changed note types.
+    """
+    resources_html = asset_manager.get_mobile_resources_html(theme_name, col)
+    changed_count = 0
+    for model_id in model_ids:
+        model = col.models.get(model_id)
+        if model and template_manager.inject_into_model(model, resources_html, True):
+            col.models.update_dict(model)
+            changed_count += 1
+    return changed_count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Prepare an Anki package for CodeMirror code blocks without Anki's GUI."
+    )
+    parser.add_argument("input", type=Path, help="the .apkg or .colpkg file to read")
+    parser.add_argument("output", type=Path, help="the .apkg or .colpkg file to write")
+    parser.add_argument("--theme", default="dracula", help="the CodeMirror theme used on the cards (default: dracula)")
+    parser.add_argument(
+        "--note-type", action="append", dest="note_types", metavar="NAME",
+        help="inject into this note type (can be repeated). "
+             "By default every note type with code blocks is injected."
+    )
+    args = parser.parse_args(argv)
+
+    for path in (args.input, args.output):
+        if path.suffix.lower() not in PACKAGE_SUFFIXES:
+            parser.error(f"{path} is not an .apkg or .colpkg file")
+    if not args.input.exists():
+        parser.error(f"{args.input} does not exist")
+    if not asset_manager.get_theme_css(args.theme):
+        parser.error(f"unknown theme: {args.theme}")
+
+    with tempfile.TemporaryDirectory(prefix="codemirror_anki_") as workdir:
+        col = open_package(args.input.resolve(), Path(workdir))
+        try:
+            changed_notes = normalize_notes(col)
+            print(f"Normalised code blocks in {changed_notes} notes.")
+
+            if args.note_types:
+                model_ids = []
+                for name in args.note_types:
+                    model = col.models.by_name(name)
+                    if not model:
+                        print(f"Note type not found: {name}", file=sys.stderr)
+                        return 1
+                    model_ids.append(model["id"])
+            else:
+                model_ids = find_code_model_ids(col)
+            changed_models = inject_models(col, model_ids, args.theme)
+            print(f"Injected CodeMirror into {changed_models} of {len(model_ids)} note types.")
+
+            trashed_names = asset_manager.collect_garbage(col)
+            print(f"Removed {len(trashed_names)} unused add-on media files.")
+
+            write_package(col, args.output.resolve())
+            print(f"Wrote {args.output}.")
+        finally:
+            col.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+# This script implements the bulk importer that turns real source trees and
+# Jupyter notebooks into CodeMirror cards.
+# It works as a stream:
+# 1. Source files are discovered one directory at a time (nothing is collected up front).
+# 2. Every file is split into units (whole file, top-level functions/classes or notebook cells).
+# 3. Units are turned into notes and added in batches, so memory stays bounded
+#    no matter how big the tree is.
+
+import ast
+import json
+import os
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from . import save_handler
+
+# --- Split modes ---
+SPLIT_FILES = "files"
+SPLIT_DEFINITIONS = "definitions"
+
+# Maps file extensions to the language ids used in starter_code.STARTER_CODE
+# and in the <select> of codemirror_index.html.
+EXTENSION_LANGUAGES = {
+    ".py": "python",
+    ".pyw": "python",
+    ".java": "text/x-java",
+    ".pde": "text/x-java",
+    ".c": "text/x-csrc",
+    ".h": "text/x-csrc",
+    ".cpp": "text/x-c++src",
+    ".cc": "text/x-c++src",
+    ".cxx": "text/x-c++src",
+    ".hpp": "text/x-c++src",
+    ".hh": "text/x-c++src",
+    ".js": "javascript",
+    ".mjs": "javascript",
+    ".cjs": "javascript",
+    ".rb": "ruby",
+    ".html": "htmlmixed",
+    ".htm": "htmlmixed",
+    ".css": "css",
+    ".kt": "text/x-kotlin",
+    ".kts": "text/x-kotlin",
+    ".sql": "sql",
+}
+
+# Maps notebook kernel languages (metadata.language_info.name) to language ids.
+NOTEBOOK_LANGUAGES = {
+    "python": "python",
+    "java": "text/x-java",
+    "c": "text/x-csrc",
+    "c++": "text/x-c++src",
+    "javascript": "javascript",
+    "ruby": "ruby",
+    "kotlin": "text/x-kotlin",
+    "sql": "sql",
+}
+
+NOTEBOOK_EXTENSION = ".ipynb"
+
+# Folders that never contain code worth learning from.
+SKIPPED_DIRECTORIES = {"__pycache__", "node_modules", "venv", "build", "dist", "target"}
+
+# Files bigger than this are skipped; they are almost always generated code
+# and would make unreadable cards anyway.
+MAX_FILE_BYTES = 512 * 1024
+
+# How many notes are handed to col.add_notes at once.
+BATCH_SIZE = 250
+
+
+class CodeUnit(NamedTuple):
+    """A single piece of code that becomes one note."""
+    title: str
+    language: str
+    code: str
+
+
+def iter_source_files(root: Path) -> Iterator[Path]:
+    """
+    Walks the tree below root and yields every file we know how to import.
+
+    Uses an explicit stack of os.scandir calls, so only the directory that is
+    currently being read is held in memory.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subdirectories = []
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIPPED_DIRECTORIES:
+                            subdirectories.append(Path(entry.path))
+                        continue
+                    extension = os.path.splitext(entry.name)[1].lower()
+                    if extension not in EXTENSION_LANGUAGES and extension != NOTEBOOK_EXTENSION:
+                        continue
+                    if entry.stat().st_size > MAX_FILE_BYTES:
+                        continue
+                    yield Path(entry.path)
+        except OSError as e:
+            print(f"CodeMirror Add-on: Could not read directory {directory}: {e}")
+            continue
+        # Reverse so the tree is visited in alphabetical order.
+        stack.extend(sorted(subdirectories, reverse=True))
+
+
+def _iter_python_definitions(source: str, title: str) -> Iterator[CodeUnit]:
+    """Yields every top-level function and class (including decorators) as its own unit."""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        # Not valid Python (e.g. Python 2 code), fall back to the whole file.
+        yield CodeUnit(title, "python", source)
+        return
+
+    lines = source.splitlines()
+    found_any = False
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        code = "\n".join(lines[start - 1:node.end_lineno])
+        found_any = True
+        yield CodeUnit(f"{title} :: {node.name}", "python", code)
+
+    if not found_any and source.strip():
+        yield CodeUnit(title, "python", source)
+
+
+def iter_notebook_units(path: Path, title: str) -> Iterator[CodeUnit]:
+    """Yields every non-empty code cell of a Jupyter notebook."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            notebook = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"CodeMirror Add-on: Could not read notebook {path}: {e}")
+        return
+
+    metadata = notebook.get("metadata", {})
+    kernel_language = (
+        metadata.get("language_info", {}).get("name")
+        or metadata.get("kernelspec", {}).get("language")
+        or "python"
+    )
+    language = NOTEBOOK_LANGUAGES.get(kernel_language.lower(), "python")
+
+    cells = notebook.get("cells", [])
+    # Free the parsed document as early as possible, only the cells are needed.
+    del notebook
+    for index, cell in enumerate(cells, start=1):
+        if cell.get("cell_type") != "code":
+            continue
+        source = cell.get("source", "")
+        if isinstance(source, list):
+            source = "".join(source)
+        if source.strip():
+            yield CodeUnit(f"{title} [cell {index}]", language, source)
+
+
+def iter_file_units(path: Path, split_mode: str, title: str) -> Iterator[CodeUnit]:
+    """Splits a single file into units according to split_mode."""
+    if path.suffix.lower() == NOTEBOOK_EXTENSION:
+        # Importing the raw notebook JSON is never useful, so notebooks are always split into cells.
+        yield from iter_notebook_units(path, title)
+        return
+
+    language = EXTENSION_LANGUAGES.get(path.suffix.lower())
+    if not language:
+        return
+    try:
+        source = path.read_text(encoding="utf-8")
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"CodeMirror Add-on: Skipping {path}: {e}")
+        return
+    if not source.strip():
+        return
+
+    if split_mode == SPLIT_DEFINITIONS and language == "python":
+        yield from _iter_python_definitions(source, title)
+    else:
+        yield CodeUnit(title, language, source)
+
+
+def iter_units(source: Path, split_mode: str) -> Iterator[CodeUnit]:
+    """
+    Yields all code units below source, which can be a directory or a single file.
+    Titles are paths relative to the imported folder.
+    """
+    if source.is_file():
+        yield from iter_file_units(source, split_mode, source.name)
+        return
+    for path in iter_source_files(source):
+        yield from iter_file_units(path, split_mode, path.relative_to(source).as_posix())
+
+
+def import_code_units(
+    col,
+    units: Iterator[CodeUnit],
+    model_id: int,
+    deck_id: int,
+    code_field: str,
+    title_field: Optional[str] = None,
+    want_cancel: Callable[[], bool] = lambda: False,
+    on_progress: Callable[[int], None] = lambda count: None,
+) -> int:
+    """
+    Consumes units and adds one note per unit to the collection.
+
+    Notes are added with col.add_notes in batches of BATCH_SIZE, so at most one
+    batch is alive at a time. Returns the number of added notes.
+    """
+    from anki.collection import AddNoteRequest
+
+    notetype = col.models.get(model_id)
+    added = 0
+    batch = []
+
+    def flush():
+        nonlocal added
+        if batch:
+            col.add_notes(batch)
+            added += len(batch)
+            batch.clear()
+            on_progress(added)
+
+    for unit in units:
+        if want_cancel():
+            break
+        note = col.new_note(notetype)
+        note[code_field] = save_handler.build_code_span(unit.code, unit.language)
+        if title_field:
+            note[title_field] = unit.title
+        batch.append(AddNoteRequest(note=note, deck_id=deck_id))
+        if len(batch) >= BATCH_SIZE:
+            flush()
+    flush()
+    return added
+
+
+def run_import(
+    parent,
+    source: Path,
+    split_mode: str,
+    model_id: int,
+    deck_id: int,
+    code_field: str,
+    title_field: Optional[str] = None,
+):
+    """
+    Runs the import as a background collection operation with a cancellable
+    progress window, so Anki stays responsive during huge imports.
+    All added notes are merged into a single undo step.
+    """
+    from aqt import mw
+    from aqt.operations import CollectionOp
+    from aqt.utils import tooltip
+
+    def on_progress(count: int):
+        mw.taskman.run_on_main(
+            lambda: mw.progress.update(label=f"Imported {count} code blocks...")
+        )
+
+    added_count = 0
+
+    def op(col):
+        nonlocal added_count
+        undo_position = col.add_custom_undo_entry("Import Code")
+        added_count = import_code_units(
+            col,
+            iter_units(source, split_mode),
+            model_id,
+            deck_id,
+            code_field,
+            title_field,
+            want_cancel=mw.progress.want_cancel,
+            on_progress=on_progress,
+        )
+        return col.merge_undoable_ops(undo_position)
+
+    # run_in_background shows Anki's progress window, on_progress fills in the label.
+    CollectionOp(parent=parent, op=op).success(
+        lambda _: tooltip(f"Imported {added_count} code blocks.", parent=parent)
+    ).run_in_background()
@@ -5,6 +5,7 @@
 
 import base64
 import json
+import html
 from bs4 import BeautifulSoup
 import time
 
@@ -16,6 +17,26 @@ from aqt.qt import QDialog, QVBoxLayout
 from . import config
 from . import utils
 from . import starter_code  # NEW: Import the starter code snippets
+from . import language_stats
+
+# The mode files every language of the dialog needs, in load order.
+# Only the modes of the likely languages are loaded when the dialog opens,
+# the others are loaded when the user switches to them (see loadMode in script.js).
+MODE_FILES = {
+    "python": ["codemirror/mode/python/python.js"],
+    "text/x-java": ["codemirror/mode/clike/clike.js"],
+    "text/x-csrc": ["codemirror/mode/clike/clike.js"],
+    "text/x-c++src": ["codemirror/mode/clike/clike.js"],
+    "text/x-kotlin": ["codemirror/mode/clike/clike.js"],
+    "javascript": ["codemirror/mode/javascript/javascript.js"],
+    "ruby": ["codemirror/mode/ruby/ruby.js"],
+    "css": ["codemirror/mode/css/css.js"],
+    "sql": ["codemirror/mode/sql/sql.js"],
+    "htmlmixed": [
+        "codemirror/mode/xml/xml.js", "codemirror/mode/javascript/javascript.js",
+        "codemirror/mode/css/css.js", "codemirror/mode/htmlmixed/htmlmixed.js",
+    ],
+}
 
 class CodeMirrorWebView(AnkiWebView):
     """
@@ -49,7 +70,7 @@ class CodeMirrorDialog(QDialog):
     This class sets up the window, loads the webview with the editor,
     and handles communication between the Python backend and the JavaScript frontend.
     """
-    def __init__(self, parent, editor: Editor, initial_code: str = "", block_id: str = None):
+    def __init__(self, parent, editor: Editor, initial_code: str = "", block_id: str = None, initial_before_code: str = ""):
         """
         Initializes the dialog.
         
@@ -58,11 +79,13 @@ class CodeMirrorDialog(QDialog):
             editor: An instance of Anki's editor, used to insert the final code.
             initial_code: Base64 encoded code to load if editing an existing block.
             block_id: The unique ID of the code block if editing.
+            initial_before_code: Base64 encoded "before" code if editing a diff block.
         """
         super().__init__(parent)
         self.editor = editor
         self.initial_code = initial_code
         self.block_id = block_id
+        self.initial_before_code = initial_before_code
 
         # --- Basic Window Setup ---
         self.setWindowTitle("Code Editor")
@@ -81,6 +104,10 @@ class CodeMirrorDialog(QDialog):
         # Load user preferences, like the theme and last-used language.
         self.active_theme = config.CONFIG.get(config.CONFIG_KEY_GLOBAL_THEME, 'dracula')
         last_lang = mw.col.conf.get("anki_codemirror_last_lang", "python")
+        likely_langs = self._likely_languages()
+        initial_lang = likely_langs[0] if likely_langs else last_lang
+        # The runner-up is loaded in the background once the dialog is idle.
+        preload_langs = [lang for lang in likely_langs[1:2] if lang != initial_lang]
         button_text = "Update Code" if self.block_id else "Insert Code"
 
         # Read the CSS content for the selected theme. This is needed later for
@@ -99,12 +126,17 @@ class CodeMirrorDialog(QDialog):
             "styles/styles.css"
         ]
         
+        # Only the modes of the initial language are loaded right away. Unknown
+        # languages (e.g. from an older version) get every mode, as before.
+        if initial_lang in MODE_FILES:
+            initial_mode_files = MODE_FILES[initial_lang]
+        else:
+            initial_mode_files = list(dict.fromkeys(file for files in MODE_FILES.values() for file in files))
+
         js_files = [
             "codemirror/lib/codemirror.js", "codemirror/addon/edit/closebrackets.js",
-            "codemirror/addon/edit/matchbrackets.js", "codemirror/keymap/vim.js", "codemirror/addon/dialog/dialog.js", "codemirror/mode/clike/clike.js",
-            "codemirror/mode/python/python.js", "codemirror/mode/javascript/javascript.js",
-            "codemirror/mode/ruby/ruby.js", "codemirror/mode/sql/sql.js", "codemirror/mode/css/css.js",
-            "codemirror/mode/xml/xml.js", "codemirror/mode/htmlmixed/htmlmixed.js", "scripts/script.js"
+            "codemirror/addon/edit/matchbrackets.js", "codemirror/keymap/vim.js", "codemirror/addon/dialog/dialog.js",
+            *initial_mode_files, "scripts/script.js"
         ]
         
         # --- HTML and Initial Data Injection ---
@@ -123,6 +155,14 @@ class CodeMirrorDialog(QDialog):
             except Exception:
                 textarea.string = "Error decoding code."
 
+        # Diff blocks open in diff mode with the "before" code in the second editor.
+        before_textarea = soup.find("textarea", {"id": "before-editor"})
+        if before_textarea and self.initial_before_code:
+            try:
+                before_textarea.string = base64.b64decode(self.initial_before_code).decode("utf-8")
+            except Exception:
+                before_textarea.string = "Error decoding code."
+
         body_content = soup.body.decode_contents() if soup.body else ""
 
         # Create a JavaScript configuration object to pass Python variables
@@ -130,9 +170,13 @@ class CodeMirrorDialog(QDialog):
         init_script = f"""<script>
             window.CM_CONFIG = {{
                 buttonText: {json.dumps(button_text)},
-                language: {json.dumps(last_lang)},
+                language: {json.dumps(initial_lang)},
+                preloadLanguages: {json.dumps(preload_langs)},
+                modeFiles: {json.dumps({lang: [f"{utils.WEB_PATH}/{file}" for file in files] for lang, files in MODE_FILES.items()})},
+                loadedModeFiles: {json.dumps([f"{utils.WEB_PATH}/{file}" for file in initial_mode_files])},
                 activeTheme: {json.dumps(self.active_theme)},
-                starterCode: {json.dumps(starter_code.STARTER_CODE)}
+                starterCode: {json.dumps(starter_code.STARTER_CODE)},
+                diffMode: {json.dumps(bool(self.initial_before_code))}
             }};
         </script>""" # MODIFIED: Added starterCode to the config object
 
@@ -141,6 +185,14 @@ class CodeMirrorDialog(QDialog):
         self.layout().addWidget(self.web)
 
 
+    def _likely_languages(self) -> list:
+        """The languages used most in the field being edited (see language_stats.py)."""
+        note = self.editor.note
+        field_index = self.editor.currentField
+        if note is None or field_index is None:
+            return []
+        return language_stats.likely_languages(mw.col, note.mid, note.keys()[field_index])
+
     def _on_bridge_cmd(self, cmd: str):
         """
         Handles commands sent from the JavaScript frontend via pycmd().
@@ -151,108 +203,168 @@ class CodeMirrorDialog(QDialog):
             mw.col.conf["anki_codemirror_last_lang"] = lang
             return
 
+        # Snippet search while typing in the snippet box. Only the matching
+        # snippets are sent back, the library itself stays on disk.
+        if cmd.startswith("search_snippets:"):
+            from . import snippet_library
+            _, request_id, lang, query = cmd.split(":", 3)
+            results = snippet_library.search(query, lang)
+            self.web.eval(f"window.showSnippetResults({json.dumps(int(request_id))}, {json.dumps(results)});")
+            return
+
         # Main command to insert or update the code block in the Anki editor.
         if cmd.startswith("insert_code:"):
-            # The JS sends the language, raw code, and syntax-highlighted HTML.
-            _, lang, encoded_raw, encoded_html = cmd.split(":", 3)
+            # The JS sends the language, raw code, syntax-highlighted HTML and
+            # the token render hint (see encodeTokenHint in script.js, may be empty).
+            _, lang, encoded_raw, encoded_html, encoded_tokens = cmd.split(":", 4)
             decoded_html = base64.b64decode(encoded_html).decode("utf-8")
-            
-            # Read the base CSS files needed to style the final code block.
-            cm_base_css = (utils.USER_FILES_PATH / "codemirror/lib/codemirror.css").read_text(encoding="utf-8")
-            
-            # Combine all necessary CSS to be injected into the Anki editor field.
-            css_to_inject = f"""
-                {cm_base_css}
-                {self.active_theme_css}
-                .anki-code-block {{
-                    display: inline-block;
-                    vertical-align: middle;
-                    height: auto;
-                    border-radius: 6px;
-                    padding: 4px 8px;
-                    padding-left: 2em;
-                    font-family: 'Fira Code', monospace;
-                    font-size: 16px;
-                    max-width: 100%;
-                    overflow-x: auto;
-                    text-align: left;
+            token_hint = base64.b64decode(encoded_tokens).decode("utf-8")
+
+            self._insert_or_update_block(
+                "anki-code-block",
+                {"data-raw-code": encoded_raw, "data-language": lang, "data-tokens": token_hint},
+                f'<div class="CodeMirror-code">{decoded_html}</div>',
+            )
+            return
+
+        # Same for a before/after pair in diff mode. The diff itself is
+        # computed when the note is saved (see save_handler.compute_diff).
+        if cmd.startswith("insert_diff:"):
+            _, lang, encoded_before, encoded_raw, encoded_before_html, encoded_html = cmd.split(":", 5)
+            decoded_before_html = base64.b64decode(encoded_before_html).decode("utf-8")
+            decoded_html = base64.b64decode(encoded_html).decode("utf-8")
+
+            self._insert_or_update_block(
+                "anki-code-block anki-code-diff",
+                {"data-raw-code": encoded_raw, "data-before-code": encoded_before, "data-language": lang},
+                f'<div class="CodeMirror-code anki-code-diff-before">{decoded_before_html}</div>'
+                f'<div class="CodeMirror-code">{decoded_html}</div>',
+            )
+            return
+
+    def _insert_or_update_block(self, block_class: str, data_attributes: dict, inner_html: str):
+        """
+        Inserts a new rich code block into the Anki editor field, or replaces the
+        one that is being edited, then closes the dialog.
+
+        Args:
+            block_class: The class(es) of the block, e.g. "anki-code-block".
+            data_attributes: The data-* attributes that save_handler reads later.
+            inner_html: The highlighted preview shown inside the editor field.
+        """
+        # Read the base CSS files needed to style the final code block.
+        cm_base_css = (utils.USER_FILES_PATH / "codemirror/lib/codemirror.css").read_text(encoding="utf-8")
+        
+        # Combine all necessary CSS to be injected into the Anki editor field.
+        css_to_inject = f"""
+            {cm_base_css}
+            {self.active_theme_css}
+            .anki-code-block {{
+                display: inline-block;
+                vertical-align: middle;
+                height: auto;
+                border-radius: 6px;
+                padding: 4px 8px;
+                padding-left: 2em;
+                font-family: 'Fira Code', monospace;
+                font-size: 16px;
+                max-width: 100%;
+                overflow-x: auto;
+                text-align: left;
+            }}
+            .anki-code-diff {{
+                display: inline-flex;
+                gap: 1.5em;
+            }}
+            .anki-code-diff-before {{
+                opacity: 0.6;
+            }}
+        """
+        theme_class = f"cm-s-{self.active_theme}"
+        full_class = f"{block_class} CodeMirror {theme_class}"
+        
+        self.editor.web.setFocus()
+
+        # --- Logic for Updating vs. Inserting ---
+        if self.block_id:
+            # --- UPDATE EXISTING BLOCK ---
+            # If a block_id exists, we are in editing mode.
+            # This JS will find the existing block by its ID and replace its
+            # attributes and content (the block may also switch between code and diff).
+            js_injector = f"""
+            (() => {{
+                const shadowRoot = document.activeElement?.shadowRoot;
+                if (!shadowRoot) return;
+                const block = shadowRoot.getElementById('{self.block_id}');
+                if (block) {{
+                    block.className = {json.dumps(full_class)};
+                    Array.from(block.attributes)
+                        .filter(attribute => attribute.name.startsWith('data-'))
+                        .forEach(attribute => block.removeAttribute(attribute.name));
+                    Object.entries({json.dumps(data_attributes)})
+                        .forEach(([name, value]) => block.setAttribute(name, value));
+                    block.innerHTML = {json.dumps(inner_html)};
                 }}
+            }})();
             """
+        else:
+            # --- INSERT NEW BLOCK ---
+            # If no block_id, we are inserting a new code block.
+            unique_id = f"code-block-{time.time_ns()}"
+            attributes_html = " ".join(
+                f'{name}="{html.escape(value)}"' for name, value in data_attributes.items()
+            )
             
-            self.editor.web.setFocus()
-
-            # --- Logic for Updating vs. Inserting ---
-            if self.block_id:
-                # --- UPDATE EXISTING BLOCK ---
-                # If a block_id exists, we are in editing mode.
-                # This JS will find the existing block by its ID and update its content.
-                js_injector = f"""
-                (() => {{
+            # Construct the HTML for the new code block.
+            # contenteditable="false" prevents direct editing in the Anki field.
+            # data-* attributes store the raw code and language for later editing.
+            html_to_insert = f"""
+            <span id="{unique_id}" 
+                  class="{full_class}" 
+                  contenteditable="false" 
+                  {attributes_html}>
+                {inner_html}
+            </span><br>
+            """
+            
+            # This complex JS blob is injected into the Anki editor's webview.
+            js_injector = f"""
+            (() => {{
+                setTimeout(() => {{
+                    if (window.selectionSaver) {{ window.selectionSaver.restore(); }}
+                    document.execCommand('insertHTML', false, {json.dumps(html_to_insert)});
                     const shadowRoot = document.activeElement?.shadowRoot;
                     if (!shadowRoot) return;
-                    const block = shadowRoot.getElementById('{self.block_id}');
-                    if (block) {{
-                        block.dataset.rawCode = {json.dumps(encoded_raw)};
-                        block.dataset.language = {json.dumps(lang)};
-                        block.querySelector('.CodeMirror-code').innerHTML = {json.dumps(decoded_html)};
+                    
+                    // Attach a double-click listener to the editor field, but only once.
+                    if (!window.ankiCodeBlockListenerAttached) {{
+                        shadowRoot.addEventListener('dblclick', (event) => {{
+                            const codeBlock = event.target.closest('.anki-code-block');
+                            if (codeBlock) {{
+                                // If a code block is double-clicked, send a command back
+                                // to Python to open the editor dialog again.
+                                // Diff blocks also send their "before" code.
+                                const beforeCode = codeBlock.dataset.beforeCode ? `:${{codeBlock.dataset.beforeCode}}` : '';
+                                pycmd(`edit_code:${{codeBlock.id}}:${{codeBlock.dataset.rawCode}}${{beforeCode}}`);
+                            }}
+                        }});
+                        window.ankiCodeBlockListenerAttached = true;
                     }}
-                }})();
-                """
-            else:
-                # --- INSERT NEW BLOCK ---
-                # If no block_id, we are inserting a new code block.
-                unique_id = f"code-block-{time.time_ns()}"
-                theme_class = f"cm-s-{self.active_theme}"
-                
-                # Construct the HTML for the new code block.
-                # contenteditable="false" prevents direct editing in the Anki field.
-                # data-* attributes store the raw code and language for later editing.
-                html_to_insert = f"""
-                <span id="{unique_id}" 
-                      class="anki-code-block CodeMirror {theme_class}" 
-                      contenteditable="false" 
-                      data-raw-code="{encoded_raw}"
-                      data-language="{lang}">
-                    <div class="CodeMirror-code">{decoded_html}</div>
-                </span><br>
-                """
-                
-                # This complex JS blob is injected into the Anki editor's webview.
-                js_injector = f"""
-                (() => {{
-                    setTimeout(() => {{
-                        if (window.selectionSaver) {{ window.selectionSaver.restore(); }}
-                        document.execCommand('insertHTML', false, {json.dumps(html_to_insert)});
-                        const shadowRoot = document.activeElement?.shadowRoot;
-                        if (!shadowRoot) return;
-                        
-                        // Attach a double-click listener to the editor field, but only once.
-                        if (!window.ankiCodeBlockListenerAttached) {{
-                            shadowRoot.addEventListener('dblclick', (event) => {{
-                                const codeBlock = event.target.closest('.anki-code-block');
-                                if (codeBlock) {{
-                                    // If a code block is double-clicked, send a command back
-                                    // to Python to open the editor dialog again.
-                                    pycmd(`edit_code:${{codeBlock.id}}:${{codeBlock.dataset.rawCode}}`);
-                                }}
-                            }});
-                            window.ankiCodeBlockListenerAttached = true;
-                        }}
 
-                        // Inject or update the CSS styles for all code blocks in the field.
-                        const styleId = 'codemirror-syntax-styles';
-                        let style = shadowRoot.getElementById(styleId);
-                        if (!style) {{
-                            style = document.createElement('style');
-                            style.id = styleId;
-                            shadowRoot.appendChild(style);
-                        }}
-                        style.innerHTML = {json.dumps(css_to_inject)};
-                    }}, 50);
-                }})();
-                """
-            
-            # Execute the prepared JavaScript in the Anki editor's webview.
-            self.editor.web.eval(js_injector)
-            # Close the dialog successfully.
-            self.accept()
\ No newline at end of file
+                    // Inject or update the CSS styles for all code blocks in the field.
+                    const styleId = 'codemirror-syntax-styles';
+                    let style = shadowRoot.getElementById(styleId);
+                    if (!style) {{
+                        style = document.createElement('style');
+                        style.id = styleId;
+                        shadowRoot.appendChild(style);
+                    }}
+                    style.innerHTML = {json.dumps(css_to_inject)};
+                }}, 50);
+            }})();
+            """
+        
+        # Execute the prepared JavaScript in the Anki editor's webview.
+        self.editor.web.eval(js_injector)
+        # Close the dialog successfully.
+        self.accept()
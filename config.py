@@ -1,7 +1,5 @@
 # Not interesting just loading and saving configs...
 
-from aqt import mw
-
 ADDON_IDENTIFIER = None
 CONFIG = {}
 
@@ -9,10 +7,17 @@ CONFIG = {}
 CONFIG_KEY_GLOBAL_THEME = "global_theme"
 CONFIG_KEY_INJECT_MODELS = "injected_model_ids"
 CONFIG_KEY_BYPASS_MODELS = "bypassed_model_ids"
+# Snippets longer than this many characters are tokenised in a Web Worker on cards (0 = never).
+CONFIG_KEY_WORKER_THRESHOLD = "worker_threshold_chars"
+# Whether the reviewer reports render timings (shown in the config dialog).
+CONFIG_KEY_COLLECT_RENDER_STATS = "collect_render_stats"
+# Whether unused add-on files are removed from the media folder in the background.
+CONFIG_KEY_AUTO_CLEAN_MEDIA = "auto_clean_media"
 
 def load_config():
     """Loads the addon's configuration from disk."""
     global ADDON_IDENTIFIER, CONFIG
+    from aqt import mw
     
     ADDON_IDENTIFIER = mw.addonManager.addonFromModule(__name__)
     if not ADDON_IDENTIFIER:
@@ -20,6 +25,9 @@ def load_config():
             CONFIG_KEY_GLOBAL_THEME: "dracula",
             CONFIG_KEY_INJECT_MODELS: [],
             CONFIG_KEY_BYPASS_MODELS: [],
+            CONFIG_KEY_WORKER_THRESHOLD: 20000,
+            CONFIG_KEY_COLLECT_RENDER_STATS: True,
+            CONFIG_KEY_AUTO_CLEAN_MEDIA: True,
         }
         return
 
@@ -29,10 +37,14 @@ def load_config():
     CONFIG.setdefault(CONFIG_KEY_GLOBAL_THEME, "dracula")
     CONFIG.setdefault(CONFIG_KEY_INJECT_MODELS, [])
     CONFIG.setdefault(CONFIG_KEY_BYPASS_MODELS, [])
+    CONFIG.setdefault(CONFIG_KEY_WORKER_THRESHOLD, 20000)
+    CONFIG.setdefault(CONFIG_KEY_COLLECT_RENDER_STATS, True)
+    CONFIG.setdefault(CONFIG_KEY_AUTO_CLEAN_MEDIA, True)
     
     CONFIG.update(loaded_config)
 
 def save_config():
     """Saves the current CONFIG dictionary to disk."""
+    from aqt import mw
     if ADDON_IDENTIFIER:
         mw.addonManager.writeConfig(ADDON_IDENTIFIER, CONFIG)
\ No newline at end of file
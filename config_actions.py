@@ -2,11 +2,22 @@
 # such as opening relevant folders for user customization.
 
 import os
+import time
+
 from aqt import mw
-from aqt.utils import openFolder
+from aqt.utils import openFolder, tooltip
 
 # Import the utility functions to get the correct user files path.
 from . import utils
+from . import config
+from . import asset_manager
+
+# Key in the collection config that stores when the media files were last cleaned up.
+MEDIA_CLEANUP_CONF_KEY = "anki_codemirror_last_media_cleanup"
+
+# The automatic clean-up runs at most once a day, a while after the profile is opened.
+MEDIA_CLEANUP_INTERVAL_SECS = 24 * 60 * 60
+MEDIA_CLEANUP_DELAY_MS = 2 * 60 * 1000
 
 def open_styles_folder():
     """
@@ -26,3 +37,68 @@ def open_styles_folder():
         # Log an error if the folder is missing for some reason.
         print(f"CodeMirror Add-on: Styles folder not found at {styles_path}")
 
+def _record_media_cleanup():
+    """Remembers a successful clean-up; only those start the one-day wait."""
+    mw.col.set_config(MEDIA_CLEANUP_CONF_KEY, int(time.time()))
+
+def clean_up_media(parent=None):
+    """
+    The "Clean Up Now" action: removes unused add-on files from the media
+    folder (see asset_manager.collect_garbage) as a visible operation and
+    reports how many files were moved to the trash.
+    """
+    from anki.collection import OpChanges, OpChangesWithCount
+    from aqt.operations import CollectionOp
+
+    def op(col):
+        trashed_names = asset_manager.collect_garbage(col)
+        # Trashing media doesn't change notes, cards or note types.
+        return OpChangesWithCount(count=len(trashed_names), changes=OpChanges())
+
+    def on_success(result):
+        _record_media_cleanup()
+        tooltip(f"Moved {result.count} unused CodeMirror media files to the trash.", parent=parent)
+
+    CollectionOp(
+        parent=parent or mw,
+        op=op,
+    ).success(
+        on_success
+    ).failure(
+        lambda e: print(f"CodeMirror Add-on: Could not clean up media files: {e}")
+    ).run_in_background()
+
+def _clean_up_media_quietly():
+    """
+    The automatic clean-up: the same work as a plain background query, without
+    a progress window, undo entry or operation_did_execute for a change that
+    notes and cards never see.
+    """
+    from aqt.operations import QueryOp
+
+    def on_success(trashed_names: list):
+        _record_media_cleanup()
+        if trashed_names:
+            print(f"CodeMirror Add-on: Moved {len(trashed_names)} unused media files to the trash.")
+
+    QueryOp(
+        parent=mw,
+        op=lambda col: asset_manager.collect_garbage(col),
+        success=on_success,
+    ).failure(
+        lambda e: print(f"CodeMirror Add-on: Could not clean up media files: {e}")
+    ).run_in_background()
+
+def schedule_media_cleanup():
+    """
+    Called when the profile opens. Unless it is turned off, or has succeeded in
+    the last day, the clean-up runs a few minutes later, when Anki is usually idle.
+    """
+    if not config.CONFIG.get(config.CONFIG_KEY_AUTO_CLEAN_MEDIA, True):
+        return
+    last_cleanup = mw.col.get_config(MEDIA_CLEANUP_CONF_KEY, 0)
+    if time.time() - last_cleanup < MEDIA_CLEANUP_INTERVAL_SECS:
+        return
+
+    # requires_collection (the default) skips the call if the profile was closed meanwhile.
+    mw.progress.single_shot(MEDIA_CLEANUP_DELAY_MS, _clean_up_media_quietly)
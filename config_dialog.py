@@ -1,16 +1,27 @@
 # This file is not very interesting (it handles the settings)
 
 import os
+from pathlib import Path
+
 from aqt import mw
 from aqt.qt import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox,
-    QPushButton, QWidget, QScrollArea, QGroupBox, Qt, QDialogButtonBox, QFrame, QEvent
+    QPushButton, QGroupBox, Qt, QDialogButtonBox, QEvent,
+    QSpinBox, QCheckBox, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView,
+    QAbstractListModel, QSortFilterProxyModel, QModelIndex, QListView, QLineEdit,
+    QFileDialog, QInputDialog
 )
-from aqt.utils import tooltip, showInfo
+from aqt import dialogs
+from aqt.utils import tooltip, showInfo, askUser
 
 from . import utils
 from . import config
-from .template_manager import apply_template_injections
+from . import asset_manager
+from . import render_stats
+from . import snippet_library
+from . import starter_code
+from .template_manager import apply_template_injections, has_outdated_injections
+from .config_actions import clean_up_media
 
 class NoScrollComboBox(QComboBox):
     """
@@ -58,36 +69,115 @@ class NoScrollComboBox(QComboBox):
         # Optional but recommended: Match the popup width to the combo box width
         popup_window.setFixedWidth(self.width())
 
+class NoteTypeListModel(QAbstractListModel):
+    """
+    A read-only list of all note types (name and id).
+    It is built once per dialog and shared by every note type picker.
+    """
+    def __init__(self, note_types, parent=None):
+        super().__init__(parent)
+        self._note_types = [(note_type.name, note_type.id) for note_type in note_types]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._note_types)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        name, model_id = self._note_types[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return name
+        if role == Qt.ItemDataRole.UserRole:
+            return model_id
+        return None
+
+    def ids(self):
+        return {model_id for _, model_id in self._note_types}
+
+class CheckedNoteTypeProxy(QSortFilterProxyModel):
+    """
+    Puts a check box in front of every note type of the shared NoteTypeListModel
+    and filters it by name (and optionally to the checked ones only).
+    Each picker has its own proxy, so only the set of checked ids is per picker.
+    """
+    def __init__(self, source_model, checked_ids, parent=None):
+        super().__init__(parent)
+        # A dict keeps the order in which note types were checked (like an ordered set).
+        self.checked_ids = dict.fromkeys(checked_ids)
+        self.only_checked = False
+        self.setSourceModel(source_model)
+        self.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+
+    def flags(self, index):
+        return super().flags(index) | Qt.ItemFlag.ItemIsUserCheckable
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.CheckStateRole:
+            model_id = super().data(index, Qt.ItemDataRole.UserRole)
+            return Qt.CheckState.Checked if model_id in self.checked_ids else Qt.CheckState.Unchecked
+        return super().data(index, role)
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.CheckStateRole:
+            return super().setData(index, value, role)
+        model_id = super().data(index, Qt.ItemDataRole.UserRole)
+        if Qt.CheckState(value) == Qt.CheckState.Checked:
+            self.checked_ids[model_id] = None
+        else:
+            self.checked_ids.pop(model_id, None)
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def set_only_checked(self, only_checked):
+        self.only_checked = only_checked
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.only_checked:
+            index = self.sourceModel().index(source_row, 0, source_parent)
+            if self.sourceModel().data(index, Qt.ItemDataRole.UserRole) not in self.checked_ids:
+                return False
+        return super().filterAcceptsRow(source_row, source_parent)
+
 class ConfigDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("CodeMirror Configuration")
         self.setMinimumWidth(550)
-        self.resize(550, 600)
+        self.resize(650, 850)
 
-        self.all_models = sorted(mw.col.models.all(), key=lambda m: m['name'])
+        # Only names and ids are needed, which is much cheaper than loading every
+        # note type with all its templates.
+        self.note_type_model = NoteTypeListModel(
+            sorted(mw.col.models.all_names_and_ids(), key=lambda n: n.name), self
+        )
         
         layout = QVBoxLayout(self)
         layout.addWidget(self._create_theme_group())
 
-        self.injection_widgets = []
-        self.injection_rows_layout = QVBoxLayout()
-        layout.addWidget(self._create_dynamic_notetype_group(
+        self.injection_proxy = CheckedNoteTypeProxy(
+            self.note_type_model, config.CONFIG.get(config.CONFIG_KEY_INJECT_MODELS, []), self
+        )
+        layout.addWidget(self._create_notetype_picker_group(
             "2. Inject CodeMirror into Note Types",
             "Select note types where you want to use CodeMirror code blocks.",
-            self.injection_rows_layout,
-            lambda: self._add_row_ui(self.injection_rows_layout, self.injection_widgets)
+            self.injection_proxy
         ), 1)
 
-        self.bypass_widgets = []
-        self.bypass_rows_layout = QVBoxLayout()
-        layout.addWidget(self._create_dynamic_notetype_group(
-            "3. Bypass 'Empty Field' Check",
-            "Select note types to bypass Anki's check for empty fields.",
-            self.bypass_rows_layout,
-            lambda: self._add_row_ui(self.bypass_rows_layout, self.bypass_widgets)
+        self.bypass_proxy = CheckedNoteTypeProxy(
+            self.note_type_model, config.CONFIG.get(config.CONFIG_KEY_BYPASS_MODELS, []), self
+        )
+        layout.addWidget(self._create_notetype_picker_group(
+            "3. Recognise Clozes in Code",
+            "Select cloze note types whose clozes are inside code blocks. Anki's field checks stay on, "
+            "but clozes split up by syntax highlighting are recognised.",
+            self.bypass_proxy
         ), 1)
 
+        layout.addWidget(self._create_reviewer_group())
+        layout.addWidget(self._create_snippet_group())
+        layout.addWidget(self._create_media_group())
+
         buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Save | QDialogButtonBox.StandardButton.Cancel)
         buttons.accepted.connect(self.on_save)
         buttons.rejected.connect(self.reject)
@@ -114,7 +204,156 @@ class ConfigDialog(QDialog):
         group.setLayout(layout)
         return group
     
-    def _create_dynamic_notetype_group(self, title, description_text, rows_layout, add_function):
+    def _create_reviewer_group(self):
+        group = QGroupBox("4. Reviewer Performance")
+        layout = QVBoxLayout()
+
+        threshold_row = QHBoxLayout()
+        label = QLabel("Highlight code longer than this many characters in the background:")
+        label.setWordWrap(True)
+        threshold_row.addWidget(label, 1)
+
+        self.worker_threshold_spin = QSpinBox()
+        self.worker_threshold_spin.setRange(0, 10_000_000)
+        self.worker_threshold_spin.setSingleStep(1000)
+        self.worker_threshold_spin.setSpecialValueText("Never")
+        self.worker_threshold_spin.setToolTip(
+            "Very long code blocks are highlighted in a Web Worker so the card flip stays smooth.\n"
+            "Devices without Web Worker support always highlight on the main thread."
+        )
+        threshold_row.addWidget(self.worker_threshold_spin)
+        layout.addLayout(threshold_row)
+
+        self.collect_stats_checkbox = QCheckBox("Measure how long code blocks take to render while reviewing (desktop only)")
+        layout.addWidget(self.collect_stats_checkbox)
+
+        # --- Render statistics of this session (see render_stats.py) ---
+        self.stats_table = self._create_table(["Language", "Note Type", "Blocks", "p50 ms", "p95 ms", "Max ms", "Avg. Chars"])
+        for row in render_stats.summary():
+            self._append_table_row(self.stats_table, [row[0], row[1], row[2], f"{row[3]:.1f}", f"{row[4]:.1f}", f"{row[5]:.1f}", row[6]])
+        layout.addWidget(self.stats_table)
+
+        layout.addWidget(QLabel("Slowest cards this session:"))
+        self.slowest_table = self._create_table(["Note Type", "Side", "Blocks", "Chars", "Total ms"])
+        self.slowest_note_ids = []
+        for _, info in render_stats.slowest_cards():
+            self.slowest_note_ids.append(info["note_id"])
+            self._append_table_row(self.slowest_table, [
+                info["note_type"], render_stats.SIDES[info["side"]], info["blocks"], info["chars"], f"{info['total_ms']:.1f}",
+            ])
+        layout.addWidget(self.slowest_table)
+
+        buttons_row = QHBoxLayout()
+        browse_button = QPushButton("Browse These Notes")
+        browse_button.clicked.connect(self._browse_slowest_notes)
+        reset_button = QPushButton("Reset Statistics")
+        reset_button.clicked.connect(self._reset_render_stats)
+        buttons_row.addStretch(1)
+        buttons_row.addWidget(browse_button)
+        buttons_row.addWidget(reset_button)
+        layout.addLayout(buttons_row)
+
+        group.setLayout(layout)
+        return group
+
+    def _create_table(self, headers):
+        table = QTableWidget(0, len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        table.horizontalHeader().setStretchLastSection(True)
+        table.verticalHeader().setVisible(False)
+        table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        table.setMaximumHeight(120)
+        return table
+
+    def _append_table_row(self, table, values):
+        row = table.rowCount()
+        table.insertRow(row)
+        for column, value in enumerate(values):
+            table.setItem(row, column, QTableWidgetItem(str(value)))
+
+    def _browse_slowest_notes(self):
+        if not self.slowest_note_ids:
+            tooltip("No render statistics collected yet.")
+            return
+        search = "nid:" + ",".join(str(nid) for nid in self.slowest_note_ids)
+        dialogs.open("Browser", mw, search=(search,))
+
+    def _reset_render_stats(self):
+        render_stats.reset()
+        self.stats_table.setRowCount(0)
+        self.slowest_table.setRowCount(0)
+        self.slowest_note_ids = []
+
+    def _create_snippet_group(self):
+        group = QGroupBox("5. Snippet Library")
+        layout = QHBoxLayout()
+
+        self.snippet_count_label = QLabel()
+        layout.addWidget(self.snippet_count_label, 1)
+        self._update_snippet_count()
+
+        import_button = QPushButton("Import Snippets...")
+        import_button.setToolTip("Import VS Code (.json, .code-snippets) or UltiSnips (.snippets) files.\nSearch them in the editor with Ctrl+Space.")
+        import_button.clicked.connect(self._import_snippets)
+        clear_button = QPushButton("Clear")
+        clear_button.clicked.connect(self._clear_snippets)
+        layout.addWidget(import_button)
+        layout.addWidget(clear_button)
+
+        group.setLayout(layout)
+        return group
+
+    def _create_media_group(self):
+        group = QGroupBox("6. Media Files")
+        layout = QHBoxLayout()
+
+        self.auto_clean_media_checkbox = QCheckBox("Remove unused add-on files (e.g. old themes) from the media folder automatically")
+        self.auto_clean_media_checkbox.setToolTip("Runs in the background at most once a day, a few minutes after Anki starts.")
+        layout.addWidget(self.auto_clean_media_checkbox, 1)
+
+        clean_button = QPushButton("Clean Up Now")
+        clean_button.clicked.connect(lambda: clean_up_media(self))
+        layout.addWidget(clean_button)
+
+        group.setLayout(layout)
+        return group
+
+    def _update_snippet_count(self):
+        self.snippet_count_label.setText(f"{snippet_library.snippet_count()} snippets in your library.")
+
+    def _import_snippets(self):
+        paths, _ = QFileDialog.getOpenFileNames(
+            self, "Import Snippets", "", "Snippet files (*.json *.code-snippets *.snippets)"
+        )
+        languages = ["All languages"] + sorted(starter_code.STARTER_CODE)
+        imported = 0
+        for path_str in paths:
+            path = Path(path_str)
+            language = snippet_library.language_for_file(path)
+            if language is None:
+                # The file name doesn't tell the language (e.g. 'my-snippets.json'), so ask.
+                choice, ok = QInputDialog.getItem(
+                    self, "Snippet Language", f"Which language are the snippets in {path.name} for?",
+                    languages, 0, False
+                )
+                if not ok:
+                    continue
+                language = "" if choice == languages[0] else choice
+            try:
+                imported += snippet_library.import_file(path, language)
+            except (OSError, ValueError) as e:
+                showInfo(f"Could not import {path.name}: {e}")
+        self._update_snippet_count()
+        if paths:
+            tooltip(f"Imported {imported} new snippets.")
+
+    def _clear_snippets(self):
+        if askUser("Remove all snippets from your library?"):
+            snippet_library.clear()
+            self._update_snippet_count()
+
+    def _create_notetype_picker_group(self, title, description_text, proxy):
         group = QGroupBox(title)
         main_layout = QVBoxLayout(group)
         
@@ -122,84 +361,47 @@ class ConfigDialog(QDialog):
         description.setWordWrap(True)
         main_layout.addWidget(description)
 
-        scroll_area = QScrollArea()
-        scroll_area.setWidgetResizable(True)
-        scroll_content = QWidget()
-        rows_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        scroll_content.setLayout(rows_layout)
-        scroll_area.setWidget(scroll_content)
-        main_layout.addWidget(scroll_area, 1)
-
-        add_button = QPushButton("Add Note Type")
-        add_button.clicked.connect(add_function)
-        main_layout.addWidget(add_button)
+        search_edit = QLineEdit()
+        search_edit.setPlaceholderText("Search note types...")
+        search_edit.setClearButtonEnabled(True)
+        search_edit.textChanged.connect(proxy.setFilterFixedString)
+        main_layout.addWidget(search_edit)
+
+        # A list view only creates what is visible, so thousands of note types
+        # cost no more than a handful.
+        list_view = QListView()
+        list_view.setUniformItemSizes(True)
+        list_view.setModel(proxy)
+        main_layout.addWidget(list_view, 1)
+
+        bottom_row = QHBoxLayout()
+        selected_label = QLabel()
+        only_checked_checkbox = QCheckBox("Show selected only")
+        only_checked_checkbox.toggled.connect(proxy.set_only_checked)
+        bottom_row.addWidget(selected_label, 1)
+        bottom_row.addWidget(only_checked_checkbox)
+        main_layout.addLayout(bottom_row)
+
+        existing_ids = self.note_type_model.ids()
+        def update_selected_label():
+            count = sum(1 for model_id in proxy.checked_ids if model_id in existing_ids)
+            selected_label.setText(f"{count} selected")
+        proxy.dataChanged.connect(update_selected_label)
+        update_selected_label()
         
         return group
-    
-    def _add_row_ui(self, rows_layout, widget_list, selected_id=None):
-        row_widget = QWidget()
-        row_layout = QHBoxLayout(row_widget)
-        row_layout.setContentsMargins(0,0,0,0)
-
-        combo = NoScrollComboBox()
-        combo.addItem("Select Note Type...", None)
-        for model in self.all_models:
-            combo.addItem(model['name'], model['id'])
-
-        # NEW: Apply the fixes to this dynamically created combo box.
-        combo.setMaxVisibleItems(15)
-        
-        remove_button = QPushButton("Remove")
-        row_layout.addWidget(combo, 1)
-        row_layout.addWidget(remove_button)
-
-        widget_tuple = (row_widget, combo)
-        widget_list.append(widget_tuple)
-
-        remove_button.clicked.connect(lambda: self._remove_row_ui(widget_tuple, widget_list, rows_layout))
-        rows_layout.addWidget(row_widget)
-
-        if selected_id:
-            index = combo.findData(selected_id)
-            if index != -1:
-                combo.setCurrentIndex(index)
 
-    def _remove_row_ui(self, widget_tuple, widget_list, rows_layout):
-        if widget_tuple in widget_list:
-            row_widget, _ = widget_tuple
-            widget_list.remove(widget_tuple)
-            rows_layout.removeWidget(row_widget)
-            row_widget.deleteLater()
+    def _get_selected_ids(self, proxy):
+        # Note types that were deleted since the config was saved are dropped.
+        existing_ids = self.note_type_model.ids()
+        return [model_id for model_id in proxy.checked_ids if model_id in existing_ids]
 
     def load_settings(self):
         current_theme = config.CONFIG.get(config.CONFIG_KEY_GLOBAL_THEME, 'dracula')
         self.theme_combo.setCurrentText(current_theme)
-
-        inject_ids = config.CONFIG.get(config.CONFIG_KEY_INJECT_MODELS, [])
-        for model_id in inject_ids:
-            self._add_row_ui(self.injection_rows_layout, self.injection_widgets, model_id)
-
-        bypass_ids = config.CONFIG.get(config.CONFIG_KEY_BYPASS_MODELS, [])
-        for model_id in bypass_ids:
-            self._add_row_ui(self.bypass_rows_layout, self.bypass_widgets, model_id)
-
-    def _get_selected_ids_from_widgets(self, widget_list):
-        selected_ids = []
-        seen_ids = set()
-        has_duplicates = False
-        for _, combo in widget_list:
-            model_id = combo.currentData()
-            if model_id:
-                if model_id in seen_ids:
-                    has_duplicates = True
-                    continue
-                selected_ids.append(model_id)
-                seen_ids.add(model_id)
-        
-        if has_duplicates:
-            showInfo("One or more Note Types were selected multiple times. Duplicates have been ignored.")
-        
-        return selected_ids
+        self.worker_threshold_spin.setValue(config.CONFIG.get(config.CONFIG_KEY_WORKER_THRESHOLD, 20000))
+        self.collect_stats_checkbox.setChecked(config.CONFIG.get(config.CONFIG_KEY_COLLECT_RENDER_STATS, True))
+        self.auto_clean_media_checkbox.setChecked(config.CONFIG.get(config.CONFIG_KEY_AUTO_CLEAN_MEDIA, True))
 
     def on_save(self):
         selected_theme = self.theme_combo.currentText()
@@ -207,16 +409,30 @@ class ConfigDialog(QDialog):
             showInfo("Please select a theme.")
             return
 
-        injected_ids = self._get_selected_ids_from_widgets(self.injection_widgets)
-        bypassed_ids = self._get_selected_ids_from_widgets(self.bypass_widgets)
+        injected_ids = self._get_selected_ids(self.injection_proxy)
+        bypassed_ids = self._get_selected_ids(self.bypass_proxy)
+        previous_injected_ids = config.CONFIG.get(config.CONFIG_KEY_INJECT_MODELS, [])
 
         config.CONFIG[config.CONFIG_KEY_GLOBAL_THEME] = selected_theme
         config.CONFIG[config.CONFIG_KEY_INJECT_MODELS] = injected_ids
         config.CONFIG[config.CONFIG_KEY_BYPASS_MODELS] = bypassed_ids
+        config.CONFIG[config.CONFIG_KEY_WORKER_THRESHOLD] = self.worker_threshold_spin.value()
+        config.CONFIG[config.CONFIG_KEY_COLLECT_RENDER_STATS] = self.collect_stats_checkbox.isChecked()
+        config.CONFIG[config.CONFIG_KEY_AUTO_CLEAN_MEDIA] = self.auto_clean_media_checkbox.isChecked()
         
         config.save_config()
-        tooltip("Applying changes to note types...")
-        apply_template_injections()
+
+        # Templates only reference the stable loader, so if the selected note types
+        # didn't change, switching the theme (or any other setting in the runtime
+        # config) is a single media file write (the asset sync only writes files
+        # whose content actually changed).
+        if set(injected_ids) == set(previous_injected_ids) and not has_outdated_injections():
+            asset_manager.sync_assets_to_media_folder()
+            asset_manager.apply_theme(selected_theme)
+            mw.reset()
+        else:
+            tooltip("Applying changes to note types...")
+            apply_template_injections()
         tooltip("Configuration saved and applied.")
         self.accept()
 
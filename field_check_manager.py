@@ -1,33 +1,76 @@
-# This file is needed for bypassing ankis cloze error message
-# when creating codemirror clozes the html will look like this:
+# This file makes Anki's field check understand clozes inside code blocks.
+# When creating codemirror clozes the html will look like this:
 # {{<span class="cm-variable">c1</span>::<span class="cm-variable">cloze</span>}}
-# Anki cant handle the html tags between that it can only handle it like this 
+# Anki cant handle the html tags between that it can only handle it like this
 # <example>{{c1::cloze}}</example>
-# Therfore a bypass is needed.
+# Therefore, for the selected note types, a "missing cloze" result is checked
+# again with a scanner that looks through the tags. All of Anki's other checks
+# (empty first field, duplicates, ...) stay as they are.
+
+import re
 
 from anki.notes import Note, NoteFieldsCheckResult
+from anki.utils import field_checksum, split_fields, strip_html_media
 from . import config
 
 _original_fields_check = None
 
-def bypassed_fields_check(note_instance: Note) -> NoteFieldsCheckResult:
+# Any number of tags between two characters of a cloze marker.
+_TAGS = r"(?:<[^<>]*>)*"
+
+# Finds "{{c1::" even if tags are wrapped around any of its parts, in a single pass.
+CLOZE_ACROSS_TAGS = re.compile(
+    r"\{" + _TAGS + r"\{" + _TAGS + r"c" + _TAGS + r"\d+" + _TAGS + r":" + _TAGS + r":"
+)
+
+def field_has_cloze(field_html: str) -> bool:
+    """
+    Checks a field for a cloze marker, also across tags. Anki checks the fields
+    again on every keystroke, so this is a single linear scan.
+    """
+    # Most fields have no braces at all, they don't need the regex.
+    if "{" not in field_html:
+        return False
+    return CLOZE_ACROSS_TAGS.search(field_html) is not None
+
+def is_duplicate(note_instance: Note) -> bool:
     """
-    If the note's type is in our bypass list, it immediately returns NORMAL.
-    Otherwise, it performs the original check.
-    This is called monkey patching. 
+    Anki's duplicate check: another note of the same note type has the same
+    first field (compared without HTML, like Anki does).
+    """
+    first_field = strip_html_media(note_instance.fields[0])
+    for (fields,) in note_instance.col.db.execute(
+        "SELECT flds FROM notes WHERE csum = ? AND id != ? AND mid = ?",
+        field_checksum(note_instance.fields[0]), note_instance.id or 0, note_instance.mid,
+    ):
+        if strip_html_media(split_fields(fields)[0]) == first_field:
+            return True
+    return False
+
+def cloze_aware_fields_check(note_instance: Note) -> NoteFieldsCheckResult:
+    """
+    Runs Anki's own check. If it reports a missing cloze for one of the selected
+    note types, the fields are searched again with CLOZE_ACROSS_TAGS.
+    Anki stops at the missing cloze, so its duplicate check is run afterwards.
+    This is called monkey patching.
     (Unfortunately monkey patching is not good and can break if anki updates...)
     """
-    # Read directly from the global CONFIG dictionary using the new key
-    bypassed_ids = config.CONFIG.get(config.CONFIG_KEY_BYPASS_MODELS, [])
+    if _original_fields_check:
+        result = _original_fields_check(note_instance)
+    else:
+        result = Note.fields_check(note_instance) # Fallback
+
+    if result != NoteFieldsCheckResult.MISSING_CLOZE:
+        return result
 
-    if note_instance.mid in bypassed_ids:
+    # Read directly from the global CONFIG dictionary
+    checked_ids = config.CONFIG.get(config.CONFIG_KEY_BYPASS_MODELS, [])
+    if note_instance.mid in checked_ids and any(field_has_cloze(value) for value in note_instance.fields):
+        if is_duplicate(note_instance):
+            return NoteFieldsCheckResult.DUPLICATE
         return NoteFieldsCheckResult.NORMAL
 
-    # Call the original Anki function
-    if _original_fields_check:
-        return _original_fields_check(note_instance)
-    
-    return Note.fields_check(note_instance) # Fallback
+    return result
 
 def apply_field_check_patch():
     """Applies the monkey patch to Note.fields_check."""
@@ -35,4 +78,4 @@ def apply_field_check_patch():
     if not hasattr(Note, '_fields_check_original_codemirror'):
         _original_fields_check = Note.fields_check
         Note._fields_check_original_codemirror = _original_fields_check
-        Note.fields_check = bypassed_fields_check
\ No newline at end of file
+        Note.fields_check = cloze_aware_fields_check
@@ -3,7 +3,6 @@
 from aqt.editor import Editor
 
 from . import utils
-from .codemirror_dialog import CodeMirrorDialog
 
 def on_insert_code_button_clicked(editor: Editor):
     if hasattr(editor, "codeMirrorDialog") and editor.codeMirrorDialog.isVisible():
@@ -11,6 +10,10 @@ def on_insert_code_button_clicked(editor: Editor):
         editor.codeMirrorDialog.activateWindow()
         return
 
+    # The dialog (and BeautifulSoup with it) is only imported once it is opened,
+    # so showing an editor doesn't pay for it.
+    from .codemirror_dialog import CodeMirrorDialog
+
     js_save_selection = "if (window.selectionSaver) { window.selectionSaver.save(); }"
     editor.web.eval(js_save_selection)
 
@@ -24,9 +27,15 @@ def on_webview_message(handled: tuple[bool, object], message: str, context: obje
 
     if message.startswith("edit_code:"):
         editor = context
-        _, block_id, encoded_raw = message.split(":", 2)
+        # Diff blocks also send their "before" code as a fourth part.
+        _, block_id, encoded_raw, *encoded_before = message.split(":", 3)
+
+        from .codemirror_dialog import CodeMirrorDialog
         
-        dialog = CodeMirrorDialog(editor.parentWindow, editor, initial_code=encoded_raw, block_id=block_id)
+        dialog = CodeMirrorDialog(
+            editor.parentWindow, editor, initial_code=encoded_raw, block_id=block_id,
+            initial_before_code=encoded_before[0] if encoded_before else "",
+        )
         editor.codeMirrorDialog = dialog
         dialog.show()
         
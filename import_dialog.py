@@ -0,0 +1,129 @@
+# This file contains the small dialog for the bulk code importer.
+# The actual importing is done in code_importer.py.
+
+from pathlib import Path
+
+from aqt import mw
+from aqt.qt import (
+    QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, QLineEdit, QPushButton,
+    QComboBox, QDialogButtonBox, QFileDialog
+)
+from aqt.utils import showInfo
+
+from . import code_importer
+
+class CodeImportDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Import Code into CodeMirror Cards")
+        self.setMinimumWidth(550)
+
+        layout = QVBoxLayout(self)
+        form = QFormLayout()
+        layout.addLayout(form)
+
+        # --- Source (folder or notebook) ---
+        self.source_edit = QLineEdit()
+        self.source_edit.setPlaceholderText("Folder or .ipynb file to import")
+        folder_button = QPushButton("Folder...")
+        folder_button.clicked.connect(self._choose_folder)
+        file_button = QPushButton("File...")
+        file_button.clicked.connect(self._choose_file)
+        source_row = QHBoxLayout()
+        source_row.addWidget(self.source_edit, 1)
+        source_row.addWidget(folder_button)
+        source_row.addWidget(file_button)
+        form.addRow("Source:", source_row)
+
+        # --- How the code is split into notes ---
+        self.split_combo = QComboBox()
+        self.split_combo.addItem("One note per file", code_importer.SPLIT_FILES)
+        self.split_combo.addItem("One note per Python function/class", code_importer.SPLIT_DEFINITIONS)
+        self.split_combo.setToolTip("Notebooks are always split into one note per code cell.")
+        form.addRow("Split:", self.split_combo)
+
+        # --- Target note type, fields and deck ---
+        self.model_combo = QComboBox()
+        for model in sorted(mw.col.models.all(), key=lambda m: m['name']):
+            self.model_combo.addItem(model['name'], model['id'])
+        self.model_combo.currentIndexChanged.connect(self._update_field_combos)
+        form.addRow("Note type:", self.model_combo)
+
+        self.code_field_combo = QComboBox()
+        form.addRow("Code field:", self.code_field_combo)
+
+        self.title_field_combo = QComboBox()
+        self.title_field_combo.setToolTip("Optional field that receives the file path (and function name).")
+        form.addRow("Title field:", self.title_field_combo)
+
+        self.deck_combo = QComboBox()
+        for deck in sorted(mw.col.decks.all_names_and_ids(), key=lambda d: d.name):
+            self.deck_combo.addItem(deck.name, deck.id)
+        current_deck_index = self.deck_combo.findData(mw.col.decks.current()['id'])
+        if current_deck_index != -1:
+            self.deck_combo.setCurrentIndex(current_deck_index)
+        form.addRow("Deck:", self.deck_combo)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        buttons.button(QDialogButtonBox.StandardButton.Ok).setText("Import")
+        buttons.accepted.connect(self.on_import)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+        self._update_field_combos()
+
+    def _choose_folder(self):
+        path = QFileDialog.getExistingDirectory(self, "Choose a source folder")
+        if path:
+            self.source_edit.setText(path)
+
+    def _choose_file(self):
+        extensions = " ".join(f"*{ext}" for ext in code_importer.EXTENSION_LANGUAGES)
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Choose a source file", "",
+            f"Code files (*{code_importer.NOTEBOOK_EXTENSION} {extensions})"
+        )
+        if path:
+            self.source_edit.setText(path)
+
+    def _update_field_combos(self):
+        self.code_field_combo.clear()
+        self.title_field_combo.clear()
+        self.title_field_combo.addItem("(none)", None)
+
+        model = mw.col.models.get(self.model_combo.currentData())
+        if not model:
+            return
+        for name in mw.col.models.field_names(model):
+            self.code_field_combo.addItem(name, name)
+            self.title_field_combo.addItem(name, name)
+
+    def on_import(self):
+        source = Path(self.source_edit.text().strip())
+        if not self.source_edit.text().strip() or not source.exists():
+            showInfo("Please choose an existing folder or file.")
+            return
+
+        code_field = self.code_field_combo.currentData()
+        title_field = self.title_field_combo.currentData()
+        if not code_field:
+            showInfo("Please select a code field.")
+            return
+        if code_field == title_field:
+            showInfo("The code field and the title field must be different.")
+            return
+
+        code_importer.run_import(
+            mw,
+            source,
+            self.split_combo.currentData(),
+            self.model_combo.currentData(),
+            self.deck_combo.currentData(),
+            code_field,
+            title_field,
+        )
+        self.accept()
+
+def show_import_dialog():
+    dialog = CodeImportDialog(mw)
+    dialog.exec()
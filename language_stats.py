@@ -0,0 +1,56 @@
+# This file keeps a small index of which languages are used in which field.
+# Every time a note is added, the languages of its code blocks are counted per
+# (note type, field) in the collection config. The editor dialog uses the counts
+# to open in the most likely language and to load only the modes it needs.
+
+import re
+
+from . import save_handler
+
+# Key in the collection config that stores the counts.
+STATS_CONF_KEY = "anki_codemirror_language_stats"
+
+# When the counts of a field add up to more than this, they are halved. This
+# keeps the index small and lets recent habits win over old ones.
+MAX_COUNT_PER_FIELD = 200
+
+# The language of every stored code block (see save_handler.build_code_span / build_diff_span).
+LANGUAGE_ATTRIBUTE = re.compile(r'data-language="([^"]*)"')
+
+
+def _field_key(model_id: int, field_name: str) -> str:
+    return f"{model_id}:{field_name}"
+
+
+def record_note(note):
+    """Counts the languages of the code blocks in every field of note."""
+    stats = None
+    for field_name, field_value in note.items():
+        if save_handler.CODE_SPAN_CLASS not in field_value:
+            continue
+        languages = LANGUAGE_ATTRIBUTE.findall(field_value)
+        if not languages:
+            continue
+
+        # Only read the config once a field actually contains code.
+        if stats is None:
+            stats = note.col.get_config(STATS_CONF_KEY, None) or {}
+        counts = stats.setdefault(_field_key(note.mid, field_name), {})
+        for language in languages:
+            counts[language] = counts.get(language, 0) + 1
+
+        if sum(counts.values()) > MAX_COUNT_PER_FIELD:
+            for language in list(counts):
+                counts[language] //= 2
+                if not counts[language]:
+                    del counts[language]
+
+    if stats is not None:
+        note.col.set_config(STATS_CONF_KEY, stats)
+
+
+def likely_languages(col, model_id: int, field_name: str) -> list:
+    """Returns the languages used in this field, most used first."""
+    stats = col.get_config(STATS_CONF_KEY, None) or {}
+    counts = stats.get(_field_key(model_id, field_name), {})
+    return sorted(counts, key=counts.get, reverse=True)
@@ -0,0 +1,126 @@
+# This file collects the render timings that reviewer_script.js reports on desktop.
+# It keeps a rolling window of recent samples per (language, note type) and the
+# slowest cards seen in this session, so the config dialog can show where
+# reviews stutter. Nothing is written to disk.
+
+import json
+from collections import deque
+
+# Messages from reviewer_script.js start with this (see TELEMETRY_COMMAND there).
+MESSAGE_PREFIX = "codemirror_render_stats:"
+
+# How many recent blocks are kept per (language, note type).
+SAMPLES_PER_KEY = 500
+
+# How many of the slowest cards are remembered.
+MAX_SLOWEST_CARDS = 20
+
+# (language, note type name) -> deque of (total ms, chars)
+_samples = {}
+
+# Names of the sides reported by reviewer_script.js.
+SIDES = {"q": "Question", "a": "Answer"}
+
+# (card id, side) -> {"note_id", "note_type", "side", "blocks", "chars", "total_ms"}
+_slowest_cards = {}
+
+
+def _block_total_ms(block: dict) -> float:
+    return sum(block.get(key) or 0 for key in ("tokenizeMs", "domMs", "layoutMs"))
+
+
+def record(blocks: list, card_id: int, note_id: int, note_type: str, side: str = "q"):
+    """
+    Adds the blocks of one render pass of a card side ("q" or "a") to the
+    statistics. The question and answer of a card are kept apart, so the
+    blocks the answer shows again (e.g. with {{FrontSide}}) aren't added to
+    the question's time.
+    """
+    card_total = 0.0
+    card_chars = 0
+    for block in blocks:
+        total_ms = _block_total_ms(block)
+        chars = int(block.get("chars") or 0)
+        key = (str(block.get("language", "")), note_type)
+        if key not in _samples:
+            _samples[key] = deque(maxlen=SAMPLES_PER_KEY)
+        _samples[key].append((total_ms, chars))
+        card_total += total_ms
+        card_chars += chars
+
+    # A side can report several times (e.g. when big blocks come back from the
+    # worker later), so its numbers are added up.
+    entry = _slowest_cards.setdefault((card_id, side), {
+        "note_id": note_id, "note_type": note_type, "side": side, "blocks": 0, "chars": 0, "total_ms": 0.0,
+    })
+    entry["blocks"] += len(blocks)
+    entry["chars"] += card_chars
+    entry["total_ms"] += card_total
+
+    if len(_slowest_cards) > MAX_SLOWEST_CARDS:
+        fastest_card = min(_slowest_cards, key=lambda key: _slowest_cards[key]["total_ms"])
+        del _slowest_cards[fastest_card]
+
+
+def _percentile(sorted_values: list, fraction: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summary() -> list:
+    """
+    Returns one row per (language, note type), slowest first:
+    (language, note type, block count, p50 ms, p95 ms, max ms, average chars)
+    """
+    rows = []
+    for (language, note_type), samples in _samples.items():
+        timings = sorted(total_ms for total_ms, _ in samples)
+        average_chars = sum(chars for _, chars in samples) // len(samples)
+        rows.append((
+            language, note_type, len(samples),
+            _percentile(timings, 0.5), _percentile(timings, 0.95), timings[-1],
+            average_chars,
+        ))
+    rows.sort(key=lambda row: row[4], reverse=True)
+    return rows
+
+
+def slowest_cards() -> list:
+    """Returns ((card id, side), info dict) pairs of the slowest card sides, slowest first."""
+    return sorted(_slowest_cards.items(), key=lambda item: item[1]["total_ms"], reverse=True)
+
+
+def reset():
+    _samples.clear()
+    _slowest_cards.clear()
+
+
+def on_webview_message(handled: tuple[bool, object], message: str, context: object) -> tuple[bool, object]:
+    """Receives the timings sent by reviewer_script.js while reviewing."""
+    if not message.startswith(MESSAGE_PREFIX):
+        return handled
+
+    from aqt.reviewer import Reviewer
+    if not isinstance(context, Reviewer) or not context.card:
+        # Previews and the card layout screen are not interesting, just swallow the message.
+        return (True, None)
+
+    try:
+        payload = json.loads(message[len(MESSAGE_PREFIX):])
+        blocks = payload.get("blocks", [])
+        side = payload.get("side", "q")
+    except (ValueError, AttributeError) as e:
+        print(f"CodeMirror Add-on: Could not read render stats: {e}")
+        return (True, None)
+    if side not in SIDES:
+        return (True, None)
+
+    # The stats are sent as soon as a side is rendered, so the reviewer still
+    # shows that card. Only if the answer was rendered while the reviewer is
+    # already on the next question, they belong to the previous card.
+    if side == "a" and context.state != "answer":
+        return (True, None)
+
+    card = context.card
+    record(blocks, card.id, card.nid, card.note_type()["name"], side)
+    return (True, None)
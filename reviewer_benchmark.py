@@ -0,0 +1,333 @@
+# This is a benchmark for rendering code blocks on cards, without Anki and without a GPU.
+# It builds cards with generated code plus the same resources block and media files
+# the add-on puts into the collection (see asset_manager.py), opens them in an
+# offscreen QtWebEngine page and lets reviewer_script.js render them. It needs
+# PyQt6 with QtWebEngine (which Anki ships with):
+#
+#   pip install PyQt6 PyQt6-WebEngine
+#   python -m <add-on folder>.reviewer_benchmark --output report.json
+#   python -m <add-on folder>.reviewer_benchmark --output new.json --baseline report.json
+#
+# (run it from the folder that contains the add-on folder)
+#
+# For every combination of snippet size, block count, language and theme it records:
+# - the time until the last block is rendered (from the start of the page load)
+# - the number of DOM nodes
+# - the JS heap size
+# - the per-block timings reviewer_script.js reports (see render_stats.py)
+# With --baseline, every case is compared with an earlier report. The exit code
+# is 1 if any case got slower than --max-slowdown, so it can guard CI runs.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+from . import asset_manager
+from . import save_handler
+
+# The page has no window and no GPU. Chromium only reports exact heap sizes
+# with enable-precise-memory-info, and file:// pages can only start the
+# tokenizer worker with allow-file-access-from-files.
+CHROMIUM_FLAGS = "--disable-gpu --enable-precise-memory-info --allow-file-access-from-files"
+
+DEFAULT_SIZES = [200, 2000, 20000, 100000]
+DEFAULT_BLOCK_COUNTS = [1, 10]
+DEFAULT_LANGUAGES = ["python", "javascript", "text/x-java"]
+DEFAULT_THEMES = ["dracula", "eclipse"]
+
+# A case counts as a regression if it is this much slower than the baseline...
+DEFAULT_MAX_SLOWDOWN = 1.10
+# ...and at least this many milliseconds slower (smaller differences are noise).
+MIN_REGRESSION_MS = 5.0
+
+POLL_INTERVAL_MS = 10
+CASE_TIMEOUT_MS = 60000
+
+# A few typical lines per language. They are repeated (with numbered names)
+# until a snippet has the requested size.
+CODE_TEMPLATES = {
+    "python": (
+        "def compute_{n}(values, factor=2):\n"
+        "    # Scale and filter the values\n"
+        "    result = [v * factor for v in values if v % 3 != 0]\n"
+        "    return {{'total': sum(result), 'name': \"item_{n}\"}}\n\n"
+    ),
+    "javascript": (
+        "function compute{n}(values, factor = 2) {{\n"
+        "    // Scale and filter the values\n"
+        "    const result = values.filter(v => v % 3 !== 0).map(v => v * factor);\n"
+        "    return {{ total: result.reduce((a, b) => a + b, 0), name: `item_{n}` }};\n"
+        "}}\n\n"
+    ),
+    "text/x-java": (
+        "public static int compute{n}(int[] values, int factor) {{\n"
+        "    // Scale and filter the values\n"
+        "    int total = 0;\n"
+        "    for (int v : values) {{ if (v % 3 != 0) total += v * factor; }}\n"
+        "    return total; // \"item_{n}\"\n"
+        "}}\n\n"
+    ),
+}
+
+# Runs in the page and stores the result once every block is rendered
+# (rendered blocks no longer have the codemirror-anki class).
+PROBE_SCRIPT = """
+(function () {
+    function check() {
+        if (typeof CodeMirror === "undefined" || document.querySelector(".codemirror-anki")) {
+            setTimeout(check, 1);
+            return;
+        }
+        window.CODE_MIRROR_BENCHMARK_RESULT = {
+            timeToRenderedMs: performance.now(),
+            domNodes: document.getElementsByTagName("*").length,
+            jsHeapBytes: performance.memory ? performance.memory.usedJSHeapSize : null,
+            blocks: window.CODE_MIRROR_RENDER_STATS,
+        };
+    }
+    check();
+})();
+"""
+
+RESULT_SCRIPT = (
+    "window.CODE_MIRROR_BENCHMARK_RESULT ? "
+    "JSON.stringify(window.CODE_MIRROR_BENCHMARK_RESULT) : null"
+)
+
+
+class _FolderMedia:
+    """The parts of Anki's media manager asset_manager uses, for a plain folder."""
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+
+    def dir(self) -> str:
+        return str(self.folder)
+
+    def write_data(self, name: str, data: bytes) -> str:
+        (self.folder / name).write_bytes(data)
+        return name
+
+    def trash_files(self, names: list):
+        for name in names:
+            (self.folder / name).unlink(missing_ok=True)
+
+
+class _MediaFolder:
+    """Lets asset_manager write the card assets into a plain folder instead of a collection."""
+
+    def __init__(self, folder: Path):
+        self.media = _FolderMedia(folder)
+
+
+def generate_code(language: str, size: int) -> str:
+    """Returns a snippet of roughly size characters."""
+    template = CODE_TEMPLATES[language]
+    parts = []
+    length = 0
+    n = 0
+    while length < size:
+        part = template.format(n=n)
+        parts.append(part)
+        length += len(part)
+        n += 1
+    return "".join(parts)[:size]
+
+
+def build_card_html(language: str, size: int, block_count: int, resources_html: str) -> str:
+    """Builds a card the way Anki shows it: the note's code spans, then the template's resources block."""
+    code = generate_code(language, size)
+    blocks = "".join(f"<div>{save_handler.build_code_span(code, language)}</div>" for _ in range(block_count))
+    return (
+        '<!doctype html><html><head><meta charset="utf-8"></head><body class="card">'
+        "<script>window.CODE_MIRROR_RENDER_STATS = [];</script>"
+        f"{blocks}{resources_html}<script>{PROBE_SCRIPT}</script>"
+        "</body></html>"
+    )
+
+
+def render_page(page_factory, html_path: Path) -> dict:
+    """Loads html_path into a fresh page and waits for the probe's result."""
+    from PyQt6.QtCore import QEventLoop, QTimer, QUrl
+
+    page = page_factory()
+    loop = QEventLoop()
+    state = {"done": False, "result": None}
+
+    def finish(result=None):
+        if state["done"]:
+            return
+        state["done"] = True
+        state["result"] = result
+        loop.quit()
+
+    def poll():
+        if not state["done"]:
+            page.runJavaScript(RESULT_SCRIPT, on_result)
+
+    def on_result(value):
+        if value:
+            finish(json.loads(value))
+        else:
+            QTimer.singleShot(POLL_INTERVAL_MS, poll)
+
+    page.loadFinished.connect(lambda ok: poll() if ok else finish())
+    QTimer.singleShot(CASE_TIMEOUT_MS, finish)
+    page.load(QUrl.fromLocalFile(str(html_path)))
+    loop.exec()
+    page.deleteLater()
+    return state["result"]
+
+
+def summarize_runs(case: dict, runs: list) -> dict:
+    """Condenses the repeated runs of one case into medians."""
+    entry = {"key": case_key(case), "case": case, "runs": len(runs)}
+    if not runs:
+        entry["error"] = "timed out"
+        return entry
+
+    blocks = [block for run in runs for block in (run.get("blocks") or [])]
+    # Which render path (editor, worker, hint) the blocks took, counted for one run.
+    paths = {}
+    for block in runs[-1].get("blocks") or []:
+        paths[block.get("path", "")] = paths.get(block.get("path", ""), 0) + 1
+    heap_sizes = [run["jsHeapBytes"] for run in runs if run.get("jsHeapBytes") is not None]
+
+    entry.update({
+        "time_to_rendered_ms": statistics.median(run["timeToRenderedMs"] for run in runs),
+        "dom_nodes": statistics.median(run["domNodes"] for run in runs),
+        "js_heap_bytes": statistics.median(heap_sizes) if heap_sizes else None,
+        "render_paths": paths,
+    })
+    for key in ("tokenizeMs", "domMs", "layoutMs"):
+        timings = [block[key] for block in blocks if block.get(key) is not None]
+        entry[f"block_{key[:-2].lower()}_ms_median"] = statistics.median(timings) if timings else None
+    return entry
+
+
+def case_key(case: dict) -> str:
+    return f"{case['language']}|{case['theme']}|{case['chars']}|{case['blocks']}"
+
+
+def run_benchmark(sizes: list, block_counts: list, languages: list, themes: list, repeat: int) -> list:
+    from PyQt6.QtWidgets import QApplication
+    from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineProfile
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    # An off-the-record profile, so no disk cache carries over between runs.
+    profile = QWebEngineProfile(app)
+
+    def page_factory():
+        return QWebEnginePage(profile, app)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="codemirror_anki_bench_") as workdir:
+        folder = Path(workdir)
+        for theme in themes:
+            resources_html = asset_manager.get_mobile_resources_html(theme, _MediaFolder(folder))
+
+            # The first page of a theme also pays for starting the renderer process, so it is not counted.
+            warmup_path = folder / "warmup.html"
+            warmup_path.write_text(build_card_html(languages[0], sizes[0], 1, resources_html), encoding="utf-8")
+            render_page(page_factory, warmup_path)
+
+            for language, size, block_count in itertools.product(languages, sizes, block_counts):
+                case = {"language": language, "theme": theme, "chars": size, "blocks": block_count}
+                html_path = folder / "card.html"
+                html_path.write_text(build_card_html(language, size, block_count, resources_html), encoding="utf-8")
+                runs = [run for run in (render_page(page_factory, html_path) for _ in range(repeat)) if run]
+                entry = summarize_runs(case, runs)
+                results.append(entry)
+                print(f"{entry['key']}: {entry.get('time_to_rendered_ms', 'timed out')}")
+    return results
+
+
+def compare_with_baseline(results: list, baseline: dict, max_slowdown: float) -> list:
+    """Returns one comparison row per case that exists in both reports."""
+    baseline_results = {entry["key"]: entry for entry in baseline.get("results", [])}
+    comparison = []
+    for entry in results:
+        old = baseline_results.get(entry["key"])
+        if not old or old.get("time_to_rendered_ms") is None or entry.get("time_to_rendered_ms") is None:
+            continue
+        old_ms = old["time_to_rendered_ms"]
+        new_ms = entry["time_to_rendered_ms"]
+        ratio = new_ms / old_ms if old_ms else None
+        comparison.append({
+            "key": entry["key"],
+            "baseline_ms": old_ms,
+            "current_ms": new_ms,
+            "ratio": ratio,
+            "dom_nodes_delta": entry["dom_nodes"] - old.get("dom_nodes", entry["dom_nodes"]),
+            "regression": bool(ratio and ratio > max_slowdown and new_ms - old_ms >= MIN_REGRESSION_MS),
+        })
+    return comparison
+
+
+def environment_info() -> dict:
+    from PyQt6.QtCore import QT_VERSION_STR
+    info = {"python": platform.python_version(), "platform": platform.platform(), "qt": QT_VERSION_STR}
+    try:
+        from PyQt6.QtWebEngineCore import qWebEngineChromiumVersion
+        info["chromium"] = qWebEngineChromiumVersion()
+    except ImportError:
+        pass
+    return info
+
+
+def _int_list(text: str) -> list:
+    return [int(value) for value in text.split(",") if value]
+
+
+def _str_list(text: str) -> list:
+    return [value for value in text.split(",") if value]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark how fast code blocks render on cards.")
+    parser.add_argument("--output", type=Path, required=True, help="where to write the JSON report")
+    parser.add_argument("--baseline", type=Path, help="an earlier report to compare with")
+    parser.add_argument("--sizes", type=_int_list, default=DEFAULT_SIZES, help="snippet sizes in characters, comma separated")
+    parser.add_argument("--blocks", type=_int_list, default=DEFAULT_BLOCK_COUNTS, help="code blocks per card, comma separated")
+    parser.add_argument("--languages", type=_str_list, default=DEFAULT_LANGUAGES, help="comma separated, one of: " + ", ".join(CODE_TEMPLATES))
+    parser.add_argument("--themes", type=_str_list, default=DEFAULT_THEMES, help="CodeMirror themes, comma separated")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case, the median is reported (default: 5)")
+    parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN, help="allowed time ratio against the baseline (default: 1.10)")
+    args = parser.parse_args(argv)
+
+    for language in args.languages:
+        if language not in CODE_TEMPLATES:
+            parser.error(f"no code template for language: {language}")
+    for theme in args.themes:
+        if not asset_manager.get_theme_css(theme):
+            parser.error(f"unknown theme: {theme}")
+
+    # Must be set before Qt is imported.
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ.setdefault("QTWEBENGINE_CHROMIUM_FLAGS", CHROMIUM_FLAGS)
+
+    results = run_benchmark(args.sizes, args.blocks, args.languages, args.themes, max(1, args.repeat))
+    report = {"environment": environment_info(), "repeat": args.repeat, "results": results}
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        report["baseline"] = {"path": str(args.baseline), "environment": baseline.get("environment")}
+        report["comparison"] = compare_with_baseline(results, baseline, args.max_slowdown)
+        regressions = [row for row in report["comparison"] if row["regression"]]
+        for row in regressions:
+            print(f"Regression: {row['key']} {row['baseline_ms']:.1f} ms -> {row['current_ms']:.1f} ms")
+
+    args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote {args.output}.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
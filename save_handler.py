@@ -5,38 +5,174 @@
 
 from bs4 import BeautifulSoup
 import base64
+import difflib
+import html
+import json
+import re
 
-def on_editor_will_save_note(problem, note):
+# The class the reviewer script looks for (see reviewer_script.js).
+CODE_SPAN_CLASS = "codemirror-anki"
+
+def build_code_span(raw_code: str, lang: str) -> str:
+    """
+    Builds the same lightweight span that on_editor_will_save_note stores,
+    for code that never went through the editor (e.g. the bulk importer).
+    """
+    return (
+        f'<span class="{CODE_SPAN_CLASS}" data-language="{html.escape(lang)}">'
+        f'{html.escape(raw_code, quote=False)}</span>'
+    )
+
+# The class of the spans holding a before/after pair (see renderDiffBlock in reviewer_script.js).
+DIFF_SPAN_CLASS = "codemirror-anki-diff"
+
+# Bump this when the data-diff format changes (see DIFF_FORMAT in reviewer_script.js).
+DIFF_FORMAT = 1
+
+# The same line breaks the reviewer splits on.
+LINE_BREAK = re.compile(r"\r\n|\n|\r")
+
+# Words, runs of whitespace and single symbols: the units of the in-line diff.
+WORD = re.compile(r"\w+|\s+|[^\w\s]")
+
+# Lines that are less similar than this are marked as a whole, not word by word.
+MIN_WORD_DIFF_RATIO = 0.3
+
+def _utf16_length(text: str) -> int:
+    """JavaScript counts string positions in UTF-16 units, not in characters."""
+    return len(text.encode("utf-16-le")) // 2
+
+def _word_changes(before_line: str, after_line: str) -> tuple[list, list]:
+    """
+    Returns the changed (start, end) ranges in before_line and in after_line,
+    in UTF-16 units, found by diffing the words of both lines.
+    """
+    before_words = [m.span() for m in WORD.finditer(before_line)]
+    after_words = [m.span() for m in WORD.finditer(after_line)]
+    matcher = difflib.SequenceMatcher(
+        None,
+        [before_line[start:end] for start, end in before_words],
+        [after_line[start:end] for start, end in after_words],
+        autojunk=False,
+    )
+    if matcher.ratio() < MIN_WORD_DIFF_RATIO:
+        return [], []
+
+    before_ranges = []
+    after_ranges = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if i2 > i1:
+            start, end = before_words[i1][0], before_words[i2 - 1][1]
+            before_ranges.append((_utf16_length(before_line[:start]), _utf16_length(before_line[:end])))
+        if j2 > j1:
+            start, end = after_words[j1][0], after_words[j2 - 1][1]
+            after_ranges.append((_utf16_length(after_line[:start]), _utf16_length(after_line[:end])))
+    return before_ranges, after_ranges
+
+def compute_diff(before_code: str, after_code: str) -> dict:
+    """
+    Computes the line and word diff of two versions of a snippet once, so the
+    cards never have to diff anything.
+
+    Only the "after" code is stored in the span (with its line count, so the
+    reviewer notices if the text was changed); every hunk carries the lines it
+    removed, so the "before" code can be rebuilt from it. A hunk is
+        [after start, after line count, before start, removed lines, before words, after words]
+    where the word lists hold [line in hunk, start, end] ranges of changed words.
+    """
+    before_lines = LINE_BREAK.split(before_code)
+    after_lines = LINE_BREAK.split(after_code)
+    matcher = difflib.SequenceMatcher(None, before_lines, after_lines, autojunk=False)
+
+    hunks = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        before_words = []
+        after_words = []
+        if tag == "replace":
+            # Lines replaced one by one get their changed words marked.
+            for offset in range(min(i2 - i1, j2 - j1)):
+                before_ranges, after_ranges = _word_changes(before_lines[i1 + offset], after_lines[j1 + offset])
+                before_words += [[offset, start, end] for start, end in before_ranges]
+                after_words += [[offset, start, end] for start, end in after_ranges]
+        hunks.append([j1, j2 - j1, i1, before_lines[i1:i2], before_words, after_words])
+
+    return {"v": DIFF_FORMAT, "lines": len(after_lines), "hunks": hunks}
+
+def build_diff_span(before_code: str, after_code: str, lang: str) -> str:
+    """Builds the span stored for a before/after pair (see compute_diff)."""
+    diff = json.dumps(compute_diff(before_code, after_code), separators=(",", ":"))
+    return (
+        f'<span class="{DIFF_SPAN_CLASS}" data-language="{html.escape(lang)}" data-diff="{html.escape(diff)}">'
+        f'{html.escape(after_code, quote=False)}</span>'
+    )
+
+# The class of the rich blocks the editor dialog inserts (see codemirror_dialog.py).
+EDITOR_BLOCK_CLASS = "anki-code-block"
+
+def normalize_field_html(field_value: str) -> str:
     """
-    Finds rich CodeMirror blocks and replaces them with a simple,
+    Finds rich CodeMirror blocks in a field and replaces them with a simple,
     lightweight span containing only the raw code and language.
     """
+    # Most fields don't contain any code block, skip parsing them.
+    if EDITOR_BLOCK_CLASS not in field_value:
+        return field_value
+
+    soup = BeautifulSoup(field_value, "html.parser")
+    
+    for block in soup.select('.anki-code-block[data-raw-code]'):
+        encoded_raw_code = block.get('data-raw-code')
+        lang = block.get('data-language', 'python')
+
+        if not encoded_raw_code: continue
+
+        try:
+            raw_code = base64.b64decode(encoded_raw_code).decode('utf-8')
+
+            # Diff blocks (see the diff mode in script.js) also carry the old version.
+            encoded_before_code = block.get('data-before-code')
+            if encoded_before_code:
+                before_code = base64.b64decode(encoded_before_code).decode('utf-8')
+                block.replace_with(BeautifulSoup(build_diff_span(before_code, raw_code, lang), "html.parser"))
+                continue
+            
+            # The important part: we store the language in the span
+            # Later we will look for codemirror-anki in reviewer_script.js
+            simple_span = soup.new_tag(
+                'span', 
+                attrs={
+                    'class': CODE_SPAN_CLASS, 
+                    'data-language': lang,
+                }
+            )
+            # The dialog's token stream, so the cards can skip the tokenizer
+            # (see encodeTokenHint in script.js and decodeTokenHint in reviewer_script.js).
+            token_hint = block.get('data-tokens')
+            if token_hint:
+                simple_span['data-tokens'] = token_hint
+            simple_span.string = raw_code
+            
+            block.replace_with(simple_span)
+        except Exception as e:
+            print(f"CodeMirror Add-on: Could not process code block on save: {e}")
+    
+    return str(soup)
+
+def on_editor_will_save_note(problem, note):
+    """
+    Cleans every field of the note before it is added (see normalize_field_html).
+    """
     for field_name, field_value in note.items():
-        soup = BeautifulSoup(field_value, "html.parser")
-        
-        for block in soup.select('.anki-code-block[data-raw-code]'):
-            encoded_raw_code = block.get('data-raw-code')
-            lang = block.get('data-language', 'python')
-
-            if not encoded_raw_code: continue
-
-            try:
-                raw_code = base64.b64decode(encoded_raw_code).decode('utf-8')
-                
-                # The important part: we store the language in the span
-                # Later we will look for codemirror-anki in reviewer_script.js
-                simple_span = soup.new_tag(
-                    'span', 
-                    attrs={
-                        'class': 'codemirror-anki', 
-                        'data-language': lang,
-                    }
-                )
-                simple_span.string = raw_code
-                
-                block.replace_with(simple_span)
-            except Exception as e:
-                print(f"CodeMirror Add-on: Could not process code block on save: {e}")
-        
-        note[field_name] = str(soup)
-    return problem
\ No newline at end of file
+        note[field_name] = normalize_field_html(field_value)
+
+    # Remember which languages this field uses, so the dialog can guess the next one.
+    from . import language_stats
+    try:
+        language_stats.record_note(note)
+    except Exception as e:
+        print(f"CodeMirror Add-on: Could not update the language statistics: {e}")
+    return problem
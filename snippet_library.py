@@ -0,0 +1,280 @@
+# This file manages the user's snippet library.
+# Snippets are imported from VS Code (.json / .code-snippets) and UltiSnips (.snippets)
+# files into a small SQLite index in user_files/snippets. Every snippet is indexed by
+# the trigrams of its trigger and description, so a search only touches the
+# matching rows and only those are sent to the editor dialog.
+# The index is opened the first time it is searched, not when the dialog opens.
+
+import json
+import re
+import sqlite3
+from pathlib import Path
+from typing import Iterator, Optional
+
+from . import utils
+
+INDEX_PATH = utils.USER_FILES_PATH / "snippets" / "snippets.db"
+
+# How many results are sent to the dialog per search.
+MAX_RESULTS = 20
+
+# How many trigram candidates are fuzzy-scored per search.
+MAX_CANDIDATES = 200
+
+# Version of the index layout, stored in SQLite's user_version.
+SCHEMA_VERSION = 1
+
+# Maps VS Code / UltiSnips language names (usually the file name) to the
+# language ids used in the dialog (see starter_code.STARTER_CODE).
+SNIPPET_LANGUAGES = {
+    "python": "python",
+    "java": "text/x-java",
+    "c": "text/x-csrc",
+    "cpp": "text/x-c++src",
+    "javascript": "javascript",
+    "ruby": "ruby",
+    "html": "htmlmixed",
+    "css": "css",
+    "kotlin": "text/x-kotlin",
+    "sql": "sql",
+}
+
+_connection = None
+
+
+def _connect() -> sqlite3.Connection:
+    """Opens (and if needed creates) the index on first use."""
+    global _connection
+    if _connection is None:
+        INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _connection = sqlite3.connect(str(INDEX_PATH))
+        _connection.executescript("""
+            CREATE TABLE IF NOT EXISTS snippets (
+                id INTEGER PRIMARY KEY,
+                language TEXT NOT NULL,
+                trigger TEXT NOT NULL,
+                description TEXT NOT NULL,
+                body TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS trigrams (
+                trigram TEXT NOT NULL,
+                snippet_id INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS trigrams_by_trigram ON trigrams (trigram, snippet_id);
+            CREATE INDEX IF NOT EXISTS snippets_by_trigger ON snippets (trigger);
+        """)
+        if _connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            _upgrade_index(_connection)
+    return _connection
+
+
+def _upgrade_index(connection: sqlite3.Connection):
+    """
+    Makes every snippet unique per (language, trigger, body), so importing a file
+    again doesn't add its snippets twice. Indexes created before this may
+    already contain duplicates, only the first copy of each is kept.
+    """
+    with connection:
+        connection.execute(
+            "DELETE FROM snippets WHERE id NOT IN "
+            "(SELECT MIN(id) FROM snippets GROUP BY language, trigger, body)"
+        )
+        connection.execute("DELETE FROM trigrams WHERE snippet_id NOT IN (SELECT id FROM snippets)")
+        connection.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS snippets_unique ON snippets (language, trigger, body)"
+        )
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def _search_text(trigger: str, description: str) -> str:
+    return f"{trigger} {description}".lower()
+
+
+def _trigrams(text: str) -> set:
+    """Returns the trigrams of text; the padding lets short words match at their start."""
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _strip_placeholders(body: str) -> str:
+    """
+    Turns snippet placeholders into plain text, since the editor has no tab stops:
+    '${1:name}' -> 'name', '${1|a,b|}' -> 'a', '$1' / '${0}' -> ''.
+    """
+    body = re.sub(r"\$\{\d+\|([^,|}]*)[^}]*\|\}", r"\1", body)
+    # Repeated so nested placeholders like ${1:foo(${2:bar})} are resolved too.
+    previous = None
+    while previous != body:
+        previous = body
+        body = re.sub(r"\$\{\d+:([^{}]*)\}", r"\1", body)
+    body = re.sub(r"\$\{\d+\}|\$\d+", "", body)
+    return body.replace("\\$", "$")
+
+
+def parse_vscode_snippets(text: str) -> Iterator[tuple]:
+    """Yields (trigger, description, body, scope) from a VS Code snippet file."""
+    # VS Code allows comments and trailing commas in its JSON files.
+    text = re.sub(r"^\s*//.*$", "", text, flags=re.MULTILINE)
+    text = re.sub(r",(\s*[}\]])", r"\1", text)
+    for name, snippet in json.loads(text).items():
+        if not isinstance(snippet, dict) or "body" not in snippet:
+            continue
+        body = snippet["body"]
+        if isinstance(body, list):
+            body = "\n".join(body)
+        prefixes = snippet.get("prefix") or name
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        description = snippet.get("description") or name
+        for prefix in prefixes:
+            yield prefix, description, body, snippet.get("scope", "")
+
+
+def parse_ultisnips(text: str) -> Iterator[tuple]:
+    """Yields (trigger, description, body, scope) from an UltiSnips file."""
+    header = re.compile(r'^snippet\s+(\S+)(?:\s+"([^"]*)")?')
+    lines = iter(text.splitlines())
+    for line in lines:
+        match = header.match(line)
+        if not match:
+            continue
+        body_lines = []
+        for body_line in lines:
+            if body_line.startswith("endsnippet"):
+                break
+            body_lines.append(body_line)
+        yield match.group(1), match.group(2) or match.group(1), "\n".join(body_lines), ""
+
+
+def language_for_file(path: Path) -> Optional[str]:
+    """Guesses the language from names like 'python.json' or 'cpp.snippets'."""
+    return SNIPPET_LANGUAGES.get(path.stem.lower())
+
+
+def import_file(path: Path, language: str) -> int:
+    """
+    Imports all snippets of a snippet file into the index.
+    language is the dialog language id, or "" for snippets that apply to every language.
+    Snippets that are already in the index are skipped.
+    Returns the number of newly added snippets.
+    """
+    text = path.read_text(encoding="utf-8")
+    if path.suffix.lower() == ".snippets":
+        parsed = parse_ultisnips(text)
+    else:
+        parsed = parse_vscode_snippets(text)
+
+    connection = _connect()
+    count = 0
+    with connection:
+        for trigger, description, body, scope in parsed:
+            snippet_language = language
+            # .code-snippets files name the languages per snippet.
+            for scope_name in scope.split(","):
+                if scope_name.strip() in SNIPPET_LANGUAGES:
+                    snippet_language = SNIPPET_LANGUAGES[scope_name.strip()]
+                    break
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO snippets (language, trigger, description, body) VALUES (?, ?, ?, ?)",
+                (snippet_language, trigger, description, _strip_placeholders(body)),
+            )
+            if not cursor.rowcount:
+                continue
+            connection.executemany(
+                "INSERT INTO trigrams (trigram, snippet_id) VALUES (?, ?)",
+                ((trigram, cursor.lastrowid) for trigram in _trigrams(_search_text(trigger, description))),
+            )
+            count += 1
+    return count
+
+
+def snippet_count() -> int:
+    if not INDEX_PATH.exists():
+        return 0
+    return _connect().execute("SELECT COUNT(*) FROM snippets").fetchone()[0]
+
+
+def clear():
+    """Removes every snippet from the index."""
+    connection = _connect()
+    with connection:
+        connection.execute("DELETE FROM snippets")
+        connection.execute("DELETE FROM trigrams")
+    connection.execute("VACUUM")
+
+
+def _fuzzy_score(query: str, text: str) -> Optional[int]:
+    """
+    Scores how well query matches text as a subsequence (like most editors do).
+    Consecutive characters and matches at word starts score higher.
+    Returns None if not every character of the query appears in order.
+    """
+    score = 0
+    position = 0
+    previous_match = -2
+    for char in query:
+        index = text.find(char, position)
+        if index == -1:
+            return None
+        score += 1
+        if index == previous_match + 1:
+            score += 3
+        if index == 0 or not text[index - 1].isalnum():
+            score += 2
+        previous_match = index
+        position = index + 1
+    # Prefer shorter texts, i.e. more specific matches.
+    return score * 100 - len(text)
+
+
+def search(query: str, language: str, limit: int = MAX_RESULTS) -> list:
+    """
+    Returns up to limit snippets matching query for the given language
+    (snippets for all languages always match), best match first.
+    Each result is a dict with id, trigger, description and body.
+    """
+    query = query.strip().lower()
+    if not query or not INDEX_PATH.exists():
+        return []
+    connection = _connect()
+
+    if len(query) < 3:
+        # Too short for trigrams, a prefix search on the trigger is what users expect here.
+        rows = connection.execute(
+            "SELECT id, trigger, description FROM snippets "
+            "WHERE language IN (?, '') AND trigger LIKE ? ESCAPE '\\' ORDER BY trigger LIMIT ?",
+            (language, query.replace("%", "\\%").replace("_", "\\_") + "%", limit),
+        ).fetchall()
+        best = [(row[0], row[1], row[2]) for row in rows]
+    else:
+        trigrams = list(_trigrams(query))
+        placeholders = ",".join("?" * len(trigrams))
+        # Only snippets sharing at least one trigram with the query are looked at.
+        rows = connection.execute(
+            "SELECT s.id, s.trigger, s.description, COUNT(*) AS shared FROM trigrams t "
+            "JOIN snippets s ON s.id = t.snippet_id "
+            f"WHERE t.trigram IN ({placeholders}) AND s.language IN (?, '') "
+            "GROUP BY s.id ORDER BY shared DESC LIMIT ?",
+            (*trigrams, language, MAX_CANDIDATES),
+        ).fetchall()
+
+        scored = []
+        for snippet_id, trigger, description, shared in rows:
+            score = _fuzzy_score(query, _search_text(trigger, description))
+            if score is not None:
+                scored.append((score + shared * 10, snippet_id, trigger, description))
+        scored.sort(reverse=True)
+        best = [(snippet_id, trigger, description) for _, snippet_id, trigger, description in scored[:limit]]
+
+    if not best:
+        return []
+
+    # Bodies are only read for the results that are actually sent to the dialog.
+    ids = [snippet_id for snippet_id, _, _ in best]
+    bodies = dict(connection.execute(
+        f"SELECT id, body FROM snippets WHERE id IN ({','.join('?' * len(ids))})", ids
+    ).fetchall())
+    return [
+        {"id": snippet_id, "trigger": trigger, "description": description, "body": bodies[snippet_id]}
+        for snippet_id, trigger, description in best
+    ]
@@ -0,0 +1,486 @@
+# This is a benchmark for the add-on's share of Anki's startup time, without Anki's GUI.
+# Every run starts a fresh Python process with a stand-in for aqt (the hooks, the main
+# window and the collection operations) and a real collection, then measures:
+# - the time to import the add-on (which registers its hooks)
+# - the time of the add-on's profile_did_open handlers (template check, media clean-up scheduling)
+# - the whole run, once with and once without the add-on, so the difference is
+#   the add-on's overhead
+# It also lists the modules the add-on imported and the background operations it
+# started, so a change that imports the dialogs or BeautifulSoup at startup, or that
+# repairs templates on every start, shows up here.
+#
+# The stand-in for aqt is built from the installed aqt: its classes only have the
+# methods of the real ones, with the same parameters, so calls that Anki doesn't
+# support fail here too. It needs the anki and aqt packages (aqt's source is read,
+# Qt doesn't have to work):
+#
+#   pip install anki aqt beautifulsoup4
+#   python -m <add-on folder>.startup_benchmark --output report.json
+#   python -m <add-on folder>.startup_benchmark --output new.json --baseline report.json
+#
+# (run it from the folder that contains the add-on folder)
+#
+# Two collections are measured: one as it is after the add-on ran before
+# ("fingerprinted") and one without the stored template fingerprints, like the
+# first start after an update ("upgraded"). With --baseline, every case is
+# compared with an earlier report. The exit code is 1 if the add-on's overhead
+# grew by more than --max-slowdown, so it can guard CI runs.
+
+import argparse
+import ast
+import importlib.metadata
+import importlib.util
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from . import asset_manager
+from . import config
+from . import template_manager
+from . import utils
+
+SCENARIOS = ["fingerprinted", "upgraded"]
+
+DEFAULT_NOTE_TYPES = 50
+DEFAULT_INJECTED = 10
+
+# A case counts as a regression if the add-on's overhead is this much bigger than in the baseline...
+DEFAULT_MAX_SLOWDOWN = 1.25
+# ...and at least this many milliseconds bigger (smaller differences are noise).
+MIN_REGRESSION_MS = 5.0
+
+# Modules that must not be imported before a feature is used (see __init__.py).
+DEFERRED_MODULES = ["bs4", "hooks", "save_handler", "codemirror_dialog", "config_dialog", "import_dialog", "snippet_library"]
+
+# The parts of aqt the add-on uses at startup: (file in the aqt package, class or function names).
+# The stand-in for aqt gets exactly these methods, with the parameters of the installed
+# aqt (read from its source, so Qt doesn't have to work), and nothing else.
+AQT_API = [
+    ("aqt/operations/__init__.py", ["CollectionOp", "QueryOp"]),
+    ("aqt/progress.py", ["ProgressManager"]),
+    ("aqt/taskman.py", ["TaskManager"]),
+    ("aqt/addons.py", ["AddonManager"]),
+    ("aqt/utils.py", ["tooltip", "openFolder", "showInfo", "askUser"]),
+]
+HOOKS_FILE = "_aqt/hooks.py"
+
+
+class ApiNotFound(Exception):
+    pass
+
+
+def _signature_source(function: ast.FunctionDef) -> str:
+    """A stub with the parameters of function, without annotations and with placeholder defaults."""
+    arguments = function.args
+    for argument in arguments.posonlyargs + arguments.args + arguments.kwonlyargs + [arguments.vararg, arguments.kwarg]:
+        if argument is not None:
+            argument.annotation = None
+    arguments.defaults = [ast.Constant(None) for _ in arguments.defaults]
+    arguments.kw_defaults = [None if default is None else ast.Constant(None) for default in arguments.kw_defaults]
+    stub = ast.FunctionDef(name=function.name, args=arguments, body=[ast.Pass()], decorator_list=[], returns=None)
+    return ast.unparse(ast.fix_missing_locations(stub))
+
+
+def _is_plain_method(function: ast.FunctionDef) -> bool:
+    decorators = {getattr(decorator, "id", getattr(decorator, "attr", "")) for decorator in function.decorator_list}
+    return not decorators & {"staticmethod", "classmethod", "property", "overload"}
+
+
+def load_aqt_api() -> dict:
+    """
+    Reads the signatures of AQT_API and the hook names from the installed aqt.
+    Returns {"functions": {"aqt.module.name": stub source}, "classes": {"aqt.module.Class":
+    {method: stub source}}, "hooks": [names], "version": aqt version}.
+    """
+    spec = importlib.util.find_spec("aqt")
+    hooks_spec = importlib.util.find_spec("_aqt")
+    if spec is None or hooks_spec is None:
+        raise ApiNotFound("the startup measurement needs the aqt package to check its stand-in for aqt (pip install aqt)")
+    site_packages = Path(spec.submodule_search_locations[0]).parent
+
+    api = {"functions": {}, "classes": {}, "hooks": [], "version": importlib.metadata.version("aqt")}
+    for file_name, names in AQT_API:
+        module_name = file_name[:-len(".py")].replace("/__init__", "").replace("/", ".")
+        tree = ast.parse((site_packages / file_name).read_text(encoding="utf-8"))
+        for node in tree.body:
+            if getattr(node, "name", None) not in names:
+                continue
+            if isinstance(node, ast.ClassDef):
+                api["classes"][f"{module_name}.{node.name}"] = {
+                    item.name: _signature_source(item) for item in node.body
+                    if isinstance(item, ast.FunctionDef) and _is_plain_method(item)
+                }
+            elif isinstance(node, ast.FunctionDef):
+                api["functions"][f"{module_name}.{node.name}"] = _signature_source(node)
+
+    # The hooks are module attributes like 'profile_did_open = _ProfileDidOpenHook()'.
+    tree = ast.parse((site_packages / HOOKS_FILE).read_text(encoding="utf-8"))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name):
+            if node.value.func.id.startswith("_") and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                api["hooks"].append(node.targets[0].id)
+    return api
+
+
+# Builds the stand-in for aqt from the API read by load_aqt_api. Every class and
+# function only accepts the calls the real one accepts (anything else raises
+# ApiMismatch or AttributeError), so the add-on can't rely on an API Anki doesn't
+# have. Only Qt's QAction is a plain fake, since PyQt may not load without a display.
+STAND_IN_SCRIPT = r"""
+import inspect, types
+
+class ApiMismatch(Exception):
+    pass
+
+def _signature(source):
+    namespace = {}
+    exec(source, namespace)
+    return inspect.signature(next(value for key, value in namespace.items() if key != "__builtins__"))
+
+def _check(name, signature, args, kwargs):
+    try:
+        signature.bind(*args, **kwargs)
+    except TypeError as e:
+        raise ApiMismatch(f"{name}: {e}") from None
+
+def strict_class(api, qualname, implementations=None):
+    implementations = implementations or {}
+    if qualname not in api["classes"]:
+        raise ApiMismatch(f"aqt has no {qualname}")
+    signatures = {name: _signature(source) for name, source in api["classes"][qualname].items()}
+    missing = sorted(set(implementations) - set(signatures))
+    if missing:
+        raise ApiMismatch(f"{qualname} has no {', '.join(missing)}")
+
+    def method(name):
+        def call(self, *args, **kwargs):
+            _check(f"{qualname}.{name}", signatures[name], (self,) + args, kwargs)
+            implementation = implementations.get(name)
+            return implementation(self, *args, **kwargs) if implementation else None
+        return call
+
+    return type(qualname.rsplit(".", 1)[1], (), {name: method(name) for name in signatures})
+
+def strict_function(api, qualname, implementation=None):
+    if qualname not in api["functions"]:
+        raise ApiMismatch(f"aqt has no {qualname}")
+    signature = _signature(api["functions"][qualname])
+    def call(*args, **kwargs):
+        _check(qualname, signature, args, kwargs)
+        return implementation(*args, **kwargs) if implementation else None
+    return call
+
+def instance(cls, **attributes):
+    # Created without the real constructor (which needs the whole GUI).
+    obj = cls.__new__(cls)
+    obj.__dict__.update(attributes)
+    return obj
+
+class Hook(list):
+    def __call__(self, *hook_args):
+        for handler in list(self):
+            handler(*hook_args)
+
+class _Signal:
+    def connect(self, slot):
+        assert callable(slot)
+
+class QAction:
+    def __init__(self, text, parent=None):
+        self.triggered = _Signal()
+
+class _Menu:
+    def addAction(self, action):
+        assert isinstance(action, QAction)
+
+def build_aqt(api, col, addon_config):
+    # Returns the aqt modules and a record of what the add-on started.
+    record = {"operations": [], "single_shots": []}
+
+    def operation_init(self, *args, **kwargs):
+        self.started = False
+    def chain(self, *args, **kwargs):
+        return self
+    def run_in_background(self, *args, **kwargs):
+        # Background work doesn't block the start, it is only counted.
+        record["operations"].append(type(self).__name__)
+    operation = {"__init__": operation_init, "success": chain, "failure": chain, "run_in_background": run_in_background}
+    query_operation = dict(operation, with_progress=chain, without_collection=chain)
+    del query_operation["success"]
+
+    gui_hooks = types.ModuleType("aqt.gui_hooks")
+    for name in api["hooks"]:
+        setattr(gui_hooks, name, Hook())
+
+    addon_manager = instance(strict_class(api, "aqt.addons.AddonManager", {
+        "addonFromModule": lambda self, module: module.split(".")[0],
+        "getConfig": lambda self, module: addon_config,
+    }))
+    progress = instance(strict_class(api, "aqt.progress.ProgressManager", {
+        "single_shot": lambda self, ms, func, *args, **kwargs: record["single_shots"].append(ms),
+    }))
+    mw = types.SimpleNamespace(
+        col=col,
+        addonManager=addon_manager,
+        progress=progress,
+        taskman=instance(strict_class(api, "aqt.taskman.TaskManager")),
+        form=types.SimpleNamespace(menuTools=_Menu()),
+    )
+
+    aqt = types.ModuleType("aqt")
+    aqt.mw = mw
+    aqt.gui_hooks = gui_hooks
+    aqt.qt = types.ModuleType("aqt.qt")
+    aqt.qt.QAction = QAction
+    aqt.utils = types.ModuleType("aqt.utils")
+    for name in ("tooltip", "openFolder", "showInfo", "askUser"):
+        setattr(aqt.utils, name, strict_function(api, f"aqt.utils.{name}"))
+    aqt.operations = types.ModuleType("aqt.operations")
+    aqt.operations.CollectionOp = strict_class(api, "aqt.operations.CollectionOp", operation)
+    aqt.operations.QueryOp = strict_class(api, "aqt.operations.QueryOp", query_operation)
+    modules = {
+        "aqt": aqt, "aqt.gui_hooks": gui_hooks, "aqt.qt": aqt.qt,
+        "aqt.utils": aqt.utils, "aqt.operations": aqt.operations,
+    }
+    return modules, record
+"""
+
+# Runs in the fresh process. Anki imports its own modules and opens the
+# collection before any add-on is loaded, so that happens before the clock
+# for the add-on starts.
+CHILD_SCRIPT = r"""
+import importlib, json, sys, time
+started = time.perf_counter()
+args = json.loads(sys.argv[1])
+sys.path.insert(0, args["addon_parent"])
+
+from anki.collection import Collection
+import anki.notes
+""" + STAND_IN_SCRIPT + r"""
+col = Collection(args["collection"])
+modules, record = build_aqt(args["api"], col, args["config"])
+sys.modules.update(modules)
+
+modules_before = set(sys.modules)
+import_start = time.perf_counter()
+if args["with_addon"]:
+    importlib.import_module(args["package"])
+import_end = time.perf_counter()
+modules["aqt.gui_hooks"].profile_did_open()
+profile_open_end = time.perf_counter()
+
+col.close()
+print("CODE_MIRROR_STARTUP_RESULT " + json.dumps({
+    "import_ms": (import_end - import_start) * 1000,
+    "profile_open_ms": (profile_open_end - import_end) * 1000,
+    "total_ms": (profile_open_end - started) * 1000,
+    "modules": sorted(set(sys.modules) - modules_before),
+    "operations": record["operations"],
+    "single_shots": len(record["single_shots"]),
+}))
+"""
+
+RESULT_MARKER = "CODE_MIRROR_STARTUP_RESULT "
+
+
+def build_collection(path: Path, note_types: int, injected: int, theme: str, fingerprinted: bool) -> list:
+    """
+    Creates a collection with note_types copies of the Basic note type, of which
+    the first injected ones have the resources block, the way the add-on leaves
+    them. Returns the ids of the injected note types.
+    """
+    from anki.collection import Collection
+
+    col = Collection(str(path))
+    try:
+        basic = col.models.by_name("Basic")
+        resources_html = asset_manager.get_mobile_resources_html(theme, col)
+        injected_ids = []
+        for i in range(note_types):
+            model = col.models.copy(basic, add=False)
+            model['name'] = f"Benchmark {i}"
+            if i < injected:
+                template_manager.inject_into_model(model, resources_html, True)
+            col.models.add_dict(model)
+            if i < injected:
+                injected_ids.append(col.models.by_name(model['name'])['id'])
+
+        if fingerprinted:
+            previous_config = dict(config.CONFIG)
+            config.CONFIG[config.CONFIG_KEY_INJECT_MODELS] = injected_ids
+            template_manager.record_fingerprints(col)
+            config.CONFIG.clear()
+            config.CONFIG.update(previous_config)
+    finally:
+        col.close()
+    return injected_ids
+
+
+def run_child(collection: Path, addon_config: dict, with_addon: bool, api: dict) -> dict:
+    """Measures one start in a fresh process."""
+    args = {
+        "addon_parent": str(utils.ADDON_PATH.parent),
+        "package": utils.ADDON_PACKAGE,
+        "collection": str(collection),
+        "config": addon_config,
+        "with_addon": with_addon,
+        "api": api,
+    }
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, json.dumps(args)],
+        capture_output=True, text=True,
+    )
+    if completed.returncode:
+        raise RuntimeError(f"The benchmark process failed:\n{completed.stderr}")
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    raise RuntimeError(f"No result from the benchmark process: {completed.stderr}")
+
+
+def deferred_modules_imported(modules: list) -> list:
+    """Returns the modules of DEFERRED_MODULES the add-on imported at startup."""
+    names = set()
+    for module in modules:
+        parts = module.split(".")
+        if parts[0] == utils.ADDON_PACKAGE and len(parts) > 1:
+            names.add(parts[1])
+        else:
+            names.add(parts[0])
+    return [name for name in DEFERRED_MODULES if name in names]
+
+
+def measure_scenario(scenario: str, workdir: Path, note_types: int, injected: int, theme: str, repeat: int, api: dict) -> dict:
+    """Runs one scenario repeat times with and without the add-on and condenses the runs into medians."""
+    template_path = workdir / f"{scenario}.anki2"
+    injected_ids = build_collection(template_path, note_types, injected, theme, scenario == "fingerprinted")
+    addon_config = {
+        config.CONFIG_KEY_GLOBAL_THEME: theme,
+        config.CONFIG_KEY_INJECT_MODELS: injected_ids,
+    }
+
+    runs = {True: [], False: []}
+    for i in range(repeat):
+        # Alternating the runs spreads noise (other processes, disk caches) over both.
+        for with_addon in (False, True):
+            # Every start gets its own copy, since the add-on writes to the collection.
+            collection = workdir / f"{scenario}-{i}-{int(with_addon)}.anki2"
+            collection.write_bytes(template_path.read_bytes())
+            runs[with_addon].append(run_child(collection, addon_config, with_addon, api))
+
+    with_addon_runs = runs[True]
+    last_run = with_addon_runs[-1]
+    without_ms = statistics.median(run["total_ms"] for run in runs[False])
+    with_ms = statistics.median(run["total_ms"] for run in with_addon_runs)
+    return {
+        "key": scenario,
+        "case": {"scenario": scenario, "note_types": note_types, "injected": injected, "theme": theme},
+        "runs": repeat,
+        "import_ms": statistics.median(run["import_ms"] for run in with_addon_runs),
+        "profile_open_ms": statistics.median(run["profile_open_ms"] for run in with_addon_runs),
+        "total_with_addon_ms": with_ms,
+        "total_without_addon_ms": without_ms,
+        "overhead_ms": with_ms - without_ms,
+        "modules_imported": len(last_run["modules"]),
+        "deferred_modules_imported": deferred_modules_imported(last_run["modules"]),
+        "operations_started": last_run["operations"],
+        "single_shots": last_run["single_shots"],
+    }
+
+
+def run_benchmark(scenarios: list, note_types: int, injected: int, theme: str, repeat: int, api: dict) -> list:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="codemirror_anki_startup_") as workdir:
+        for scenario in scenarios:
+            entry = measure_scenario(scenario, Path(workdir), note_types, injected, theme, repeat, api)
+            results.append(entry)
+            print(
+                f"{entry['key']}: import {entry['import_ms']:.1f} ms, "
+                f"profile open {entry['profile_open_ms']:.1f} ms, overhead {entry['overhead_ms']:.1f} ms"
+            )
+    return results
+
+
+def compare_with_baseline(results: list, baseline: dict, max_slowdown: float) -> list:
+    """Returns one comparison row per scenario that exists in both reports."""
+    baseline_results = {entry["key"]: entry for entry in baseline.get("results", [])}
+    comparison = []
+    for entry in results:
+        old = baseline_results.get(entry["key"])
+        if not old or old.get("overhead_ms") is None:
+            continue
+        old_ms = old["overhead_ms"]
+        new_ms = entry["overhead_ms"]
+        ratio = new_ms / old_ms if old_ms > 0 else None
+        comparison.append({
+            "key": entry["key"],
+            "baseline_ms": old_ms,
+            "current_ms": new_ms,
+            "ratio": ratio,
+            "regression": new_ms - old_ms >= MIN_REGRESSION_MS and (ratio is None or ratio > max_slowdown),
+        })
+    return comparison
+
+
+def environment_info(api: dict) -> dict:
+    info = {"python": platform.python_version(), "platform": platform.platform(), "aqt": api["version"]}
+    try:
+        from anki.buildinfo import version
+        info["anki"] = version
+    except ImportError:
+        pass
+    return info
+
+
+def _str_list(text: str) -> list:
+    return [value for value in text.split(",") if value]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure how much the add-on adds to Anki's startup time.")
+    parser.add_argument("--output", type=Path, required=True, help="where to write the JSON report")
+    parser.add_argument("--baseline", type=Path, help="an earlier report to compare with")
+    parser.add_argument("--scenarios", type=_str_list, default=SCENARIOS, help="comma separated, of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--note-types", type=int, default=DEFAULT_NOTE_TYPES, help=f"note types in the collection (default: {DEFAULT_NOTE_TYPES})")
+    parser.add_argument("--injected", type=int, default=DEFAULT_INJECTED, help=f"note types with CodeMirror enabled (default: {DEFAULT_INJECTED})")
+    parser.add_argument("--theme", default="dracula", help="the CodeMirror theme (default: dracula)")
+    parser.add_argument("--repeat", type=int, default=7, help="starts per case, the median is reported (default: 7)")
+    parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN, help="allowed overhead ratio against the baseline (default: 1.25)")
+    args = parser.parse_args(argv)
+
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario: {scenario}")
+    if not asset_manager.get_theme_css(args.theme):
+        parser.error(f"unknown theme: {args.theme}")
+    try:
+        api = load_aqt_api()
+    except ApiNotFound as e:
+        parser.error(str(e))
+
+    results = run_benchmark(args.scenarios, args.note_types, min(args.injected, args.note_types), args.theme, max(1, args.repeat), api)
+    report = {"environment": environment_info(api), "repeat": args.repeat, "results": results}
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        report["baseline"] = {"path": str(args.baseline), "environment": baseline.get("environment")}
+        report["comparison"] = compare_with_baseline(results, baseline, args.max_slowdown)
+        regressions = [row for row in report["comparison"] if row["regression"]]
+        for row in regressions:
+            print(f"Regression: {row['key']} {row['baseline_ms']:.1f} ms -> {row['current_ms']:.1f} ms")
+    for entry in results:
+        if entry["deferred_modules_imported"]:
+            print(f"{entry['key']}: imported at startup: {', '.join(entry['deferred_modules_imported'])}")
+
+    args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Wrote {args.output}.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
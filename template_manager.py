@@ -2,9 +2,11 @@
 # (CSS and JS links) into the user's Anki card templates. It reads the add-on's
 # configuration to determine which note types should have the CodeMirror functionality
 # enabled and then modifies their templates accordingly.
+# It also remembers a fingerprint of every injected note type, so templates that lose
+# the injection later (edited by hand, replaced by a deck import, ...) are found and
+# repaired cheaply without parsing every template again.
 
-from aqt import mw
-from bs4 import BeautifulSoup
+import zlib
 
 # Import modules from within the add-on.
 from . import asset_manager 
@@ -14,6 +16,62 @@ from . import config
 # that will be injected. This ensures consistency and avoids conflicts.
 INJECTION_ID = f"{asset_manager.PREFIX}resources"
 
+# Key in the collection config that stores the fingerprints of the injected note types.
+FINGERPRINTS_CONF_KEY = "anki_codemirror_template_fingerprints"
+
+def inject_into_model(model: dict, resources_html: str, should_have_injection: bool) -> bool:
+    """
+    Adds, updates or removes the resources block in every template of a single
+    note type (model). Returns True if any template was changed; saving the
+    model is left to the caller.
+
+    This works on plain model dicts and doesn't need Anki's GUI, so the
+    command-line tool (cli.py) uses it as well.
+    """
+    # BeautifulSoup is only needed when templates are actually changed,
+    # so it isn't imported just for the startup check.
+    from bs4 import BeautifulSoup
+
+    # The block as BeautifulSoup writes it, so an up-to-date block is left alone.
+    normalised_html = str(BeautifulSoup(resources_html, "html.parser"))
+    model_changed = False
+
+    # Each model can have multiple card templates (e.g., Card 1, Card 2).
+    for template in model['tmpls']:
+        
+        # Process both the front ('qfmt') and back ('afmt') of the card template.
+        for key in ['qfmt', 'afmt']:
+            # Use BeautifulSoup to safely and easily parse and manipulate the HTML.
+            soup = BeautifulSoup(template[key], "html.parser")
+            existing_div = soup.find("div", {"id": INJECTION_ID})
+            template_changed = False
+
+            if should_have_injection:
+                # --- ADD OR UPDATE INJECTION ---
+                if existing_div:
+                    # If the div already exists, check if it's outdated.
+                    # This ensures changes (like a new asset list) are applied.
+                    if str(existing_div) != normalised_html:
+                        existing_div.replace_with(BeautifulSoup(resources_html, "html.parser"))
+                        template_changed = True
+                else:
+                    # If the div doesn't exist, append it to the end of the template.
+                    soup.append(BeautifulSoup(resources_html, "html.parser"))
+                    template_changed = True
+            
+            elif existing_div:
+                # --- REMOVE INJECTION ---
+                # If the model should not have the injection but the div is found, remove it.
+                existing_div.decompose()
+                template_changed = True
+            
+            # If any modifications were made, update the template's HTML content.
+            if template_changed:
+                template[key] = str(soup)
+                model_changed = True
+
+    return model_changed
+
 def apply_template_injections():
     """
     The main function that orchestrates the template modification process.
@@ -23,11 +81,13 @@ def apply_template_injections():
     1. Injects the HTML block containing asset links into the card templates.
     2. Removes a previously injected HTML block if it's no longer needed.
     """
+    from aqt import mw
+
     # Retrieve the user's chosen theme from the configuration.
     global_theme = config.CONFIG.get(config.CONFIG_KEY_GLOBAL_THEME, 'dracula')
     
-    # Call the asset manager to generate the complete, self-contained HTML block
-    # that links to all necessary CSS and JS files for the reviewer.
+    # Call the asset manager to sync all assets and generate the HTML block
+    # that loads them in the reviewer.
     resources_html = asset_manager.get_mobile_resources_html(global_theme)
 
     # Get the set of note type IDs that the user has selected for injection.
@@ -44,48 +104,160 @@ def apply_template_injections():
         
         # Determine if the current model *should* have the CodeMirror assets.
         should_have_injection = model['id'] in injected_ids
-        model_changed = False
-
-        # Each model can have multiple card templates (e.g., Card 1, Card 2).
-        for template in model['tmpls']:
-            
-            # Process both the front ('qfmt') and back ('afmt') of the card template.
-            for key in ['qfmt', 'afmt']:
-                # Use BeautifulSoup to safely and easily parse and manipulate the HTML.
-                soup = BeautifulSoup(template[key], "html.parser")
-                existing_div = soup.find("div", {"id": INJECTION_ID})
-
-                if should_have_injection:
-                    # --- ADD OR UPDATE INJECTION ---
-                    if existing_div:
-                        # If the div already exists, check if it's outdated.
-                        # This ensures changes (like a theme update) are applied.
-                        if str(existing_div) != resources_html:
-                            existing_div.replace_with(BeautifulSoup(resources_html, "html.parser"))
-                            model_changed = True
-                    else:
-                        # If the div doesn't exist, append it to the end of the template.
-                        soup.append(BeautifulSoup(resources_html, "html.parser"))
-                        model_changed = True
-                
-                elif not should_have_injection and existing_div:
-                    # --- REMOVE INJECTION ---
-                    # If the model should not have the injection but the div is found, remove it.
-                    existing_div.decompose()
-                    model_changed = True
-                
-                # If any modifications were made, update the template's HTML content.
-                if model_changed:
-                    template[key] = str(soup)
 
         # If any of the templates for this model were changed, save the model.
-        if model_changed:
+        if inject_into_model(model, resources_html, should_have_injection):
             something_changed = True
             mw.col.models.save(model)
             
     mw.progress.finish()
+    record_fingerprints(mw.col)
     
     # If any models were updated, a reset is required for changes to take full effect,
     # especially for clearing webview caches.
     if something_changed:
         mw.reset()
+
+def has_resources_block(template: dict, resources_html: str) -> bool:
+    """
+    Whether both sides of a card template contain the current resources block.
+    Uses a plain substring test, no HTML parsing (build_resources_html already
+    returns the block the way it is stored).
+    """
+    return resources_html in template['qfmt'] and resources_html in template['afmt']
+
+def has_outdated_injections(col=None) -> bool:
+    """
+    Cheaply checks whether any selected note type still lacks the current
+    resources block (e.g. templates injected by an older version of the add-on,
+    which had the theme baked in).
+    """
+    if col is None:
+        from aqt import mw
+        col = mw.col
+
+    resources_html = asset_manager.build_resources_html()
+    for model_id in config.CONFIG.get(config.CONFIG_KEY_INJECT_MODELS, []):
+        model = col.models.get(model_id)
+        if not model:
+            continue
+        for template in model['tmpls']:
+            if not has_resources_block(template, resources_html):
+                return True
+    return False
+
+# --- Integrity check ---
+
+def _hash(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+def _template_hash(template: dict) -> int:
+    return _hash(template['qfmt'] + "\0" + template['afmt'])
+
+def _modification_times(col) -> dict:
+    """Returns note type id -> modification time, for all note types in one query."""
+    return dict(col.db.all("SELECT id, mtime_secs FROM notetypes"))
+
+def record_fingerprints(col):
+    """
+    Remembers the modification time and a hash of every template of the
+    selected note types, plus a hash of the current resources block.
+    """
+    modification_times = _modification_times(col)
+    models = {}
+    for model_id in config.CONFIG.get(config.CONFIG_KEY_INJECT_MODELS, []):
+        model = col.models.get(model_id)
+        if model:
+            models[str(model_id)] = {
+                "mod": modification_times.get(model_id, model['mod']),
+                "tmpls": [_template_hash(template) for template in model['tmpls']],
+            }
+    col.set_config(FINGERPRINTS_CONF_KEY, {
+        "resources": _hash(asset_manager.build_resources_html()),
+        "models": models,
+    })
+
+def find_drifted_models(col) -> tuple[list, bool]:
+    """
+    Returns the ids of the selected note types that lost their resources block,
+    and whether any stored fingerprint is out of date.
+
+    Note types that weren't modified since they were injected are skipped after a
+    single query. Of the others, only the templates whose hash changed are searched
+    (see has_resources_block), so ordinary template edits don't count as drift.
+    """
+    resources_html = asset_manager.build_resources_html()
+    stored = col.get_config(FINGERPRINTS_CONF_KEY, None) or {}
+    # A new add-on version can change the resources block, then every template has to be looked at.
+    if stored.get("resources") == _hash(resources_html):
+        fingerprints = stored.get("models", {})
+    else:
+        fingerprints = {}
+
+    modification_times = _modification_times(col)
+    drifted_ids = []
+    fingerprints_outdated = False
+    for model_id in config.CONFIG.get(config.CONFIG_KEY_INJECT_MODELS, []):
+        if model_id not in modification_times:
+            continue
+        fingerprint = fingerprints.get(str(model_id))
+        if fingerprint and fingerprint["mod"] == modification_times[model_id]:
+            continue
+
+        fingerprints_outdated = True
+        known_hashes = set(fingerprint["tmpls"]) if fingerprint else set()
+        model = col.models.get(model_id)
+        for template in model['tmpls']:
+            if _template_hash(template) in known_hashes:
+                continue
+            if not has_resources_block(template, resources_html):
+                drifted_ids.append(model_id)
+                break
+    return drifted_ids, fingerprints_outdated
+
+_repair_running = False
+
+def check_template_injections():
+    """
+    Called when the profile opens and whenever note types change. Repairs the
+    note types that lost their injection in the background, as one undo step.
+    """
+    global _repair_running
+    from aqt import mw
+
+    if not mw.col or _repair_running:
+        return
+
+    drifted_ids, fingerprints_outdated = find_drifted_models(mw.col)
+    if not drifted_ids:
+        if fingerprints_outdated:
+            record_fingerprints(mw.col)
+        return
+
+    from aqt.operations import CollectionOp
+    from aqt.utils import tooltip
+
+    global_theme = config.CONFIG.get(config.CONFIG_KEY_GLOBAL_THEME, 'dracula')
+
+    def op(col):
+        undo_position = col.add_custom_undo_entry("Repair CodeMirror Templates")
+        resources_html = asset_manager.get_mobile_resources_html(global_theme, col)
+        for model_id in drifted_ids:
+            model = col.models.get(model_id)
+            if model and inject_into_model(model, resources_html, True):
+                col.models.update_dict(model)
+        record_fingerprints(col)
+        return col.merge_undoable_ops(undo_position)
+
+    def on_success(_):
+        global _repair_running
+        _repair_running = False
+        tooltip(f"CodeMirror: Repaired the templates of {len(drifted_ids)} note types.")
+
+    def on_failure(error: Exception):
+        global _repair_running
+        _repair_running = False
+        print(f"CodeMirror Add-on: Could not repair templates: {error}")
+
+    _repair_running = True
+    CollectionOp(parent=mw, op=op).success(on_success).failure(on_failure).run_in_background()
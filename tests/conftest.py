@@ -0,0 +1,73 @@
+# Shared fixtures for the add-on's tests. They run without Anki's GUI: the
+# add-on folder is imported as a package (its __init__ only registers hooks
+# when aqt is available) and the tests work on plain note type dicts.
+
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+ADDON_DIR = Path(__file__).resolve().parents[1]
+
+# The add-on is a package named after its folder, so its parent has to be importable.
+if str(ADDON_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(ADDON_DIR.parent))
+
+
+@pytest.fixture
+def addon_module():
+    """Imports a module of the add-on by name, e.g. addon_module("template_manager")."""
+    return lambda name: importlib.import_module(f"{ADDON_DIR.name}.{name}")
+
+
+class FakeModels:
+    def __init__(self, models: list):
+        self.by_id = {model['id']: model for model in models}
+
+    def get(self, model_id):
+        return self.by_id.get(model_id)
+
+    def all(self) -> list:
+        return list(self.by_id.values())
+
+
+class FakeDB:
+    def __init__(self, models: FakeModels):
+        self.models = models
+
+    def all(self, sql: str) -> list:
+        # Only the query template_manager._modification_times runs.
+        assert sql == "SELECT id, mtime_secs FROM notetypes"
+        return [(model['id'], model['mod']) for model in self.models.all()]
+
+
+class FakeCollection:
+    """The parts of a collection template_manager reads, for a few note type dicts."""
+
+    def __init__(self, models: list):
+        self.models = FakeModels(models)
+        self.db = FakeDB(self.models)
+        self.conf = {}
+
+    def get_config(self, key, default=None):
+        return self.conf.get(key, default)
+
+    def set_config(self, key, value):
+        self.conf[key] = value
+
+
+def make_model(model_id: int, qfmt: str = "{{Front}}", afmt: str = "{{FrontSide}}<hr id=answer>{{Back}}") -> dict:
+    return {"id": model_id, "name": f"Model {model_id}", "mod": 0, "css": "", "tmpls": [{"qfmt": qfmt, "afmt": afmt}]}
+
+
+@pytest.fixture
+def injected_config(addon_module):
+    """Selects note type 1 for injection and restores the config afterwards."""
+    config = addon_module("config")
+    previous = dict(config.CONFIG)
+    config.CONFIG.clear()
+    config.CONFIG[config.CONFIG_KEY_INJECT_MODELS] = [1]
+    yield config
+    config.CONFIG.clear()
+    config.CONFIG.update(previous)
@@ -0,0 +1,58 @@
+# Checks how asset_manager writes and replaces its files in the media folder.
+
+import pytest
+
+
+class FolderMedia:
+    def __init__(self, folder):
+        self.folder = folder
+        self.trashed = []
+
+    def dir(self) -> str:
+        return str(self.folder)
+
+    def write_data(self, name: str, data: bytes) -> str:
+        (self.folder / name).write_bytes(data)
+        return name
+
+    def trash_files(self, names: list):
+        self.trashed.extend(names)
+        for name in names:
+            (self.folder / name).unlink()
+
+
+class FolderCollection:
+    def __init__(self, folder):
+        self.media = FolderMedia(folder)
+
+
+@pytest.fixture
+def col(tmp_path):
+    return FolderCollection(tmp_path)
+
+
+def test_rewrite_removes_hashed_copies_only(addon_module, col, tmp_path):
+    asset_manager = addon_module("asset_manager")
+    for name in (
+        "_codemirror_anki_runmode.js",
+        "_codemirror_anki_runmode-" + "0123456789abcdef" * 2 + "01234567.js",
+        "_codemirror_anki_runmode-standalone.js",
+        "_codemirror_anki_runmode.node.js",
+    ):
+        (tmp_path / name).write_bytes(b"old")
+
+    asset_manager._write_media_file("_codemirror_anki_runmode.js", b"new", col)
+
+    assert sorted(col.media.trashed) == [
+        "_codemirror_anki_runmode-" + "0123456789abcdef" * 2 + "01234567.js",
+        "_codemirror_anki_runmode.js",
+    ]
+    assert (tmp_path / "_codemirror_anki_runmode.js").read_bytes() == b"new"
+    assert (tmp_path / "_codemirror_anki_runmode-standalone.js").exists()
+
+
+def test_unchanged_file_is_not_rewritten(addon_module, col, tmp_path):
+    asset_manager = addon_module("asset_manager")
+    (tmp_path / "_codemirror_anki_loader.js").write_bytes(b"same")
+    asset_manager._write_media_file("_codemirror_anki_loader.js", b"same", col)
+    assert col.media.trashed == []
@@ -0,0 +1,70 @@
+# Runs the command-line tool on small .apkg and .colpkg packages. Needs the anki package.
+
+import pytest
+
+anki = pytest.importorskip("anki", reason="the command-line tests need the anki package (pip install anki)")
+pytest.importorskip("bs4", reason="the command-line tests need beautifulsoup4")
+
+CODE = "def greet(name):\n    return f'Hello {name}'"
+
+
+@pytest.fixture
+def cli(addon_module):
+    return addon_module("cli")
+
+
+def make_package(addon_module, path):
+    """Writes a package with one Basic note holding a code block and one note without code."""
+    from anki.collection import Collection, ExportAnkiPackageOptions
+
+    save_handler = addon_module("save_handler")
+    col = Collection(str(path.parent / f"source-{path.suffix[1:]}.anki2"))
+    try:
+        model = col.models.by_name("Basic")
+        deck_id = col.decks.id("Default")
+        for front in (save_handler.build_code_span(CODE, "python"), "Plain text"):
+            note = col.new_note(model)
+            note["Front"] = front
+            col.add_note(note, deck_id)
+
+        if path.suffix == ".colpkg":
+            col.export_collection_package(str(path), include_media=True, legacy=False)
+        else:
+            col.export_anki_package(
+                out_path=str(path),
+                options=ExportAnkiPackageOptions(
+                    with_scheduling=True, with_deck_configs=True, with_media=True, legacy=False
+                ),
+                limit=None,
+            )
+    finally:
+        col.close()
+
+
+@pytest.mark.parametrize("suffix", [".apkg", ".colpkg"])
+def test_cli_injects_package(addon_module, cli, tmp_path, suffix):
+    asset_manager = addon_module("asset_manager")
+    template_manager = addon_module("template_manager")
+    package = tmp_path / f"input{suffix}"
+    output = tmp_path / f"output{suffix}"
+    make_package(addon_module, package)
+
+    assert cli.main([str(package), str(output), "--theme", "eclipse"]) == 0
+
+    workdir = tmp_path / "check"
+    workdir.mkdir()
+    col = cli.open_package(output, workdir)
+    try:
+        assert col.note_count() == 2
+        # An .apkg imported into a new collection can get its own copy of Basic, so go by the note.
+        note = col.get_note(col.find_notes("greet")[0])
+        template = note.note_type()['tmpls'][0]
+        assert template_manager.has_resources_block(template, asset_manager.build_resources_html())
+        media_dir = workdir / "collection.media"
+        media_files = {path.name for path in media_dir.iterdir()}
+        assert asset_manager.RUNTIME_CONFIG_FILENAME in media_files
+        assert "_codemirror_anki_loader.js" in media_files
+        runtime = (media_dir / asset_manager.RUNTIME_CONFIG_FILENAME).read_text(encoding="utf-8")
+        assert '"theme": "eclipse"' in runtime
+    finally:
+        col.close()
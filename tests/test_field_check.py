@@ -0,0 +1,62 @@
+# Checks the cloze-aware field check on a real collection. Needs the anki package.
+
+import pytest
+
+pytest.importorskip("anki", reason="the field check tests need the anki package (pip install anki)")
+
+CODE_CLOZE = '<span class="cm-keyword">{{</span><span class="cm-variable">c1</span>::<span>answer</span>}}'
+
+
+@pytest.fixture
+def field_check(addon_module, injected_config):
+    import anki.collection  # anki.collection has to be imported before anki.notes
+    import anki.lang
+    from anki.notes import Note
+
+    # Anki sets the language when it starts; stripping HTML needs it.
+    anki.lang.set_lang("en")
+
+    module = addon_module("field_check_manager")
+    original = Note.fields_check
+    module.apply_field_check_patch()
+    yield module
+    Note.fields_check = original
+    del Note._fields_check_original_codemirror
+
+
+@pytest.fixture
+def col(tmp_path, injected_config):
+    from anki.collection import Collection
+
+    col = Collection(str(tmp_path / "collection.anki2"))
+    injected_config.CONFIG[injected_config.CONFIG_KEY_BYPASS_MODELS] = [col.models.by_name("Cloze")['id']]
+    yield col
+    col.close()
+
+
+def cloze_note(col, text: str):
+    note = col.new_note(col.models.by_name("Cloze"))
+    note["Text"] = text
+    return note
+
+
+def test_field_has_cloze(field_check):
+    assert field_check.field_has_cloze(CODE_CLOZE)
+    assert field_check.field_has_cloze("{{c12::plain}}")
+    assert not field_check.field_has_cloze("{ {c1::x}}")
+    assert not field_check.field_has_cloze("no braces")
+
+
+def test_cloze_in_code_is_accepted(field_check, col):
+    from anki.notes import NoteFieldsCheckResult
+
+    assert cloze_note(col, CODE_CLOZE).fields_check() == NoteFieldsCheckResult.NORMAL
+    assert cloze_note(col, "no cloze").fields_check() == NoteFieldsCheckResult.MISSING_CLOZE
+
+
+def test_duplicates_are_still_found(field_check, col):
+    from anki.notes import NoteFieldsCheckResult
+
+    col.add_note(cloze_note(col, CODE_CLOZE), col.decks.id("Default"))
+    assert cloze_note(col, CODE_CLOZE).fields_check() == NoteFieldsCheckResult.DUPLICATE
+    assert cloze_note(col, CODE_CLOZE + " more").fields_check() == NoteFieldsCheckResult.NORMAL
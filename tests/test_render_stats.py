@@ -0,0 +1,43 @@
+# Checks how render_stats adds up the timings reviewer_script.js reports.
+
+import pytest
+
+
+@pytest.fixture
+def render_stats(addon_module):
+    module = addon_module("render_stats")
+    module.reset()
+    yield module
+    module.reset()
+
+
+def block(language="python", ms=10.0, chars=100):
+    return {"language": language, "chars": chars, "tokenizeMs": None, "domMs": ms, "layoutMs": 0}
+
+
+def test_question_and_answer_are_kept_apart(render_stats):
+    render_stats.record([block(ms=10)], 1, 11, "Basic", "q")
+    render_stats.record([block(ms=12)], 1, 11, "Basic", "a")
+
+    cards = dict(render_stats.slowest_cards())
+    assert cards[(1, "q")]["total_ms"] == 10
+    assert cards[(1, "a")]["total_ms"] == 12
+    assert render_stats.summary()[0][2] == 2
+
+
+def test_later_passes_of_a_side_are_added(render_stats):
+    # E.g. a big block that comes back from the worker after the rest of the card.
+    render_stats.record([block(ms=5)], 1, 11, "Basic", "q")
+    render_stats.record([block(ms=50, chars=30000)], 1, 11, "Basic", "q")
+
+    (key, info), = render_stats.slowest_cards()
+    assert key == (1, "q")
+    assert (info["blocks"], info["chars"], info["total_ms"]) == (2, 30100, 55)
+
+
+def test_only_the_slowest_cards_are_kept(render_stats):
+    for card_id in range(render_stats.MAX_SLOWEST_CARDS + 5):
+        render_stats.record([block(ms=card_id)], card_id, card_id, "Basic")
+    cards = render_stats.slowest_cards()
+    assert len(cards) == render_stats.MAX_SLOWEST_CARDS
+    assert cards[0][0] == (render_stats.MAX_SLOWEST_CARDS + 4, "q")
@@ -0,0 +1,69 @@
+# Checks the snippet index: searching, and that importing a file again doesn't add duplicates.
+
+import sqlite3
+
+import pytest
+
+SNIPPETS = """{
+    // Comments and trailing commas are allowed in VS Code files.
+    "For loop": {"prefix": "for", "body": ["for ${1:item} in ${2:items}:", "    $0"], "description": "For loop"},
+    "Print": {"prefix": "pr", "body": "print($1)", "description": "Print a value"},
+    "Fetch URL": {"prefix": "url", "body": "urlopen(${1:url})", "description": "Open a URL",},
+}"""
+
+
+@pytest.fixture
+def library(addon_module, tmp_path, monkeypatch):
+    snippet_library = addon_module("snippet_library")
+    monkeypatch.setattr(snippet_library, "INDEX_PATH", tmp_path / "snippets.db")
+    monkeypatch.setattr(snippet_library, "_connection", None)
+    yield snippet_library
+    if snippet_library._connection is not None:
+        snippet_library._connection.close()
+
+
+@pytest.fixture
+def snippet_file(tmp_path):
+    path = tmp_path / "python.json"
+    path.write_text(SNIPPETS, encoding="utf-8")
+    return path
+
+
+def test_search(library, snippet_file):
+    assert library.import_file(snippet_file, "python") == 3
+    results = library.search("for", "python")
+    assert [result["trigger"] for result in results] == ["for"]
+    assert results[0]["body"] == "for item in items:\n    "
+    assert library.search("for", "javascript") == []
+
+
+def test_import_twice(library, snippet_file):
+    library.import_file(snippet_file, "python")
+    assert library.import_file(snippet_file, "python") == 0
+    assert library.snippet_count() == 3
+    for query in ("for", "pr", "url"):
+        assert len(library.search(query, "python")) == 1
+
+
+def test_upgrade_removes_duplicates(library, snippet_file):
+    library.import_file(snippet_file, "python")
+    # An index from before snippets were unique, with every snippet imported twice.
+    connection = library._connect()
+    connection.execute("DROP INDEX snippets_unique")
+    connection.execute("PRAGMA user_version = 0")
+    library._connection = None
+    connection.close()
+    connection = sqlite3.connect(str(library.INDEX_PATH))
+    with connection:
+        connection.execute(
+            "INSERT INTO snippets (language, trigger, description, body) "
+            "SELECT language, trigger, description, body FROM snippets"
+        )
+        connection.execute(
+            "INSERT INTO trigrams (trigram, snippet_id) SELECT trigram, snippet_id + 3 FROM trigrams"
+        )
+    connection.close()
+
+    assert library.snippet_count() == 3
+    assert len(library.search("url", "python")) == 1
+    assert library._connect().execute("SELECT COUNT(DISTINCT snippet_id) FROM trigrams").fetchone()[0] == 3
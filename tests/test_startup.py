@@ -0,0 +1,76 @@
+# Measures the add-on's startup cost with startup_benchmark.py and checks that
+# starting Anki doesn't import the deferred modules or start any background
+# work besides scheduling the media clean-up. Needs the anki and aqt packages;
+# aqt's stand-in is checked against the installed aqt.
+
+import importlib.util
+import types
+
+import pytest
+
+pytest.importorskip("anki", reason="the startup measurement needs the anki package (pip install anki)")
+pytest.importorskip("bs4", reason="the startup measurement needs beautifulsoup4")
+if importlib.util.find_spec("aqt") is None:
+    pytest.skip(
+        "the startup measurement needs the aqt package to check its stand-in for aqt (pip install aqt)",
+        allow_module_level=True,
+    )
+
+
+@pytest.fixture(scope="module")
+def startup_benchmark():
+    import importlib
+    from conftest import ADDON_DIR
+    return importlib.import_module(f"{ADDON_DIR.name}.startup_benchmark")
+
+
+@pytest.fixture(scope="module")
+def api(startup_benchmark):
+    return startup_benchmark.load_aqt_api()
+
+
+@pytest.fixture
+def stand_in(startup_benchmark, api):
+    namespace = {}
+    exec(startup_benchmark.STAND_IN_SCRIPT, namespace)
+    modules, record = namespace["build_aqt"](api, types.SimpleNamespace(), {})
+    return namespace, modules, record
+
+
+@pytest.mark.parametrize("scenario", ["fingerprinted", "upgraded"])
+def test_startup(startup_benchmark, api, tmp_path, scenario):
+    entry = startup_benchmark.measure_scenario(scenario, tmp_path, note_types=20, injected=5, theme="dracula", repeat=1, api=api)
+
+    print(f"{scenario}: import {entry['import_ms']:.1f} ms, profile open {entry['profile_open_ms']:.1f} ms, "
+          f"overhead {entry['overhead_ms']:.1f} ms")
+    assert entry["deferred_modules_imported"] == []
+    # Up-to-date templates must not be repaired on every start.
+    assert entry["operations_started"] == []
+    assert entry["single_shots"] == 1
+
+
+def test_stand_in_follows_the_real_api(stand_in):
+    namespace, modules, record = stand_in
+    operations = modules["aqt.operations"]
+    op = lambda col: None
+
+    operations.QueryOp(parent=None, op=op, success=print).with_progress("Working...").run_in_background()
+    operations.CollectionOp(parent=None, op=op).success(print).failure(print).run_in_background()
+    assert record["operations"] == ["QueryOp", "CollectionOp"]
+
+    # Calls the real aqt doesn't support fail like they would in Anki.
+    with pytest.raises(AttributeError):
+        operations.CollectionOp(parent=None, op=op).with_progress("Working...")
+    with pytest.raises(namespace["ApiMismatch"]):
+        operations.QueryOp(None, op, print)
+    with pytest.raises(namespace["ApiMismatch"]):
+        modules["aqt"].mw.progress.single_shot(100)
+    with pytest.raises(namespace["ApiMismatch"]):
+        modules["aqt.utils"].tooltip("text", unknown_argument=True)
+    assert not hasattr(modules["aqt.gui_hooks"], "profile_did_not_exist")
+
+
+def test_deferred_modules_are_recognised(startup_benchmark):
+    from conftest import ADDON_DIR
+    modules = [f"{ADDON_DIR.name}.hooks", f"{ADDON_DIR.name}.template_manager", "bs4.element", "zlib"]
+    assert startup_benchmark.deferred_modules_imported(modules) == ["bs4", "hooks"]
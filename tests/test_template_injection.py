@@ -0,0 +1,70 @@
+# Checks that the resources block survives being stored with BeautifulSoup, so
+# injected templates are recognised as up to date and are not rewritten again.
+
+import pytest
+
+from conftest import FakeCollection, make_model
+
+pytest.importorskip("bs4")
+
+
+def test_resources_html_is_stored_unchanged(addon_module):
+    from bs4 import BeautifulSoup
+    resources_html = addon_module("asset_manager").build_resources_html()
+    assert str(BeautifulSoup(resources_html, "html.parser")) == resources_html
+
+
+def test_injected_model_is_up_to_date(addon_module, injected_config):
+    template_manager = addon_module("template_manager")
+    resources_html = addon_module("asset_manager").build_resources_html()
+    model = make_model(1)
+
+    assert template_manager.inject_into_model(model, resources_html, True)
+    assert resources_html in model['tmpls'][0]['qfmt']
+    assert not template_manager.has_outdated_injections(FakeCollection([model]))
+    # A second run finds the block and leaves the templates alone.
+    assert not template_manager.inject_into_model(model, resources_html, True)
+
+
+def test_missing_block_is_outdated(addon_module, injected_config):
+    template_manager = addon_module("template_manager")
+    assert template_manager.has_outdated_injections(FakeCollection([make_model(1)]))
+
+
+def test_removing_the_injection(addon_module):
+    template_manager = addon_module("template_manager")
+    resources_html = addon_module("asset_manager").build_resources_html()
+    model = make_model(1)
+    template_manager.inject_into_model(model, resources_html, True)
+
+    assert template_manager.inject_into_model(model, resources_html, False)
+    assert template_manager.INJECTION_ID not in model['tmpls'][0]['afmt']
+
+
+def test_edited_template_is_not_drifted(addon_module, injected_config):
+    template_manager = addon_module("template_manager")
+    resources_html = addon_module("asset_manager").build_resources_html()
+    model = make_model(1)
+    template_manager.inject_into_model(model, resources_html, True)
+    col = FakeCollection([model])
+    template_manager.record_fingerprints(col)
+
+    assert template_manager.find_drifted_models(col) == ([], False)
+
+    # An ordinary edit keeps the block: only the fingerprint is out of date.
+    model['tmpls'][0]['qfmt'] = "<b>" + model['tmpls'][0]['qfmt'] + "</b>"
+    model['mod'] += 1
+    assert template_manager.find_drifted_models(col) == ([], True)
+
+
+def test_lost_block_is_drifted(addon_module, injected_config):
+    template_manager = addon_module("template_manager")
+    resources_html = addon_module("asset_manager").build_resources_html()
+    model = make_model(1)
+    template_manager.inject_into_model(model, resources_html, True)
+    col = FakeCollection([model])
+    template_manager.record_fingerprints(col)
+
+    model['tmpls'][0]['afmt'] = "{{Back}}"
+    model['mod'] += 1
+    assert template_manager.find_drifted_models(col) == ([1], True)
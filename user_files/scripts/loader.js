@@ -0,0 +1,57 @@
+// This is the only script the card templates run (see asset_manager.py).
+// Its name and content never change, so the templates never have to be rewritten.
+// Everything that can change (theme, which CSS/JS files to load) lives in
+// _codemirror_anki_runtime.js, which is generated by the add-on and loaded first.
+
+(function () {
+    // Desktop Anki keeps the same page between cards and re-runs the template
+    // scripts every time. Everything only has to be loaded once, after that the
+    // MutationObserver in reviewer_script.js renders the new cards.
+    if (window.CODE_MIRROR_LOADER_STARTED) {
+        return;
+    }
+    window.CODE_MIRROR_LOADER_STARTED = true;
+
+    const RUNTIME_CONFIG_FILE = "_codemirror_anki_runtime.js";
+
+    function loadScript(src, onDone) {
+        const script = document.createElement("script");
+        script.src = src;
+        script.onload = onDone;
+        script.onerror = () => {
+            console.error(`CodeMirror Add-on: Could not load ${src}`);
+            onDone();
+        };
+        document.head.appendChild(script);
+    }
+
+    function addStyle(css) {
+        const style = document.createElement("style");
+        style.textContent = css;
+        document.head.appendChild(style);
+    }
+
+    function addStylesheet(href) {
+        const link = document.createElement("link");
+        link.rel = "stylesheet";
+        link.type = "text/css";
+        link.href = href;
+        document.head.appendChild(link);
+    }
+
+    // Scripts depend on each other (modes need codemirror.js), so they are
+    // loaded one after the other instead of in parallel.
+    function loadScriptsInOrder(scripts, index) {
+        if (index >= scripts.length) return;
+        loadScript(scripts[index], () => loadScriptsInOrder(scripts, index + 1));
+    }
+
+    loadScript(RUNTIME_CONFIG_FILE, () => {
+        const runtime = window.CODE_MIRROR_RUNTIME || {};
+        window.CODE_MIRROR_GLOBAL_THEME = runtime.theme || "dracula";
+        (runtime.styles || []).forEach(addStylesheet);
+        // The theme's CSS is part of the runtime config (see asset_manager.get_runtime_config).
+        if (runtime.themeCss) addStyle(runtime.themeCss);
+        loadScriptsInOrder(runtime.scripts || [], 0);
+    });
+})();
@@ -2,11 +2,419 @@
 // Also: we inject this into the card
 
 (function () {
+    const runtime = window.CODE_MIRROR_RUNTIME || {};
+
+    // Snippets longer than this (in characters) are tokenised in a Web Worker.
+    // 0 disables the worker completely.
+    const workerThreshold = typeof runtime.workerThreshold === "number" ? runtime.workerThreshold : 20000;
+
+    // =================================================================
+    // SECTION: Render telemetry
+    // =================================================================
+
+    // Render costs are only reported on desktop (where pycmd exists); the
+    // add-on collects them in render_stats.py and shows them in its config dialog.
+    const TELEMETRY_COMMAND = "codemirror_render_stats:";
+    const collectStats = runtime.collectRenderStats !== false && typeof window.pycmd === "function";
+    let pendingStats = [];
+
+    /** Whether render costs are measured at all: for the add-on or for a benchmark. */
+    function measuringStats() {
+        // Benchmarks (see reviewer_benchmark.py) define this array to collect every block.
+        return collectStats || Array.isArray(window.CODE_MIRROR_RENDER_STATS);
+    }
+
+    /**
+     * Records the cost of rendering one block. Nothing is measured here that
+     * would slow the rendering down; the layout is measured once per render
+     * pass by sendBlockStats.
+     */
+    function recordBlockStats(stats) {
+        if (measuringStats()) pendingStats.push(stats);
+    }
+
+    /**
+     * Ends a render pass: called right after its last block is in the page,
+     * while the card that was rendered is still shown, so the add-on charges
+     * the blocks to the right card. Without telemetry this does nothing.
+     *
+     * The layout of the pass is forced once here and its time is shared by
+     * the blocks by size. All blocks are sent in one message; the side ("q" or
+     * "a") keeps the question and answer renders of a card apart. The answer
+     * side is recognised by the <hr id=answer> of Anki's templates.
+     */
+    function sendBlockStats() {
+        if (pendingStats.length === 0) return;
+        const blocks = pendingStats;
+        pendingStats = [];
+
+        const start = performance.now();
+        void document.body.offsetHeight;
+        const layoutMs = performance.now() - start;
+        const totalChars = blocks.reduce((sum, block) => sum + block.chars, 0);
+        blocks.forEach(block => {
+            block.layoutMs = totalChars ? layoutMs * block.chars / totalChars : layoutMs / blocks.length;
+        });
+
+        if (Array.isArray(window.CODE_MIRROR_RENDER_STATS)) {
+            window.CODE_MIRROR_RENDER_STATS.push(...blocks);
+        }
+        if (collectStats) {
+            const side = document.getElementById("answer") ? "a" : "q";
+            pycmd(TELEMETRY_COMMAND + JSON.stringify({ side, blocks }));
+        }
+    }
+
+    // =================================================================
+    // SECTION: Rendering
+    // =================================================================
+
+    /** Renders a snippet with a full (read-only) CodeMirror instance. */
+    function renderWithEditor(span, code, language, theme) {
+        // Create a new container for the full CodeMirror instance.
+        // A <div> is more suitable than <pre> for this.
+        const container = document.createElement('div');
+
+        // IMPORTANT: Replace the original span with our new container *before*
+        // initializing CodeMirror. CodeMirror needs the element to be in the DOM.
+        span.parentNode.replaceChild(container, span);
+
+        // Now, initialize a full CodeMirror instance on the container.
+        // (CodeMirror tokenises and builds the DOM in one go, so both are measured together.)
+        const start = performance.now();
+        CodeMirror(container, {
+            value: code,              // The code to display
+            mode: language,           // The language for syntax highlighting
+            theme: theme,             // The theme from your addon's config
+            lineNumbers: true,        // Numbers for code
+            readOnly: 'nocursor',     // Makes it non-editable and hides the blinking cursor
+            lineWrapping: true,       // Optional: wrap long lines
+        });
+        const domMs = performance.now() - start;
+        recordBlockStats({
+            language, chars: code.length, path: "editor",
+            tokenizeMs: null, domMs,
+        });
+    }
+
+    function escapeHtml(text) {
+        return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+    }
+
+    /**
+     * Builds a static, read-only code block from token runs (see tokenizer_worker.js).
+     * The whole block is assembled as one string and inserted with a single DOM write.
+     * Returns null if the runs don't match the code (e.g. Anki changed the text
+     * because of a cloze), so the caller can fall back to tokenising.
+     */
+    function buildStaticBlock(code, runs, theme) {
+        const lines = code.split(/\r?\n|\r/);
+        if (!runs || !runs.lines || runs.lines.length !== lines.length) {
+            return null;
+        }
+        const classNames = runs.styles.map(style => style ? "cm-" + style.replace(/ +/g, " cm-") : "");
+
+        const html = [];
+        for (let i = 0; i < lines.length; i++) {
+            const line = lines[i];
+            const lineRuns = runs.lines[i];
+            let pos = 0;
+            html.push(`<div class="cm-anki-static-line"><span class="CodeMirror-linenumber">${i + 1}</span><pre class="CodeMirror-line"><span role="presentation">`);
+            for (let r = 0; r < lineRuns.length; r += 2) {
+                const text = escapeHtml(line.slice(pos, pos + lineRuns[r]));
+                const className = classNames[lineRuns[r + 1]];
+                html.push(className ? `<span class="${className}">${text}</span>` : text);
+                pos += lineRuns[r];
+            }
+            if (pos !== line.length) {
+                return null;
+            }
+            // An empty line would collapse to zero height without a zero-width space.
+            html.push(line.length ? "</span></pre></div>" : "\u200b</span></pre></div>");
+        }
+
+        const container = document.createElement('div');
+        container.className = `CodeMirror cm-s-${theme} cm-anki-static`;
+        container.innerHTML = `<div class="CodeMirror-code">${html.join("")}</div>`;
+        return container;
+    }
+
+    // Must match TOKEN_HINT_FORMAT in script.js.
+    const TOKEN_HINT_FORMAT = "1";
+
+    /**
+     * Reads the render hint the editor dialog stores in data-tokens (see
+     * encodeTokenHint in script.js) into token runs for buildStaticBlock.
+     * Returns null if there is no hint or it was made by another CodeMirror
+     * version or for another mode, since the tokens could differ then.
+     */
+    function decodeTokenHint(hint, language) {
+        if (!hint) return null;
+        const parts = hint.split("|");
+        if (parts.length !== 5 || parts[0] !== TOKEN_HINT_FORMAT
+            || parts[1] !== CodeMirror.version || parts[2] !== language) {
+            return null;
+        }
+        const styles = parts[3] ? [""].concat(parts[3].split(",")) : [""];
+        // The styles end up in class attributes, and notes can come from shared decks.
+        if (!styles.every(style => /^[\w -]*$/.test(style))) {
+            return null;
+        }
+        const lines = parts[4].split(";").map(line =>
+            line ? line.split(",").map(n => parseInt(n, 36)) : []
+        );
+        return { styles, lines };
+    }
+
+    /** Paints a snippet straight from its render hint. Returns false if that isn't possible. */
+    function renderFromHint(span, code, language, theme) {
+        const runs = decodeTokenHint(span.dataset.tokens, language);
+        if (!runs) return false;
+        const start = performance.now();
+        const block = buildStaticBlock(code, runs, theme);
+        if (!block) return false;
+        span.parentNode.replaceChild(block, span);
+        const domMs = performance.now() - start;
+        recordBlockStats({
+            language, chars: code.length, path: "hint",
+            tokenizeMs: 0, domMs,
+        });
+        return true;
+    }
+
+    // =================================================================
+    // SECTION: Web Worker tokenisation for big snippets
+    // =================================================================
+
+    let tokenizerWorker = null;
+    let workerFailed = false;
+    let nextJobId = 0;
+    const pendingJobs = new Map();
+
+    function getTokenizerWorker() {
+        if (workerFailed || !window.Worker || !runtime.worker) {
+            return null;
+        }
+        if (tokenizerWorker) {
+            return tokenizerWorker;
+        }
+        try {
+            tokenizerWorker = new Worker(runtime.worker);
+        } catch (e) {
+            // Some webviews don't allow workers from the media folder (e.g. file:// URLs).
+            workerFailed = true;
+            return null;
+        }
+        tokenizerWorker.onmessage = (event) => {
+            const job = pendingJobs.get(event.data.id);
+            if (!job) return;
+            pendingJobs.delete(event.data.id);
+            const start = performance.now();
+            const block = event.data.error ? null : buildStaticBlock(job.code, event.data, job.theme);
+            if (!job.span.isConnected) return;
+            if (block) {
+                job.span.parentNode.replaceChild(block, job.span);
+                const domMs = performance.now() - start;
+                recordBlockStats({
+                    language: job.language, chars: job.code.length, path: "worker",
+                    tokenizeMs: event.data.tokenizeMs, domMs,
+                });
+            } else {
+                renderWithEditor(job.span, job.code, job.language, job.theme);
+            }
+            sendBlockStats();
+        };
+        tokenizerWorker.onerror = () => {
+            // The worker script could not be loaded or crashed: render everything
+            // that is still waiting on the main thread and stop using workers.
+            workerFailed = true;
+            tokenizerWorker = null;
+            pendingJobs.forEach(job => {
+                if (job.span.isConnected) {
+                    renderWithEditor(job.span, job.code, job.language, job.theme);
+                }
+            });
+            pendingJobs.clear();
+            sendBlockStats();
+        };
+        return tokenizerWorker;
+    }
+
+    /** Hands a snippet to the worker. Returns false if no worker is available. */
+    function renderInWorker(span, code, language, theme) {
+        const worker = getTokenizerWorker();
+        if (!worker) {
+            return false;
+        }
+        const id = nextJobId++;
+        // Mark the span so the MutationObserver doesn't pick it up again while it waits.
+        span.dataset.cmPending = "1";
+        pendingJobs.set(id, { span, code, language, theme });
+        worker.postMessage({ id, code, mode: language, scripts: runtime.workerScripts || [] });
+        return true;
+    }
+
+    // =================================================================
+    // SECTION: Before/after diffs
+    // =================================================================
+    // The diff is computed once when the note is saved (see compute_diff in
+    // save_handler.py). The span holds the new code and data-diff holds the
+    // hunks, so nothing has to be diffed here. Both versions are drawn side
+    // by side with the classes of CodeMirror's merge addon.
+
+    // Must match DIFF_FORMAT in save_handler.py.
+    const DIFF_FORMAT = 1;
+
+    /**
+     * Rebuilds the old lines from the new lines and the hunks, which carry
+     * the removed lines. Returns null if the hunks don't fit the code.
+     */
+    function rebuildBeforeLines(afterLines, hunks) {
+        const beforeLines = [];
+        let pos = 0;
+        for (const [afterStart, afterCount, beforeStart, removed] of hunks) {
+            if (afterStart < pos || afterStart + afterCount > afterLines.length) return null;
+            for (let i = pos; i < afterStart; i++) beforeLines.push(afterLines[i]);
+            if (beforeLines.length !== beforeStart) return null;
+            for (const line of removed) beforeLines.push(line);
+            pos = afterStart + afterCount;
+        }
+        for (let i = pos; i < afterLines.length; i++) beforeLines.push(afterLines[i]);
+        return beforeLines;
+    }
+
+    /** Returns the [text, style] tokens of every line. */
+    function tokenizeLines(code, language) {
+        const lines = [[]];
+        CodeMirror.runMode(code, language, (text, style) => {
+            if (text === "\n") {
+                lines.push([]);
+                return;
+            }
+            lines[lines.length - 1].push([text, style || ""]);
+        });
+        return lines;
+    }
+
+    /**
+     * Collects the changed lines of one side: line index -> { className, words },
+     * where words are the [start, end] ranges of changed words on that line.
+     */
+    function collectDiffMarks(hunks, side) {
+        const marks = new Map();
+        for (const [afterStart, afterCount, beforeStart, removed, beforeWords, afterWords] of hunks) {
+            const start = side === "after" ? afterStart : beforeStart;
+            const count = side === "after" ? afterCount : removed.length;
+            for (let k = 0; k < count; k++) {
+                let className = "CodeMirror-merge-r-chunk";
+                if (k === 0) className += " CodeMirror-merge-r-chunk-start";
+                if (k === count - 1) className += " CodeMirror-merge-r-chunk-end";
+                marks.set(start + k, { className, words: [] });
+            }
+            for (const [k, from, to] of (side === "after" ? afterWords : beforeWords)) {
+                const mark = marks.get(start + k);
+                if (mark) mark.words.push([from, to]);
+            }
+        }
+        return marks;
+    }
+
+    /** Renders the tokens of one line, splitting them where changed words start and end. */
+    function renderDiffLine(tokens, words, wordClass) {
+        const html = [];
+        let pos = 0;
+        let w = 0;
+        for (const [text, style] of tokens) {
+            const styleClass = style ? "cm-" + style.replace(/ +/g, " cm-") : "";
+            let offset = 0;
+            while (offset < text.length) {
+                const absolute = pos + offset;
+                while (w < words.length && words[w][1] <= absolute) w++;
+                let end = text.length;
+                let changed = false;
+                if (w < words.length) {
+                    if (words[w][0] <= absolute) {
+                        changed = true;
+                        end = Math.min(end, words[w][1] - pos);
+                    } else {
+                        end = Math.min(end, words[w][0] - pos);
+                    }
+                }
+                const piece = escapeHtml(text.slice(offset, end));
+                const className = changed ? `${styleClass} ${wordClass}`.trim() : styleClass;
+                html.push(className ? `<span class="${className}">${piece}</span>` : piece);
+                offset = end;
+            }
+            pos += text.length;
+        }
+        return html.join("");
+    }
+
+    /** Builds the HTML of one side of the diff as a static block (see buildStaticBlock). */
+    function buildDiffPane(lines, language, marks, theme, side) {
+        const tokens = tokenizeLines(lines.join("\n"), language);
+        const wordClass = side === "after" ? "CodeMirror-merge-r-inserted" : "CodeMirror-merge-r-deleted";
+        const html = [];
+        for (let i = 0; i < lines.length; i++) {
+            const mark = marks.get(i);
+            const content = renderDiffLine(tokens[i] || [], mark ? mark.words : [], wordClass);
+            html.push(
+                `<div class="cm-anki-static-line ${mark ? mark.className : ""}">`
+                + `<span class="CodeMirror-linenumber">${i + 1}</span>`
+                + `<pre class="CodeMirror-line"><span role="presentation">${content || "\u200b"}</span></pre></div>`
+            );
+        }
+        return `<div class="CodeMirror cm-s-${theme} cm-anki-static CodeMirror-merge-pane cm-anki-diff-${side}">`
+            + `<div class="CodeMirror-code">${html.join("")}</div></div>`;
+    }
+
+    /** Replaces a diff span with the side-by-side view. */
+    function renderDiffBlock(span, theme) {
+        const code = span.textContent;
+        const language = span.dataset.language;
+        const start = performance.now();
+
+        let diff = null;
+        try {
+            diff = JSON.parse(span.dataset.diff);
+        } catch (e) {
+            console.error("CodeMirror Add-on: Could not read the diff:", e);
+        }
+        const afterLines = code.split(/\r?\n|\r/);
+        const beforeLines = diff && diff.v === DIFF_FORMAT && diff.lines === afterLines.length
+            ? rebuildBeforeLines(afterLines, diff.hunks)
+            : null;
+        if (!beforeLines) {
+            // The text was changed after saving (e.g. by a cloze) or the format
+            // is unknown: show the new version on its own.
+            renderWithEditor(span, code, language, theme);
+            return;
+        }
+
+        const container = document.createElement("div");
+        container.className = "CodeMirror-merge CodeMirror-merge-2pane cm-anki-diff";
+        container.innerHTML = buildDiffPane(beforeLines, language, collectDiffMarks(diff.hunks, "before"), theme, "before")
+            + '<div class="CodeMirror-merge-gap"></div>'
+            + buildDiffPane(afterLines, language, collectDiffMarks(diff.hunks, "after"), theme, "after");
+        span.parentNode.replaceChild(container, span);
+
+        const domMs = performance.now() - start;
+        recordBlockStats({
+            language, chars: code.length, path: "diff",
+            tokenizeMs: null, domMs,
+        });
+    }
+
+    // =================================================================
+    // SECTION: Initialization
+    // =================================================================
+
     function initializeCodeMirrorBlocks() {
         // Find all the simple spans that are our placeholders for code blocks.
-        const codeSpans = document.querySelectorAll('.codemirror-anki[data-language]');
+        const codeSpans = document.querySelectorAll('.codemirror-anki[data-language]:not([data-cm-pending])');
+        const diffSpans = document.querySelectorAll('.codemirror-anki-diff[data-language]');
 
-        if (codeSpans.length === 0 || typeof CodeMirror === 'undefined') {
+        if ((codeSpans.length === 0 && diffSpans.length === 0) || typeof CodeMirror === 'undefined') {
             return;
         }
 
@@ -19,24 +427,21 @@
             const code = span.textContent;
             const language = span.dataset.language;
 
-            // Create a new container for the full CodeMirror instance.
-            // A <div> is more suitable than <pre> for this.
-            const container = document.createElement('div');
-
-            // IMPORTANT: Replace the original span with our new container *before*
-            // initializing CodeMirror. CodeMirror needs the element to be in the DOM.
-            span.parentNode.replaceChild(container, span);
-
-            // Now, initialize a full CodeMirror instance on the container.
-            CodeMirror(container, {
-                value: code,              // The code to display
-                mode: language,           // The language for syntax highlighting
-                theme: globalTheme,       // The theme from your addon's config
-                lineNumbers: true,        // Numbers for code
-                readOnly: 'nocursor',     // Makes it non-editable and hides the blinking cursor
-                lineWrapping: true,       // Optional: wrap long lines
-            });
+            // Notes saved by the editor dialog carry their tokens, so nothing has to be tokenised.
+            if (renderFromHint(span, code, language, globalTheme)) {
+                return;
+            }
+
+            // Big snippets are tokenised off the main thread; small ones keep
+            // the synchronous path, where a worker round trip isn't worth it.
+            if (workerThreshold > 0 && code.length > workerThreshold && renderInWorker(span, code, language, globalTheme)) {
+                return;
+            }
+            renderWithEditor(span, code, language, globalTheme);
         });
+
+        diffSpans.forEach(span => renderDiffBlock(span, globalTheme));
+        sendBlockStats();
     }
 
     // Run the function once the card is fully loaded.
@@ -55,4 +460,4 @@
         });
         observer.observe(document.body, { childList: true, subtree: true });
     }
-})();
\ No newline at end of file
+})();
@@ -8,13 +8,19 @@ document.addEventListener("DOMContentLoaded", () => {
     const initialLanguage = config.language || "python";
     const activeTheme = config.activeTheme || "dracula";
     const starterCode = config.starterCode || {};
+    const modeFiles = config.modeFiles || {};
 
     // --- ELEMENT SETUP ---
     const insertButton = document.getElementById("insert-button");
-    const langSelect = document.getElementById("language-select");
+    const langSelect = document.getElementById("language-selector");
     const clozeButton = document.getElementById("cloze-button");
     const clozeSameButton = document.getElementById("cloze-same-button");
     const starterCodeButton = document.getElementById("starter-code-button");
+    const snippetSearch = document.getElementById("snippet-search");
+    const snippetResults = document.getElementById("snippet-results");
+    const diffButton = document.getElementById("diff-button");
+    const beforePane = document.getElementById("before-pane");
+    const afterLabel = document.getElementById("after-label");
 
     if (insertButton) {
         insertButton.textContent = buttonText;
@@ -98,6 +104,40 @@ document.addEventListener("DOMContentLoaded", () => {
         editor.focus();
     }
     
+    // =================================================================
+    // SECTION: Mode Loading
+    // =================================================================
+    // The dialog only starts with the mode files of the likely language
+    // (see MODE_FILES in codemirror_dialog.py). Other modes are loaded on demand.
+
+    const scriptLoads = new Map(
+        (config.loadedModeFiles || []).map(src => [src, Promise.resolve()])
+    );
+
+    function loadScriptOnce(src) {
+        if (!scriptLoads.has(src)) {
+            scriptLoads.set(src, new Promise((resolve) => {
+                const script = document.createElement("script");
+                script.src = src;
+                script.onload = resolve;
+                script.onerror = () => {
+                    console.error(`Could not load ${src}`);
+                    resolve();
+                };
+                document.head.appendChild(script);
+            }));
+        }
+        return scriptLoads.get(src);
+    }
+
+    /** Loads the mode files of a language one after the other (e.g. xml.js before htmlmixed.js). */
+    function loadMode(lang) {
+        return (modeFiles[lang] || []).reduce(
+            (previous, src) => previous.then(() => loadScriptOnce(src)),
+            Promise.resolve()
+        );
+    }
+
     /** Inserts pre-defined starter code for the current language into the editor. */
     function insertStarterCode() {
         const editor = window.editor;
@@ -110,11 +150,170 @@ document.addEventListener("DOMContentLoaded", () => {
         editor.focus();
     }
 
+    // =================================================================
+    // SECTION: Snippet Library
+    // =================================================================
+    // The library lives on the Python side (snippet_library.py). Every keystroke
+    // sends the query over the bridge and only the matching snippets come back.
+
+    let snippetRequestId = 0;
+    let snippetSearchTimer = null;
+    let shownSnippets = [];
+    let selectedSnippet = 0;
+
+    function requestSnippets() {
+        const query = snippetSearch.value;
+        if (!query.trim()) {
+            hideSnippetResults();
+            return;
+        }
+        snippetRequestId++;
+        sendToPython(`search_snippets:${snippetRequestId}:${window.editor.getOption("mode")}:${query}`);
+    }
+
+    /** Called from Python with the results of a search. */
+    window.showSnippetResults = (requestId, results) => {
+        // Ignore answers to queries the user has already typed past.
+        if (requestId !== snippetRequestId) return;
+        shownSnippets = results;
+        selectedSnippet = 0;
+        renderSnippetResults();
+    };
+
+    function renderSnippetResults() {
+        snippetResults.innerHTML = "";
+        shownSnippets.forEach((snippet, index) => {
+            const item = document.createElement("li");
+            item.textContent = snippet.trigger;
+            const description = document.createElement("span");
+            description.className = "snippet-description";
+            description.textContent = snippet.description;
+            item.appendChild(description);
+            item.title = snippet.body;
+            if (index === selectedSnippet) item.className = "selected";
+            item.addEventListener("mousedown", (event) => {
+                event.preventDefault();
+                insertSnippet(index);
+            });
+            snippetResults.appendChild(item);
+        });
+        snippetResults.hidden = shownSnippets.length === 0;
+        const selectedItem = snippetResults.children[selectedSnippet];
+        if (selectedItem) selectedItem.scrollIntoView({ block: "nearest" });
+    }
+
+    function hideSnippetResults() {
+        shownSnippets = [];
+        snippetResults.hidden = true;
+    }
+
+    function insertSnippet(index) {
+        const snippet = shownSnippets[index];
+        if (!snippet) return;
+        window.editor.replaceSelection(snippet.body);
+        snippetSearch.value = "";
+        hideSnippetResults();
+        window.editor.focus();
+    }
+
+    function focusSnippetSearch() {
+        if (!snippetSearch) return;
+        snippetSearch.focus();
+        snippetSearch.select();
+    }
+
+    // Bump this when the data-tokens format changes (see decodeTokenHint in reviewer_script.js).
+    const TOKEN_HINT_FORMAT = "1";
+
+    /**
+     * Encodes the editor's tokens as a compact render hint, so the cards can be
+     * painted without running the tokenizer again:
+     *   format|CodeMirror version|mode|style,style,...|line;line;...
+     * Every line is a flat list of base-36 "length,styleIndex" pairs. Style index 0
+     * means "no style", index i > 0 is the i-th entry of the style list.
+     */
+    function encodeTokenHint(cm) {
+        const styles = [""];
+        const styleIndexes = new Map([["", 0]]);
+        const lines = [];
+
+        for (let i = 0; i < cm.lineCount(); i++) {
+            const runs = [];
+            cm.getLineTokens(i, true).forEach(token => {
+                const key = token.type || "";
+                let index = styleIndexes.get(key);
+                if (index === undefined) {
+                    index = styles.length;
+                    styles.push(key);
+                    styleIndexes.set(key, index);
+                }
+                // Merge neighbouring tokens with the same style to keep the hint small.
+                if (runs.length && runs[runs.length - 1] === index) {
+                    runs[runs.length - 2] += token.string.length;
+                } else {
+                    runs.push(token.string.length, index);
+                }
+            });
+            lines.push(runs.map(n => n.toString(36)).join(","));
+        }
+
+        return [
+            TOKEN_HINT_FORMAT, CodeMirror.version, cm.getOption("mode"),
+            styles.slice(1).join(","), lines.join(";"),
+        ].join("|");
+    }
+
+    // =================================================================
+    // SECTION: Diff Mode
+    // =================================================================
+
+    // The second editor holding the old version of the code. It is only
+    // created the first time diff mode is switched on.
+    let beforeEditor = null;
+    let diffMode = false;
+
+    /**
+     * Switches the before/after mode on or off. The card then shows what changed
+     * between the two versions (the diff is computed by save_handler.compute_diff).
+     */
+    function setDiffMode(enabled) {
+        diffMode = enabled;
+        if (beforePane) beforePane.hidden = !enabled;
+        if (afterLabel) afterLabel.hidden = !enabled;
+        if (diffButton) diffButton.classList.toggle("active", enabled);
+
+        if (enabled && !beforeEditor) {
+            const beforeTextarea = document.getElementById("before-editor");
+            const startFromCurrent = !beforeTextarea.value;
+            beforeEditor = CodeMirror.fromTextArea(beforeTextarea, {
+                lineNumbers: true,
+                mode: window.editor.getOption("mode"),
+                theme: activeTheme,
+                keyMap: "vim",
+                autoCloseBrackets: true,
+                matchBrackets: true,
+                lineWrapping: true,
+                extraKeys: {
+                    "Ctrl-Enter": () => submitCode()
+                }
+            });
+            // Usually only a few lines change, so start from the current code.
+            if (startFromCurrent) beforeEditor.setValue(window.editor.getValue());
+        }
+
+        window.editor.refresh();
+        if (beforeEditor) beforeEditor.refresh();
+    }
+
+    function encodeBase64(text) {
+        return btoa(unescape(encodeURIComponent(text)));
+    }
+
     /**
      * Encodes the editor's content and sends it back to Python.
      */
     function submitCode() {
-        const codeElement = document.querySelector(".CodeMirror-code");
+        const codeElement = window.editor.getWrapperElement().querySelector(".CodeMirror-code");
         if (!codeElement) {
             console.error("Could not find the '.CodeMirror-code' element to get highlighted HTML.");
             return;
@@ -126,8 +325,23 @@ document.addEventListener("DOMContentLoaded", () => {
         const encodedRaw = btoa(unescape(encodeURIComponent(rawCode)));
         const encodedHtml = btoa(unescape(encodeURIComponent(highlightedHtml)));
         const currentLang = window.editor.getOption("mode");
-        
-        sendToPython(`insert_code:${currentLang}:${encodedRaw}:${encodedHtml}`);
+
+        if (diffMode && beforeEditor) {
+            const beforeCode = beforeEditor.getValue();
+            const beforeHtml = beforeEditor.getWrapperElement().querySelector(".CodeMirror-code").innerHTML;
+            sendToPython(`insert_diff:${currentLang}:${encodeBase64(beforeCode)}:${encodedRaw}:${encodeBase64(beforeHtml)}:${encodedHtml}`);
+            return;
+        }
+
+        // The hint is optional, the cards can always tokenise the raw code themselves.
+        let encodedTokens = "";
+        try {
+            encodedTokens = btoa(encodeTokenHint(window.editor));
+        } catch (e) {
+            console.error("Could not encode the token hint:", e);
+        }
+
+        sendToPython(`insert_code:${currentLang}:${encodedRaw}:${encodedHtml}:${encodedTokens}`);
     }
 
     /**
@@ -188,7 +402,8 @@ document.addEventListener("DOMContentLoaded", () => {
         styleActiveLine: true,
         extraKeys: {
             "Ctrl-Enter": (cm) => submitCode(),
-            "Ctrl-B": () => insertStarterCode()
+            "Ctrl-B": () => insertStarterCode(),
+            "Ctrl-Space": () => focusSnippetSearch()
         }
     });
     window.editor = editor;
@@ -204,11 +419,42 @@ document.addEventListener("DOMContentLoaded", () => {
     if (clozeButton) clozeButton.addEventListener("click", () => addCloze(true));
     if (clozeSameButton) clozeSameButton.addEventListener("click", () => addCloze(false));
     if (starterCodeButton) starterCodeButton.addEventListener("click", insertStarterCode);
+    if (diffButton) diffButton.addEventListener("click", () => setDiffMode(!diffMode));
     
+    if (snippetSearch && snippetResults) {
+        snippetSearch.addEventListener("input", () => {
+            clearTimeout(snippetSearchTimer);
+            snippetSearchTimer = setTimeout(requestSnippets, 60);
+        });
+        snippetSearch.addEventListener("keydown", (event) => {
+            if (event.key === "ArrowDown" || event.key === "ArrowUp") {
+                event.preventDefault();
+                if (!shownSnippets.length) return;
+                const step = event.key === "ArrowDown" ? 1 : -1;
+                selectedSnippet = (selectedSnippet + step + shownSnippets.length) % shownSnippets.length;
+                renderSnippetResults();
+            } else if (event.key === "Enter") {
+                event.preventDefault();
+                insertSnippet(selectedSnippet);
+            } else if (event.key === "Escape") {
+                event.preventDefault();
+                event.stopPropagation();
+                snippetSearch.value = "";
+                hideSnippetResults();
+                editor.focus();
+            }
+        });
+        snippetSearch.addEventListener("blur", hideSnippetResults);
+    }
+
     if (langSelect) {
         langSelect.addEventListener("change", (e) => {
             const newLang = e.target.value;
-            editor.setOption("mode", newLang);
+            // Setting the mode again after loading makes CodeMirror re-highlight.
+            loadMode(newLang).then(() => {
+                editor.setOption("mode", newLang);
+                if (beforeEditor) beforeEditor.setOption("mode", newLang);
+            });
             sendToPython(`set_lang:${newLang}`);
             editor.focus();
         });
@@ -228,6 +474,9 @@ document.addEventListener("DOMContentLoaded", () => {
     });
 
     // --- Final Setup ---
+    // Diff blocks that are edited again open in diff mode.
+    if (config.diffMode) setDiffMode(true);
+
     setTimeout(() => {
         editor.focus();
         editor.refresh();
@@ -240,5 +489,9 @@ document.addEventListener("DOMContentLoaded", () => {
     
     syncUiToTheme();
     injectVimDialogStyles();
+
+    // Load the runner-up language while nothing else is going on, so switching to it is instant.
+    const whenIdle = window.requestIdleCallback || ((callback) => setTimeout(callback, 500));
+    whenIdle(() => (config.preloadLanguages || []).forEach(loadMode));
 });
 
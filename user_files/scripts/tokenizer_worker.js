@@ -0,0 +1,57 @@
+// This script runs inside a Web Worker started by reviewer_script.js.
+// It tokenises big snippets off the main thread with the standalone runMode
+// addon, so the card flip and input stay smooth, and posts back compact
+// token runs that the reviewer paints in one go.
+//
+// Token runs look like this:
+//   styles: ["", "keyword", "variable", ...]   (index 0 is "no style")
+//   lines:  [[length, styleIndex, length, styleIndex, ...], ...]   (one array per line)
+
+let scriptsLoaded = false;
+
+function tokenize(code, mode) {
+    const styles = [""];
+    const styleIndexes = new Map([["", 0]]);
+    const lines = [[]];
+
+    CodeMirror.runMode(code, mode, (text, style) => {
+        // runMode reports line breaks as a separate "\n" token.
+        if (text === "\n") {
+            lines.push([]);
+            return;
+        }
+        const key = style || "";
+        let index = styleIndexes.get(key);
+        if (index === undefined) {
+            index = styles.length;
+            styles.push(key);
+            styleIndexes.set(key, index);
+        }
+        // Merge neighbouring tokens with the same style to keep the runs small.
+        const line = lines[lines.length - 1];
+        if (line.length && line[line.length - 1] === index) {
+            line[line.length - 2] += text.length;
+        } else {
+            line.push(text.length, index);
+        }
+    });
+
+    return { styles, lines };
+}
+
+self.onmessage = (event) => {
+    const { id, code, mode, scripts } = event.data;
+    try {
+        // The runMode addon and the mode files are only loaded for the first snippet.
+        if (!scriptsLoaded) {
+            importScripts(...scripts);
+            scriptsLoaded = true;
+        }
+        const start = performance.now();
+        const { styles, lines } = tokenize(code, mode);
+        const tokenizeMs = performance.now() - start;
+        self.postMessage({ id, styles, lines, tokenizeMs });
+    } catch (e) {
+        self.postMessage({ id, error: String(e) });
+    }
+};
@@ -1,10 +1,11 @@
 # Only needed for importing paths
 
 from pathlib import Path
-from aqt import mw
 
 # Shared constants for the add-on
-ADDON_PACKAGE = mw.addonManager.addonFromModule(__name__)
-ADDON_PATH = Path(mw.addonManager.addonsFolder()) / ADDON_PACKAGE
+# They are derived from this file's location instead of asking aqt, so they
+# also work without Anki's GUI (see cli.py).
+ADDON_PACKAGE = __name__.split(".")[0]
+ADDON_PATH = Path(__file__).parent
 USER_FILES_PATH = ADDON_PATH / "user_files"
 WEB_PATH = f"/_addons/{ADDON_PACKAGE}/user_files"